@@ -0,0 +1,379 @@
+"""
+action_log.py
+
+Structured journal of what the organizer did, written off the hot path:
+- Scans, suggestions and applied moves/deletes are recorded as JSON lines
+  by a background thread; record() only puts a dict on a queue
+- Files rotate by size and rotated segments are gzip-compressed; the
+  oldest are removed beyond `keep`
+- A SQLite index of the key fields (time, event, source, target, name)
+  answers "where did X go" and "what happened in the last day" without
+  reading the journal itself
+- Log lines go through a QueueHandler as well, so writing logs/actions.log
+  and the console never blocks the caller
+
+Query it with: python action_log.py where <name or path> | recent [1d]
+"""
+import argparse
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+DEFAULT_LOG_DIR = '~/.cache/auto_file_organizer/actions'
+DEFAULT_MAX_MB = 50
+DEFAULT_KEEP = 20
+LOG_FORMAT = '%(asctime)s %(levelname)s: %(message)s'
+
+# Records written per batch by the background thread
+WRITE_BATCH = 1000
+# Hops followed when a file was moved several times
+MAX_HOPS = 20
+
+_DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+class ActionLog:
+    """
+    Background JSONL writer with rotation, compression and a query index.
+    record() is a no-op until start() is called, so library code can record
+    unconditionally.
+    """
+    def __init__(self):
+        self.directory = None
+        self._queue = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self._thread is not None
+
+    def start(self, directory: str = DEFAULT_LOG_DIR, max_bytes: int = DEFAULT_MAX_MB * 1024 * 1024,
+              keep: int = DEFAULT_KEEP, compress: bool = True, name: str = 'main') -> None:
+        """
+        Start the background writer.
+
+        :param directory: Folder for the journal segments and index.sqlite
+        :param max_bytes: Size at which the current segment is rotated
+        :param keep: Rotated segments kept per process
+        :param compress: gzip rotated segments
+        :param name: Process name; each process writes its own segment file
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.directory = Path(directory).expanduser()
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self.max_bytes = max_bytes
+            self.keep = keep
+            self.compress = compress
+            self.name = name
+            self._queue = queue.SimpleQueue()
+            self._thread = threading.Thread(target=self._run, name='action-log', daemon=True)
+            self._thread.start()
+
+    def record(self, event: str, **fields) -> None:
+        """Queue one event; never blocks on I/O."""
+        if self._queue is not None:
+            fields['event'] = event
+            fields['ts'] = time.time()
+            self._queue.put(fields)
+
+    def flush(self) -> None:
+        """Block until every event recorded so far is written and indexed."""
+        if self._queue is not None:
+            done = threading.Event()
+            self._queue.put(done)
+            done.wait()
+
+    def close(self) -> None:
+        """Write what is queued and stop the background thread."""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._queue = None
+
+    # --- background thread ---
+
+    @property
+    def current_path(self) -> Path:
+        return self.directory / f"actions.{self.name}.jsonl"
+
+    def _run(self) -> None:
+        index = open_index(self.directory)
+        stream = open(self.current_path, 'a', encoding='utf-8')
+        try:
+            while True:
+                batch = [self._queue.get()]
+                while len(batch) < WRITE_BATCH:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                records = [item for item in batch if isinstance(item, dict)]
+                if records:
+                    try:
+                        self._write(stream, index, records)
+                        if stream.tell() >= self.max_bytes:
+                            stream.close()
+                            self._rotate(index)
+                            stream = open(self.current_path, 'a', encoding='utf-8')
+                    except Exception as e:  # never take the organizer down with the journal
+                        logging.error(f"Could not write the action log: {e}")
+                for item in batch:
+                    if isinstance(item, threading.Event):
+                        item.set()
+                if any(item is None for item in batch):
+                    return
+        finally:
+            stream.close()
+            index.close()
+
+    def _write(self, stream, index, records: list) -> None:
+        stream.write(''.join(json.dumps(r, default=str, ensure_ascii=False) + '\n' for r in records))
+        stream.flush()
+        segment = self.current_path.name
+        index.executemany(
+            "INSERT INTO events (ts, event, path, dst, name, status, segment) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(r['ts'], r['event'], r.get('path'), r.get('dst'),
+              os.path.basename(r['path']) if r.get('path') else None, r.get('status'), segment)
+             for r in records]
+        )
+        index.commit()
+
+    def _rotate(self, index) -> None:
+        stamp = time.strftime('%Y%m%dT%H%M%S')
+        rotated = self.directory / f"actions.{self.name}.{stamp}.jsonl"
+        n = 1
+        while rotated.exists() or Path(str(rotated) + '.gz').exists():
+            rotated = self.directory / f"actions.{self.name}.{stamp}-{n}.jsonl"
+            n += 1
+        os.replace(self.current_path, rotated)
+        if self.compress:
+            with open(rotated, 'rb') as src, gzip.open(str(rotated) + '.gz', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.unlink(rotated)
+            rotated = Path(str(rotated) + '.gz')
+        index.execute("UPDATE events SET segment = ? WHERE segment = ?",
+                      (rotated.name, self.current_path.name))
+        # Drop the oldest segments of this process beyond keep, and their index rows
+        segments = sorted(p for p in self.directory.glob(f"actions.{self.name}.*.jsonl*"))
+        for old in segments[:max(0, len(segments) - self.keep)]:
+            old.unlink()
+            index.execute("DELETE FROM events WHERE segment = ?", (old.name,))
+        index.commit()
+
+
+def open_index(directory) -> sqlite3.Connection:
+    """Open (creating if needed) the SQLite index of an action log folder."""
+    conn = sqlite3.connect(str(Path(directory).expanduser() / 'index.sqlite'), timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS events ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " ts REAL NOT NULL,"
+        " event TEXT NOT NULL,"
+        " path TEXT,"
+        " dst TEXT,"
+        " name TEXT,"
+        " status TEXT,"
+        " segment TEXT NOT NULL)"
+    )
+    for column in ('ts', 'path', 'dst', 'name'):
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_events_{column} ON events({column})")
+    conn.commit()
+    return conn
+
+
+def _row(row) -> dict:
+    return dict(zip(('ts', 'event', 'path', 'dst', 'status'), row))
+
+
+def where(directory, query: str) -> list:
+    """
+    Answer "where did this file go": the moves of files whose path or name
+    is `query`, each followed through later moves of its new location.
+
+    :returns: One list of move records per file found, oldest first; for a
+        file that was deleted rather than moved, its delete record
+    """
+    conn = open_index(directory)
+    try:
+        column = 'path' if os.sep in query or '/' in query else 'name'
+        starts = conn.execute(
+            f"SELECT ts, event, path, dst, status FROM events"
+            f" WHERE {column} = ? AND event = 'move' AND status = 'done' ORDER BY ts",
+            (query,)
+        ).fetchall()
+        trails = []
+        for start in starts:
+            trail = [_row(start)]
+            while len(trail) < MAX_HOPS:
+                nxt = conn.execute(
+                    "SELECT ts, event, path, dst, status FROM events"
+                    " WHERE path = ? AND event = 'move' AND status = 'done' AND ts > ? ORDER BY ts LIMIT 1",
+                    (trail[-1]['dst'], trail[-1]['ts'])
+                ).fetchone()
+                if nxt is None:
+                    break
+                trail.append(_row(nxt))
+            trails.append(trail)
+        if not starts:
+            # Not moved: it may have been deleted
+            rows = conn.execute(
+                f"SELECT ts, event, path, dst, status FROM events"
+                f" WHERE {column} = ? AND event = 'delete' ORDER BY ts", (query,)
+            ).fetchall()
+            trails = [[_row(row)] for row in rows]
+        return trails
+    finally:
+        conn.close()
+
+
+def recent(directory, seconds: float, event: Optional[str] = None, now: float = None) -> list:
+    """
+    Return the indexed events of the last `seconds`, oldest first,
+    optionally only those of one type (e.g. 'move').
+    """
+    now = time.time() if now is None else now
+    conn = open_index(directory)
+    try:
+        sql = "SELECT ts, event, path, dst, status FROM events WHERE ts >= ?"
+        params = [now - seconds]
+        if event:
+            sql += " AND event = ?"
+            params.append(event)
+        return [_row(row) for row in conn.execute(sql + " ORDER BY ts", params)]
+    finally:
+        conn.close()
+
+
+def parse_duration(text: str) -> float:
+    """Parse '90', '15m', '12h', '1d' or '2w' into seconds."""
+    text = text.strip().lower()
+    if text and text[-1] in _DURATION_UNITS:
+        return float(text[:-1]) * _DURATION_UNITS[text[-1]]
+    return float(text)
+
+
+def log_suggestion(file_meta: dict, suggestion: dict, prefix: str = '') -> None:
+    """
+    Log one file's suggestion (as a log line and a structured event).
+    """
+    if 'duplicate_of' in suggestion:
+        logging.info(f"{prefix}File: {file_meta['name']} | Duplicate of {suggestion['duplicate_of']} | Delete? True")
+    else:
+        logging.info(
+            f"{prefix}File: {file_meta['name']} | "
+            f"Rename → {suggestion.get('suggested_name')} | "
+            f"Move → {suggestion.get('suggested_folder')} | "
+            f"Delete? {suggestion.get('delete')}"
+        )
+    source = ('rule' if 'rule' in suggestion else 'similar' if 'similar_to' in suggestion
+              else 'duplicate' if 'duplicate_of' in suggestion else 'llm')
+    action_log.record(
+        'suggestion', path=file_meta['path'], suggested_name=suggestion.get('suggested_name'),
+        suggested_folder=suggestion.get('suggested_folder'), delete=bool(suggestion.get('delete')),
+        source=source
+    )
+
+
+def configure_logging(log_file: str = 'logs/actions.log', fmt: str = LOG_FORMAT):
+    """
+    Send log records through a queue to the file and console handlers, which
+    a background listener writes. Returns the started QueueListener.
+    """
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(
+        log_queue, logging.FileHandler(log_file), logging.StreamHandler()
+    )
+    for handler in listener.handlers:
+        handler.setFormatter(logging.Formatter(fmt))
+    # The listener's handlers format each record; the queue side passes the message through
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
+    listener.start()
+    return listener
+
+
+def get_action_log_options(config: dict) -> dict:
+    """
+    Return the `action_log` section of config.yaml as keyword arguments for
+    ActionLog.start, or {} if the journal is disabled.
+    """
+    options = config.get('action_log') or {}
+    if not options.get('enabled', True):
+        return {}
+    return {
+        'directory': options.get('directory', DEFAULT_LOG_DIR),
+        'max_bytes': int(options.get('max_mb', DEFAULT_MAX_MB) * 1024 * 1024),
+        'keep': options.get('keep', DEFAULT_KEEP),
+        'compress': options.get('compress', True)
+    }
+
+
+def load_action_log(config: dict, name: str = 'main') -> 'ActionLog':
+    """
+    Start the shared action log as configured in config.yaml and return it.
+    """
+    options = get_action_log_options(config)
+    if options:
+        action_log.start(name=name, **options)
+    return action_log
+
+
+# Shared journal used by every module
+action_log = ActionLog()
+
+
+def _format(row: dict) -> str:
+    when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row['ts']))
+    if row['event'] == 'move':
+        return f"{when} move {row['path']} -> {row['dst']} ({row['status']})"
+    return f"{when} {row['event']} {row['path'] or ''} {row['status'] or ''}".rstrip()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Query the structured action log")
+    parser.add_argument("-c", "--config", default="config.yaml", help="Path to YAML configuration file")
+    commands = parser.add_subparsers(dest='command', required=True)
+    where_cmd = commands.add_parser('where', help="Show where a file went")
+    where_cmd.add_argument('file', help="File name or original path")
+    recent_cmd = commands.add_parser('recent', help="List recent events")
+    recent_cmd.add_argument('period', nargs='?', default='1d', help="e.g. 30m, 12h, 1d (default 1d)")
+    recent_cmd.add_argument('--event', help="Only this event type (scan, suggestion, move, delete, ...)")
+    args = parser.parse_args(argv)
+
+    from file_scanner import load_config
+    config = load_config(args.config) if os.path.exists(args.config) else {}
+    directory = (config.get('action_log') or {}).get('directory', DEFAULT_LOG_DIR)
+    if args.command == 'where':
+        trails = where(directory, args.file)
+        if not trails:
+            print(f"No moves or deletes recorded for {args.file}")
+        for trail in trails:
+            for row in trail:
+                print(_format(row))
+            if len(trails) > 1:
+                print()
+    else:
+        for row in recent(directory, parse_duration(args.period), event=args.event):
+            print(_format(row))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -10,13 +10,16 @@ load_dotenv()  # load OPENAI_API_KEY from .env
 
 from langchain_community.chat_models import ChatOpenAI
 from langchain.agents import initialize_agent, Tool, AgentType
-from file_scanner import load_config, scan_directories
-from organizer import suggest_actions
-from utils import apply_suggestion
+from agent_tools import AgentSession, get_agent_options
+from file_scanner import load_config
+from organizer import configure_llm
 
 # Load configuration
 config = load_config()
-root_folder = config.get('root_folder')
+configure_llm(config)
+
+# One scan snapshot per session; tools exchange short file handles (f1, f2, ...)
+session = AgentSession(config, **get_agent_options(config))
 
 # Initialize LLM
 api_key = os.getenv("OPENAI_API_KEY")
@@ -29,20 +32,27 @@ llm = ChatOpenAI(
 tools = [
     Tool(
         name="scan_files",
-        func=lambda _: scan_directories(config),
-        description="Scan configured directories and return a list of file metadata dicts."
+        func=session.scan_files,
+        description=(
+            "List the files in the monitored folders, one page at a time, as handles "
+            "(f1, f2, ...) with name, size and folder. Input: optional 'page=N', "
+            "'ext=.pdf', 'name=<text>', or 'refresh' to re-scan."
+        )
+    ),
+    Tool(
+        name="file_details",
+        func=session.file_details,
+        description="Show path, size, dates and a short content preview for handles, e.g. 'f1, f4-f6'."
     ),
     Tool(
         name="suggest_actions",
-        func=lambda metadata: suggest_actions(metadata),
-        description="Given file metadata, return a JSON dict with suggested_name, suggested_folder, and delete flag."
+        func=session.suggest_actions,
+        description="Suggest a new name and folder (or deletion) for a batch of handles, e.g. 'f1-f20'."
     ),
     Tool(
         name="apply_suggestion",
-        func=lambda metadata, suggestion: apply_suggestion(
-            metadata, suggestion, root_folder=root_folder, auto_confirm=True
-        ),
-        description="Apply a suggestion to the file system (rename/move/delete)."
+        func=session.apply_suggestion,
+        description="Apply the suggestions for a batch of handles (rename/move/delete), e.g. 'f1-f20, f25'."
     )
 ]
 
@@ -60,6 +70,7 @@ if __name__ == '__main__':
         user_input = input(">> ")
         if user_input.lower() in ('exit', 'quit'):
             print("Goodbye!")
+            session.close()
             break
         try:
             result = agent.run(user_input)
@@ -0,0 +1,272 @@
+"""
+agent_tools.py
+
+Tool implementations behind the LangChain agent in agent.py, shaped for an
+LLM's context window:
+- One scan snapshot per session (paths and stat only), held in a
+  memory-mapped snapshot.Snapshot rather than a list of stat results;
+  previews are read only for files the agent asks about, and dropped once
+  the file has a suggestion (read again if the agent asks once more)
+- Files are referred to by short handles (f1, f2, ...); listings are
+  paginated summaries of one line per file
+- Suggestions and applies take batches of handles ("f1-f20, f31") and run
+  through the same pipeline and plan executor as main.py
+"""
+import os
+import re
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from decision_index import load_decision_index
+from file_scanner import fill_previews, iter_entries
+from pipeline import get_batching, get_concurrency, suggest_many
+from plan import PlanJournal, build_plan, execute_plan, get_journal_options
+from rate_limiter import load_limiter
+from rules import load_rules
+from snapshot import Snapshot, write_snapshot
+from suggestion_cache import load_cache
+
+DEFAULT_PAGE_SIZE = 20
+DEFAULT_PREVIEW_CHARS = 200
+# Handles accepted per suggest/apply call, to keep each tool call bounded
+MAX_BATCH = 200
+
+_HANDLE = re.compile(r'\bf(\d+)(?:\s*-\s*f?(\d+))?', re.IGNORECASE)
+
+
+def _size(n: int) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024 or unit == 'GB':
+            return f"{n:.0f} {unit}" if unit == 'B' else f"{n:.1f} {unit}"
+        n /= 1024
+
+
+def parse_handles(text: str, limit: int = MAX_BATCH) -> list:
+    """
+    Parse handles like "f1, f3 f7-f9" into [1, 3, 7, 8, 9] (ranges included),
+    stopping after `limit` handles so a range like "f1-f999999999" stays cheap.
+    """
+    numbers = {}
+    for match in _HANDLE.finditer(text or ''):
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else start
+        for n in range(start, min(end, start + limit - 1) + 1):
+            numbers[n] = None
+            if len(numbers) >= limit:
+                return list(numbers)
+    return list(numbers)
+
+
+def _options(text: str) -> dict:
+    # "page=2 ext=.pdf" -> {'page': '2', 'ext': '.pdf'}
+    return dict(part.split('=', 1) for part in (text or '').split() if '=' in part)
+
+
+class AgentSession:
+    """
+    State shared by the agent's tools for one session: the scan snapshot,
+    metadata read so far and the suggestions made.
+    """
+    def __init__(self, config: dict, page_size: int = DEFAULT_PAGE_SIZE,
+                 preview_chars: int = DEFAULT_PREVIEW_CHARS):
+        self.config = config
+        self.page_size = page_size
+        self.preview_chars = preview_chars
+        self._snapshot = None    # handle number - 1 -> entry index
+        self._tmpdir = None
+        self._taken_at = None
+        self._meta = {}          # handle number -> metadata dict
+        self._suggestions = {}   # handle number -> suggestion dict
+        self._applied = set()
+        self._services = None
+
+    # --- snapshot ---
+
+    def snapshot(self, refresh: bool = False) -> Snapshot:
+        """Return the session's Snapshot, scanning on first use or refresh."""
+        if self._snapshot is None or refresh:
+            if self._snapshot is not None:
+                self._snapshot.close()
+            if self._tmpdir is None:
+                self._tmpdir = tempfile.TemporaryDirectory(prefix='agent-snapshot-')
+            path = os.path.join(self._tmpdir.name, 'listing.snap')
+            write_snapshot(path, iter_entries(self.config))
+            self._snapshot = Snapshot(path)
+            self._taken_at = time.time()
+            self._meta.clear()
+            self._suggestions.clear()
+            self._applied.clear()
+        return self._snapshot
+
+    def close(self) -> None:
+        """Close the snapshot and remove its file."""
+        if self._snapshot is not None:
+            self._snapshot.close()
+            self._snapshot = None
+        if self._tmpdir is not None:
+            self._tmpdir.cleanup()
+            self._tmpdir = None
+
+    def _lookup(self, numbers: list) -> tuple:
+        count = len(self.snapshot())
+        valid = [n for n in numbers if 1 <= n <= count]
+        invalid = [n for n in numbers if not 1 <= n <= count]
+        return valid, invalid
+
+    def metadata(self, numbers: list) -> dict:
+        """Return {handle number: metadata} with previews, reading only those not in memory."""
+        snapshot = self.snapshot()
+        for n in numbers:
+            if n not in self._meta:
+                self._meta[n] = snapshot[n - 1]
+        unread = [self._meta[n] for n in numbers if not self._meta[n].preview_loaded]
+        if unread:
+            fill_previews(self.config, unread)
+        return {n: self._meta[n] for n in numbers}
+
+    # --- tools ---
+
+    def scan_files(self, text: str = '') -> str:
+        """
+        Tool: paginated listing of the snapshot.
+        Input: optional "page=N", "ext=.pdf", "name=<substring>" and "refresh".
+        """
+        options = _options(text)
+        try:
+            page = int(options.get('page', 1))
+        except ValueError:
+            return f"Bad page {options['page']!r}: use a number, e.g. \"page=2\"."
+        snapshot = self.snapshot(refresh='refresh' in (text or '').split())
+        ext = options.get('ext', '').lower()
+        name = options.get('name', '').lower()
+        # One pass over the name column; records are only built for the page shown
+        rows = []
+        extensions = Counter()
+        for i in range(len(snapshot)):
+            file_name = snapshot.name(i)
+            suffix = os.path.splitext(file_name)[1].lower()
+            extensions[suffix or '(none)'] += 1
+            if (not ext or suffix == ext) and (not name or name in file_name.lower()):
+                rows.append(i + 1)
+        pages = max(1, -(-len(rows) // self.page_size))
+        page = min(max(1, page), pages)
+        start = (page - 1) * self.page_size
+
+        lines = [
+            f"{len(snapshot)} files in the snapshot taken "
+            f"{time.strftime('%H:%M:%S', time.localtime(self._taken_at))}; "
+            f"most common types: " + ', '.join(f"{e} {c}" for e, c in extensions.most_common(5)),
+            f"{len(rows)} match; page {page}/{pages}:"
+        ]
+        for n in rows[start:start + self.page_size]:
+            record = snapshot[n - 1]
+            state = ' [applied]' if n in self._applied else ''
+            folder = os.path.basename(os.path.dirname(record.path))
+            lines.append(f"f{n} {record.name} ({_size(record.size_bytes)}, {folder}){state}")
+        if page < pages:
+            lines.append(f"Next: scan_files \"page={page + 1}\". Details: file_details \"f1, f2\".")
+        return '\n'.join(lines)
+
+    def file_details(self, text: str) -> str:
+        """
+        Tool: metadata and a short preview for up to page_size handles.
+        """
+        numbers, invalid = self._lookup(parse_handles(text, self.page_size))
+        lines = []
+        for n, meta in self.metadata(numbers).items():
+            preview = ' '.join((meta.get('preview') or '').split())[:self.preview_chars]
+            lines.append(
+                f"f{n} {meta['name']} | {meta['path']} | {_size(meta['size_bytes'])} | "
+                f"modified {meta['modified_time'][:16]} | preview: {preview or '(none)'}"
+            )
+        if invalid:
+            lines.append("Unknown handles: " + ', '.join(f"f{n}" for n in invalid))
+        return '\n'.join(lines) or "No handles given, e.g. \"f1, f2-f5\"."
+
+    def suggest_actions(self, text: str) -> str:
+        """
+        Tool: suggestions for a batch of handles, one line each.
+        """
+        numbers, invalid = self._lookup(parse_handles(text))
+        self._suggest(numbers)
+        lines = [self._describe(n) for n in numbers]
+        if invalid:
+            lines.append("Unknown handles: " + ', '.join(f"f{n}" for n in invalid))
+        return '\n'.join(lines) or "No handles given, e.g. \"f1, f2-f5\"."
+
+    def apply_suggestion(self, text: str) -> str:
+        """
+        Tool: apply the suggestions for a batch of handles as one plan.
+        Handles without a suggestion yet get one first.
+        """
+        numbers, invalid = self._lookup(parse_handles(text))
+        numbers = [n for n in numbers if n not in self._applied]
+        self._suggest(numbers)
+        waiting = [n for n in numbers if n not in self._suggestions]
+        numbers = [n for n in numbers if n in self._suggestions]
+        items = [(self._meta[n], self._suggestions[n]) for n in numbers]
+        if not items:
+            return "Nothing to apply." + (" The LLM is unavailable; try again later." if waiting else "")
+        plan = build_plan(items, root_folder=self.config.get('root_folder'))
+        options = get_journal_options(self.config)
+        journal = PlanJournal.create(**options) if options and len(plan) else None
+        moved = execute_plan(plan, journal, auto_confirm=True)
+        deleted = [n for n in numbers if self._suggestions[n].get('delete')
+                   and not Path(self._meta[n]['path']).exists()]
+        done = [n for n in numbers if self._meta[n]['path'] in moved] + deleted
+        self._applied.update(done)
+        failed = len(numbers) - len(done)
+        summary = f"Applied {len(done)} of {len(numbers)}: {len(done) - len(deleted)} moved, {len(deleted)} deleted"
+        if failed:
+            summary += f", {failed} unchanged (unchanged suggestion or error)"
+        if waiting:
+            summary += f", {len(waiting)} left for later (the LLM is unavailable)"
+        if invalid:
+            summary += ". Unknown handles: " + ', '.join(f"f{n}" for n in invalid)
+        return summary + '.'
+
+    # --- helpers ---
+
+    def _suggest(self, numbers: list) -> None:
+        missing = [n for n in numbers if n not in self._suggestions]
+        if not missing:
+            return
+        metas = self.metadata(missing)
+        cache, limiter, rules, decisions = self._load_services()
+        results = suggest_many(
+            [metas[n] for n in missing], cache=cache, limiter=limiter, rules=rules,
+            decisions=decisions, concurrency=get_concurrency(self.config),
+            **get_batching(self.config)
+        )
+        for n, (_, suggestion) in zip(missing, results):
+            if suggestion is not None:   # None: deferred, the LLM is unavailable
+                self._suggestions[n] = suggestion
+                self._meta[n].drop_preview()
+
+    def _load_services(self) -> tuple:
+        if self._services is None:
+            self._services = (load_cache(self.config), load_limiter(self.config),
+                              load_rules(self.config), load_decision_index(self.config))
+        return self._services
+
+    def _describe(self, n: int) -> str:
+        meta, suggestion = self._meta[n], self._suggestions.get(n)
+        if suggestion is None:
+            return f"f{n} {meta['name']} -> no suggestion: the LLM is unavailable, try again later"
+        if suggestion.get('delete'):
+            return f"f{n} {meta['name']} -> delete"
+        target = '/'.join(p for p in (suggestion.get('suggested_folder'), suggestion.get('suggested_name')) if p)
+        return f"f{n} {meta['name']} -> {target}"
+
+
+def get_agent_options(config: dict) -> dict:
+    """
+    Return the `agent` section of config.yaml as AgentSession keyword arguments.
+    """
+    options = config.get('agent') or {}
+    return {
+        'page_size': options.get('page_size', DEFAULT_PAGE_SIZE),
+        'preview_chars': options.get('preview_chars', DEFAULT_PREVIEW_CHARS)
+    }
@@ -0,0 +1,579 @@
+"""
+bench.py
+
+End-to-end benchmark for Auto File Organizer:
+- Generates a synthetic inbox of configurable size and mix (text, PDF, DOCX,
+  images, installers, duplicates)
+- Replaces the LLM backend in organizer with a local fake that answers
+  valid JSON after a configurable latency
+- Measures scan_directories, suggest_actions, apply_suggestion and the full
+  job(): files/sec, p50/p99 per-file latency and peak RSS per stage
+- Optionally compares how a large listing is held: the metadata dicts
+  scan_directories used to return, FileRecords, and a memory-mapped
+  snapshot (build time, traced memory, save and load time)
+- Writes the results as JSON and can compare them against an earlier run
+
+Usage:
+    python bench.py --files 500 --latency-ms 50 --output bench.json
+    python bench.py --files 500 --compare bench.json
+    python bench.py --files 100 --listing 1000000
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+DEFAULT_MIX = {
+    'text': 0.35,
+    'pdf': 0.15,
+    'docx': 0.1,
+    'image': 0.2,
+    'installer': 0.1,
+    'duplicate': 0.1,
+}
+
+WORDS = ('invoice report meeting notes budget resume draft project summary '
+         'contract receipt travel photo screenshot weekly quarterly vendor').split()
+
+# Relative slowdown (new/old) above which a stage is reported as a regression
+REGRESSION_THRESHOLD = 1.2
+
+
+# --- Synthetic inbox ---
+
+def _sentence(rng: random.Random, words: int = 40) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def _write_pdf(path: Path, text: str) -> None:
+    """Write a minimal one-page PDF containing text."""
+    text = text.replace('(', '').replace(')', '')
+    stream = f"BT /F1 12 Tf 72 712 Td ({text}) Tj ET".encode('latin-1')
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+        b"/Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    path.write_bytes(bytes(out))
+
+
+def _write_docx(path: Path, text: str) -> None:
+    """Write a minimal Word document containing one paragraph per sentence."""
+    paragraphs = ''.join(f'<w:p><w:r><w:t>{line}</w:t></w:r></w:p>' for line in text.split('. '))
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('[Content_Types].xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" ContentType="application/'
+            'vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            '</Types>'))
+        z.writestr('_rels/.rels', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+            'relationships/officeDocument" Target="word/document.xml"/>'
+            '</Relationships>'))
+        z.writestr('word/document.xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            f'<w:body>{paragraphs}</w:body></w:document>'))
+
+
+def _write_image(path: Path, rng: random.Random) -> None:
+    """Write a small PNG with some drawn text (or a plain PNG without PIL)."""
+    try:
+        from PIL import Image, ImageDraw
+    except ImportError:
+        import struct
+        import zlib
+        def chunk(kind, data):
+            return struct.pack('>I', len(data)) + kind + data + \
+                struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+        raw = b''.join(b'\x00' + bytes([rng.randrange(256)] * 3 * 64) for _ in range(64))
+        path.write_bytes(b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', 64, 64, 8, 2, 0, 0, 0))
+                         + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+        return
+    img = Image.new('RGB', (640, 360), 'white')
+    ImageDraw.Draw(img).text((20, 20), _sentence(rng, 8), fill='black')
+    img.save(path)
+
+
+def make_inbox(root: Path, files: int, mix: dict = None, seed: int = 0) -> Path:
+    """
+    Create a synthetic inbox folder with `files` files in the given mix.
+
+    :param root: Directory in which the `inbox` folder is created
+    :param files: Number of files to create
+    :param mix: {kind: fraction} with kinds text, pdf, docx, image, installer, duplicate
+    :param seed: Random seed, so runs with the same arguments are comparable
+    :returns: Path of the inbox folder
+    """
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    inbox = root / 'inbox'
+    inbox.mkdir(parents=True, exist_ok=True)
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    created = []
+    for i in range(files):
+        kind = rng.choices(kinds, weights)[0]
+        stem = f"{rng.choice(WORDS)}_{i:06d}"
+        if kind == 'duplicate' and created:
+            original = rng.choice(created)
+            path = inbox / f"{original.stem} (copy {i}){original.suffix}"
+            shutil.copyfile(original, path)
+            continue
+        if kind == 'pdf':
+            path = inbox / f"{stem}.pdf"
+            _write_pdf(path, _sentence(rng))
+        elif kind == 'docx':
+            path = inbox / f"{stem}.docx"
+            _write_docx(path, _sentence(rng, 80))
+        elif kind == 'image':
+            path = inbox / f"IMG_{i:04d}.png"
+            _write_image(path, rng)
+        elif kind == 'installer':
+            path = inbox / f"{stem}_setup.{rng.choice(['dmg', 'exe', 'pkg', 'msi'])}"
+            path.write_bytes(os.urandom(rng.randrange(1024, 64 * 1024)))
+        else:
+            path = inbox / f"{stem}.txt"
+            path.write_text(_sentence(rng, 120))
+        created.append(path)
+    return inbox
+
+
+# --- Stand-in LLM ---
+
+def _fake_reply(prompt: str) -> str:
+    """Answer a single-file or batched prompt with valid JSON."""
+    if 'Files (JSON array' in prompt:
+        ids = [int(i) for i in re.findall(r'"id": (\d+)', prompt)]
+        names = re.findall(r'"name": "([^"]*)"', prompt)
+        return json.dumps([
+            {'id': item_id, 'suggested_name': name.lower().replace(' ', '_'),
+             'suggested_folder': 'bench/batched', 'delete': False}
+            for item_id, name in zip(ids, names)
+        ])
+    found = re.search(r'Name: (.*)', prompt)
+    name = found.group(1).strip() if found else 'file'
+    return json.dumps({'suggested_name': name.lower().replace(' ', '_'),
+                       'suggested_folder': 'bench/single', 'delete': False})
+
+
+def install_fake_llm(latency: float = 0.05):
+    """
+    Replace the LLM backend in organizer with a local fake that sleeps
+    `latency` seconds per request. Chains are rebuilt on next use.
+    """
+    import organizer
+    from llm_backend import PromptChain
+
+    class FakeBackend:
+        def chain(self, template: str) -> PromptChain:
+            return PromptChain(self, template)
+
+        def complete(self, prompt: str) -> str:
+            time.sleep(latency)
+            return _fake_reply(prompt)
+
+        def close(self) -> None:
+            pass
+
+    organizer.reset_chains()
+    organizer.backend = FakeBackend()
+    return organizer.backend
+
+
+# --- Measurements ---
+
+def _peak_rss_mb() -> float:
+    """
+    Return the process's peak RSS so far in MB. Stages run in order, so each
+    stage reports the high-water mark up to and including itself.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _percentile(values: list, pct: float) -> float:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(count: int, seconds: float, latencies: list = None) -> dict:
+    """Build the result dict for one stage."""
+    latencies = latencies or []
+    return {
+        'files': count,
+        'seconds': round(seconds, 4),
+        'files_per_sec': round(count / seconds, 2) if seconds > 0 else None,
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 3) if latencies else None,
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 3) if latencies else None,
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+
+def _timed_iter(iterable, latencies: list):
+    """Yield from iterable, recording the time taken to produce each item."""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        latencies.append(time.perf_counter() - start)
+        yield item
+
+
+def bench_scan(config: dict) -> tuple:
+    # iter_files is the streaming scanner behind scan_directories
+    from file_scanner import iter_files
+    latencies = []
+    start = time.perf_counter()
+    files = list(_timed_iter(iter_files(config), latencies))
+    return files, summarize(len(files), time.perf_counter() - start, latencies)
+
+
+def bench_suggest(files: list) -> tuple:
+    from organizer import suggest_actions
+    latencies, suggestions = [], []
+    start = time.perf_counter()
+    for file_meta in files:
+        t = time.perf_counter()
+        suggestions.append(suggest_actions(file_meta))
+        latencies.append(time.perf_counter() - t)
+    return suggestions, summarize(len(files), time.perf_counter() - start, latencies)
+
+
+def bench_apply(files: list, suggestions: list, root_folder: str) -> dict:
+    from utils import apply_suggestion
+    latencies = []
+    start = time.perf_counter()
+    for file_meta, suggestion in zip(files, suggestions):
+        t = time.perf_counter()
+        apply_suggestion(file_meta, suggestion, root_folder=root_folder, auto_confirm=True)
+        latencies.append(time.perf_counter() - t)
+    return summarize(len(files), time.perf_counter() - start, latencies)
+
+
+def bench_job(config: dict, count: int) -> dict:
+    from main import job
+    from duplicates import load_hash_index
+    from file_index import FileIndex
+    from suggestion_cache import SuggestionCache
+    # Built even if the overrides disable them: job() is measured with both
+    cache = SuggestionCache(path=config['cache']['path'])
+    index = FileIndex(path=config['index']['path'])
+    hash_index = load_hash_index(config)
+    start = time.perf_counter()
+    job(config, cache=cache, index=index, hash_index=hash_index)
+    return summarize(count, time.perf_counter() - start)
+
+
+# --- Listing memory: dicts vs FileRecords vs snapshot ---
+
+class _Stat:
+    """Minimal stand-in for os.stat_result, so listings need no real files."""
+    __slots__ = ('st_size', 'st_mtime_ns', 'st_ctime_ns', 'st_ino', 'st_mtime', 'st_ctime')
+
+    def __init__(self, i: int):
+        self.st_size = 1024 + i % 100000
+        self.st_mtime_ns = 1_700_000_000_000_000_000 + i * 1_000_003
+        self.st_ctime_ns = self.st_mtime_ns - 86_400_000_000_000
+        self.st_ino = 10_000_000 + i
+        self.st_mtime = self.st_mtime_ns / 1e9
+        self.st_ctime = self.st_ctime_ns / 1e9
+
+
+def synthetic_entries(count: int, per_folder: int = 1000) -> list:
+    """(path, stat) pairs shaped like an archive share: per_folder files per folder."""
+    return [(f"/archive/{2000 + i // 500000}/project_{i // per_folder:05d}/"
+             f"{WORDS[i % len(WORDS)]}_{i:08d}.pdf", _Stat(i)) for i in range(count)]
+
+
+def _legacy_metadata(path: str, stat) -> dict:
+    """The metadata dict get_file_metadata built before FileRecord (preview not read)."""
+    from datetime import datetime
+    return {
+        'path': path,
+        'name': os.path.basename(path),
+        'size_bytes': stat.st_size,
+        'modified_time': datetime.fromtimestamp(stat.st_mtime).isoformat(),
+        'created_time': datetime.fromtimestamp(stat.st_ctime).isoformat(),
+        'inode': stat.st_ino,
+        'mtime_ns': stat.st_mtime_ns,
+        'preview': ''
+    }
+
+
+def _traced(func):
+    """Return (result, seconds, bytes still allocated by func's result)."""
+    import gc
+    import tracemalloc
+    gc.collect()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    del result
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func()
+        allocated = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return result, seconds, allocated
+
+
+def bench_listing(count: int, workdir: Path) -> dict:
+    """
+    Hold a listing of `count` entries as dicts, as FileRecords and as a
+    snapshot, and measure each. Paths are synthetic, so no files are created.
+    """
+    import pickle
+    from file_record import FileRecord
+    from snapshot import Snapshot, write_snapshot
+    entries = synthetic_entries(count)
+    results = {'entries': count}
+
+    dicts, seconds, allocated = _traced(lambda: [_legacy_metadata(p, st) for p, st in entries])
+    saved = workdir / 'listing.pickle'
+    start = time.perf_counter()
+    saved.write_bytes(pickle.dumps(dicts, protocol=pickle.HIGHEST_PROTOCOL))
+    save_seconds = time.perf_counter() - start
+    del dicts
+    start = time.perf_counter()
+    loaded = pickle.loads(saved.read_bytes())
+    load_seconds = time.perf_counter() - start
+    del loaded
+    results['dict_list'] = {'build_seconds': round(seconds, 4), 'memory_mb': round(allocated / 2 ** 20, 1),
+                            'save_seconds': round(save_seconds, 4), 'load_seconds': round(load_seconds, 4),
+                            'file_mb': round(saved.stat().st_size / 2 ** 20, 1)}
+
+    records, seconds, allocated = _traced(lambda: [FileRecord.from_stat(p, st) for p, st in entries])
+    del records
+    results['file_records'] = {'build_seconds': round(seconds, 4), 'memory_mb': round(allocated / 2 ** 20, 1)}
+
+    path = workdir / 'listing.snap'
+    start = time.perf_counter()
+    write_snapshot(path, entries)
+    save_seconds = time.perf_counter() - start
+    snapshot, load_seconds, allocated = _traced(lambda: Snapshot(path))
+    start = time.perf_counter()
+    total = sum(record.size_bytes for record in snapshot)
+    iterate_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    probe = entries[count // 2][0]
+    found = snapshot.find(probe)
+    find_seconds = time.perf_counter() - start
+    assert total == sum(st.st_size for _, st in entries) and snapshot.path_of(found) == probe
+    snapshot.close()
+    results['snapshot'] = {'save_seconds': round(save_seconds, 4), 'load_seconds': round(load_seconds, 6),
+                           'memory_mb': round(allocated / 2 ** 20, 2),
+                           'file_mb': round(path.stat().st_size / 2 ** 20, 1),
+                           'iterate_seconds': round(iterate_seconds, 4),
+                           'find_ms': round(find_seconds * 1000, 3)}
+    return results
+
+
+def _quietly(func, *args):
+    """Run func with stdout and INFO logging silenced (apply_suggestion prints)."""
+    import contextlib
+    import io
+    previous = logging.getLogger().level
+    logging.getLogger().setLevel(logging.WARNING)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return func(*args)
+    finally:
+        logging.getLogger().setLevel(previous)
+
+
+def _isolated(config: dict, state: Path) -> dict:
+    """
+    Return config with every persistent store (journal, caches, indexes,
+    action log) moved into a fresh `state` folder, so a benchmark neither
+    touches the user's ~/.cache nor measures hits left by an earlier run.
+    """
+    shutil.rmtree(state, ignore_errors=True)
+
+    def section(name: str, **paths) -> dict:
+        return dict(config.get(name) or {}, **{key: str(state / value) for key, value in paths.items()})
+
+    preview = dict(config.get('preview') or {})
+    preview['ocr'] = dict(preview.get('ocr') or {}, cache_path=str(state / 'ocr.sqlite'))
+    return dict(
+        config,
+        plan=section('plan', journal_dir='journal'),
+        cache=section('cache', path='cache.sqlite'),
+        index=section('index', path='index.sqlite'),
+        duplicates=section('duplicates', index_path='hashes.sqlite'),
+        similar=section('similar', path='decisions.sqlite'),
+        action_log=section('action_log', directory='actions'),
+        preview=preview
+    )
+
+
+def run_benchmark(files: int = 200, latency: float = 0.05, mix: dict = None, seed: int = 0,
+                  config_overrides: dict = None, workdir: str = None, listing: int = 0) -> dict:
+    """
+    Run every stage on fresh synthetic inboxes and return the results dict.
+
+    :param files: Number of files in each synthetic inbox
+    :param latency: Seconds the fake LLM waits per request
+    :param mix: {kind: fraction} of generated files (see DEFAULT_MIX)
+    :param seed: Random seed for the generated inbox
+    :param config_overrides: Extra config.yaml sections (e.g. llm, preview)
+    :param workdir: Directory for the synthetic trees; a temporary one if None
+    :param listing: Entries in the listing memory comparison; skipped if 0
+    """
+    install_fake_llm(latency)
+    base = Path(workdir or tempfile.mkdtemp(prefix='afo_bench_'))
+    try:
+        # Stages on one inbox: scan -> suggest -> apply
+        inbox = make_inbox(base / 'stages', files, mix, seed)
+        config = {'monitor_folders': [str(inbox)], 'root_folder': str(base / 'stages' / 'organized'),
+                  'auto_confirm': True, **(config_overrides or {})}
+        config = _isolated(config, base / 'stages' / 'state')
+        results = {}
+        scanned, results['scan_directories'] = bench_scan(config)
+        suggestions, results['suggest_actions'] = bench_suggest(scanned)
+        results['apply_suggestion'] = _quietly(bench_apply, scanned, suggestions, config['root_folder'])
+
+        # Full job() on a fresh copy of the same inbox, with fresh cache and index
+        inbox = make_inbox(base / 'job', files, mix, seed)
+        job_config = _isolated(dict(config, monitor_folders=[str(inbox)],
+                                    root_folder=str(base / 'job' / 'organized')),
+                               base / 'job' / 'state')
+        results['job'] = _quietly(bench_job, job_config, files)
+        listing_results = bench_listing(listing, base) if listing else None
+    finally:
+        if workdir is None:
+            shutil.rmtree(base, ignore_errors=True)
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {'files': files, 'latency_ms': latency * 1000, 'seed': seed,
+                       'mix': mix or DEFAULT_MIX, 'config': config_overrides or {}},
+        'stages': results,
+        **({'listing': listing_results} if listing_results else {}),
+    }
+
+
+def compare(current: dict, previous: dict, threshold: float = REGRESSION_THRESHOLD) -> list:
+    """
+    Compare two result dicts. Returns a list of (stage, old_fps, new_fps, regressed).
+    """
+    rows = []
+    for stage, result in current['stages'].items():
+        old = previous.get('stages', {}).get(stage, {}).get('files_per_sec')
+        new = result.get('files_per_sec')
+        regressed = bool(old and new and old / new > threshold)
+        rows.append((stage, old, new, regressed))
+    return rows
+
+
+def parse_mix(text: str) -> dict:
+    """Parse 'text=0.5,pdf=0.2' into a mix dict."""
+    mix = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        if kind.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown file kind: {kind}")
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+def _cell(value, digits: int = 2) -> str:
+    return '-' if value is None else f"{value:.{digits}f}"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Auto File Organizer benchmark")
+    parser.add_argument("--files", type=int, default=200, help="Files per synthetic inbox")
+    parser.add_argument("--latency-ms", type=float, default=50, help="Fake LLM latency per request")
+    parser.add_argument("--mix", type=parse_mix, help="File mix, e.g. text=0.5,pdf=0.2,image=0.3")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic inbox")
+    parser.add_argument("--concurrency", type=int, help="llm.concurrency for the job() stage")
+    parser.add_argument("--batch-size", type=int, help="llm.batch_size for the job() stage")
+    parser.add_argument("--preview-workers", type=int, help="preview.workers for scanning")
+    parser.add_argument("--listing", type=int, default=0, metavar="N",
+                        help="Also compare holding a listing of N entries as dicts, FileRecords and a snapshot")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Compare against an earlier JSON result file")
+    args = parser.parse_args()
+
+    overrides = {}
+    llm = {k: v for k, v in (('concurrency', args.concurrency), ('batch_size', args.batch_size))
+           if v is not None}
+    if llm:
+        overrides['llm'] = llm
+    if args.preview_workers is not None:
+        overrides['preview'] = {'workers': args.preview_workers}
+
+    results = run_benchmark(args.files, args.latency_ms / 1000, args.mix, args.seed, overrides,
+                            listing=args.listing)
+    print(f"{'stage':<18} {'files/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'peak RSS MB':>12}")
+    for stage, r in results['stages'].items():
+        print(f"{stage:<18} {_cell(r['files_per_sec'], 1):>10} {_cell(r['p50_ms']):>10} "
+              f"{_cell(r['p99_ms']):>10} {_cell(r['peak_rss_mb'], 1):>12}")
+    if 'listing' in results:
+        listing = results['listing']
+        print(f"\nlisting of {listing['entries']} entries: build s, traced memory MB, save s, load s, file MB")
+        for name in ('dict_list', 'file_records', 'snapshot'):
+            r = listing[name]
+            print(f"{name:<18} {_cell(r.get('build_seconds'), 3):>8} {_cell(r['memory_mb'], 1):>8} "
+                  f"{_cell(r.get('save_seconds'), 3):>8} {_cell(r.get('load_seconds'), 4):>8} "
+                  f"{_cell(r.get('file_mb'), 1):>8}")
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+    if args.compare:
+        previous = json.loads(Path(args.compare).read_text())
+        regressions = 0
+        for stage, old, new, regressed in compare(results, previous):
+            change = f"{new / old:.2f}x" if old and new else 'n/a'
+            print(f"{stage:<18} {old or 0:>10.1f} -> {new or 0:>10.1f} files/s ({change})"
+                  f"{'  REGRESSION' if regressed else ''}")
+            regressions += regressed
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
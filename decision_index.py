@@ -0,0 +1,367 @@
+"""
+decision_index.py
+
+Nearest-neighbour index of past decisions, to skip the LLM for files that
+look like ones we have already organized:
+- Each applied LLM decision is stored with a hashed bag-of-words vector of
+  the file's name tokens and preview text (NumPy, L2-normalized)
+- A new file is compared with every past decision of the same extension and
+  prompt in one matrix product; if the closest is above the threshold, its
+  folder and naming pattern are reused
+- Naming patterns carry over the numbers in a name, so the decision for
+  invoice_2025_03.pdf turns invoice_2025_04.pdf into the matching new name
+- Only files with preview text are compared, and only renames that reuse
+  the words of the old name are learned: a name like IMG_0412.JPG says
+  nothing about what the photo shows
+- Persisted in SQLite and updated incrementally after each applied move
+"""
+import logging
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path, PurePath
+from typing import Optional
+
+from metrics import metrics
+from rules import slugify
+from suggestion_cache import hash_text
+
+DEFAULT_DECISION_INDEX_PATH = '~/.cache/auto_file_organizer/decisions.sqlite'
+DEFAULT_THRESHOLD = 0.9
+DEFAULT_DIMENSIONS = 1024
+DEFAULT_MAX_ENTRIES = 20000
+
+# Preview words used per file, and the weight of name tokens relative to them
+PREVIEW_WORDS = 120
+NAME_WEIGHT = 3.0
+# Distinct preview words a file needs before it is compared with past decisions
+MIN_PREVIEW_WORDS = 3
+
+_WORD = re.compile(r'[a-z]+|\d+')
+_DIGITS = re.compile(r'\d+')
+_PLACEHOLDER = re.compile(r'\{d(\d+)\}')
+
+
+def _shape(token: str) -> str:
+    # Numbers only count by their length, so dates and counters still match
+    return '#' * min(len(token), 4) if token.isdigit() else token
+
+
+def features(file_meta: dict) -> dict:
+    """
+    Return {feature: weight} for a file: name tokens, the extension and preview words.
+    """
+    name = file_meta.get('name', '')
+    path = PurePath(name)
+    weights = {}
+    # split camelCase before lowercasing, so "WeeklyReport" gives weekly + report
+    stem = re.sub(r'([a-z])([A-Z])', r'\1 \2', path.stem).lower()
+    for token in _WORD.findall(stem):
+        key = 'n:' + _shape(token)
+        weights[key] = weights.get(key, 0.0) + NAME_WEIGHT
+    weights['x:' + path.suffix.lower()] = NAME_WEIGHT
+    words = _WORD.findall((file_meta.get('preview') or '').lower())[:PREVIEW_WORDS]
+    for token in words:
+        if len(token) >= 3 or token.isdigit():
+            key = 'p:' + _shape(token)
+            weights[key] = weights.get(key, 0.0) + 1.0
+    return weights
+
+
+def preview_words(file_meta: dict) -> int:
+    """Return the number of distinct words (not numbers) in a file's preview features."""
+    return sum(1 for feature in features(file_meta)
+               if feature.startswith('p:') and not feature.startswith('p:#'))
+
+
+def _name_words(name: str) -> set:
+    stem = re.sub(r'([a-z])([A-Z])', r'\1 \2', PurePath(name).stem).lower()
+    return {token for token in _WORD.findall(stem) if not token.isdigit()}
+
+
+def vectorize(file_meta: dict, dimensions: int = DEFAULT_DIMENSIONS):
+    """
+    Hash a file's features into a unit-length float32 vector (the hashing
+    trick, with a sign bit to keep collisions unbiased).
+    """
+    import numpy as np
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for feature, weight in features(file_meta).items():
+        h = zlib.crc32(feature.encode('utf-8'))
+        vector[h % dimensions] += (1.0 if h & 0x80000000 else -1.0) * (1.0 + np.log(weight))
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+def naming_pattern(original: str, suggested: str) -> Optional[str]:
+    """
+    Turn a past rename into a reusable pattern:
+    'keep', 'slug', or a template with {dN} for the N-th number of the
+    original name. Returns None if the new name cannot be derived from the
+    old one (e.g. it contains numbers or words the original did not).
+    """
+    if suggested == original:
+        return 'keep'
+    path = PurePath(original)
+    if suggested == slugify(path.stem) + path.suffix.lower():
+        return 'slug'
+    # Words the LLM took from the content would be wrong for the next file
+    if not _name_words(suggested) <= _name_words(original):
+        return None
+    numbers = _DIGITS.findall(path.stem)
+    unmatched = False
+
+    def placeholder(match):
+        nonlocal unmatched
+        if match.group(0) in numbers:
+            return '{d%d}' % numbers.index(match.group(0))
+        unmatched = True
+        return match.group(0)
+    target = PurePath(suggested.replace('{', '').replace('}', ''))
+    template = _DIGITS.sub(placeholder, target.stem) + target.suffix
+    return None if unmatched else 'template:' + template
+
+
+def apply_pattern(pattern: str, name: str) -> Optional[str]:
+    """Apply a naming_pattern to a new file name, or return None if it does not fit."""
+    path = PurePath(name)
+    if pattern == 'keep':
+        return name
+    if pattern == 'slug':
+        return slugify(path.stem) + path.suffix.lower()
+    template = pattern[len('template:'):]
+    numbers = _DIGITS.findall(path.stem)
+    try:
+        result = _PLACEHOLDER.sub(lambda m: numbers[int(m.group(1))], template)
+    except IndexError:
+        return None
+    # The template keeps the old extension; files only match within one extension anyway
+    return result
+
+
+def _folder_pattern(original: str, folder: str) -> str:
+    # Numbers in the folder taken from the name follow the new name; others stay as they are
+    numbers = _DIGITS.findall(PurePath(original).stem)
+    return _DIGITS.sub(
+        lambda m: '{d%d}' % numbers.index(m.group(0)) if m.group(0) in numbers else m.group(0),
+        folder.replace('{', '').replace('}', '')
+    )
+
+
+def learnable(file_meta: dict, suggestion: dict) -> bool:
+    """
+    Whether DecisionIndex.learn would store this decision once it is applied:
+    an LLM rename or move of a file with preview text, whose name can be
+    turned into a pattern.
+    """
+    if suggestion.get('delete') or 'similar_to' in suggestion or 'rule' in suggestion:
+        return False
+    if preview_words(file_meta) < MIN_PREVIEW_WORDS:
+        return False
+    name = file_meta.get('name', '')
+    return naming_pattern(name, suggestion.get('suggested_name', name)) is not None
+
+
+class DecisionIndex:
+    """
+    SQLite-backed store of past decisions with an in-memory NumPy matrix of
+    their vectors. Safe to share between threads.
+    """
+    def __init__(self, path: str = DEFAULT_DECISION_INDEX_PATH,
+                 threshold: float = DEFAULT_THRESHOLD,
+                 dimensions: int = DEFAULT_DIMENSIONS,
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        import numpy as np
+        self._np = np
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.threshold = threshold
+        self.dimensions = dimensions
+        self.max_entries = max_entries
+        self.lookups = 0
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS decisions ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " grp TEXT NOT NULL,"
+            " name TEXT NOT NULL,"
+            " folder TEXT NOT NULL,"
+            " pattern TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(decisions)")}
+        if 'preview_words' not in columns:
+            # Decisions stored before previews were required: not used for matching
+            self._conn.execute(
+                "ALTER TABLE decisions ADD COLUMN preview_words INTEGER NOT NULL DEFAULT 0"
+            )
+        self._conn.commit()
+        self._load()
+
+    def _load(self) -> None:
+        np = self._np
+        rows = self._conn.execute(
+            "SELECT id, grp, name, folder, pattern, vector FROM decisions"
+            " WHERE preview_words >= ? ORDER BY id", (MIN_PREVIEW_WORDS,)
+        ).fetchall()
+        rows = [row for row in rows if len(row[5]) == self.dimensions * 4]
+        self._rows = [row[:5] for row in rows]
+        self._size = len(rows)
+        capacity = max(64, self._size * 2)
+        self._matrix = np.zeros((capacity, self.dimensions), dtype=np.float32)
+        # Group of each row as a small integer, so filtering is one vector comparison
+        self._group_codes = {}
+        self._codes = np.full(capacity, -1, dtype=np.int32)
+        for i, row in enumerate(rows):
+            self._matrix[i] = np.frombuffer(row[5], dtype=np.float32)
+            self._codes[i] = self._group_codes.setdefault(row[1], len(self._group_codes))
+
+    @staticmethod
+    def _group(file_meta: dict, template: str) -> str:
+        # Decisions only apply to files of the same extension under the same prompt
+        return PurePath(file_meta.get('name', '')).suffix.lower() + ':' + hash_text(template)[:16]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._size
+
+    def lookup(self, file_meta: dict, template: str) -> Optional[dict]:
+        """
+        Return a suggestion copied from the most similar past decision, or
+        None if no decision is similar enough or the file has too little
+        preview text to tell.
+        """
+        np = self._np
+        if preview_words(file_meta) < MIN_PREVIEW_WORDS:
+            with self._lock:
+                self.lookups += 1
+            metrics.inc('similar_lookups_total', result='miss')
+            return None
+        vector = vectorize(file_meta, self.dimensions)
+        group = self._group(file_meta, template)
+        with self._lock:
+            self.lookups += 1
+            code = self._group_codes.get(group)
+            best = None
+            mask = self._codes[:self._size] == code if code is not None else None
+            if mask is not None and mask.any():
+                scores = self._matrix[:self._size] @ vector
+                scores[~mask] = -1.0
+                i = int(np.argmax(scores))
+                if scores[i] >= self.threshold:
+                    best = (self._rows[i], float(scores[i]))
+        if best is not None:
+            (row_id, _, name, folder, pattern), score = best
+            suggestion = self._suggestion(file_meta, name, folder, pattern, score)
+            if suggestion is not None:
+                with self._lock:
+                    self.hits += 1
+                metrics.inc('similar_lookups_total', result='hit')
+                return suggestion
+        metrics.inc('similar_lookups_total', result='miss')
+        return None
+
+    @staticmethod
+    def _suggestion(file_meta, name, folder, pattern, score) -> Optional[dict]:
+        new_name = apply_pattern(pattern, file_meta.get('name', ''))
+        if not new_name:
+            return None
+        numbers = _DIGITS.findall(PurePath(file_meta.get('name', '')).stem)
+        try:
+            new_folder = _PLACEHOLDER.sub(lambda m: numbers[int(m.group(1))], folder)
+        except IndexError:
+            return None
+        return {
+            'suggested_name': new_name,
+            'suggested_folder': new_folder,
+            'delete': False,
+            'similar_to': name,
+            'similarity': round(score, 3)
+        }
+
+    def add(self, file_meta: dict, suggestion: dict, template: str) -> bool:
+        """
+        Learn from an applied decision. Only learnable() decisions are stored.
+        """
+        if not learnable(file_meta, suggestion):
+            return False
+        name = file_meta.get('name', '')
+        pattern = naming_pattern(name, suggestion.get('suggested_name', name))
+        folder = _folder_pattern(name, suggestion.get('suggested_folder', ''))
+        vector = vectorize(file_meta, self.dimensions)
+        group = self._group(file_meta, template)
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO decisions (grp, name, folder, pattern, vector, created_at, preview_words)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (group, name, folder, pattern, vector.tobytes(), time.time(), preview_words(file_meta))
+            )
+            self._conn.commit()
+            if self._size == len(self._matrix):
+                np = self._np
+                self._matrix = np.concatenate([self._matrix, np.zeros_like(self._matrix)])
+                self._codes = np.concatenate([self._codes, np.full_like(self._codes, -1)])
+            self._matrix[self._size] = vector
+            self._codes[self._size] = self._group_codes.setdefault(group, len(self._group_codes))
+            self._rows.append((cursor.lastrowid, group, name, folder, pattern))
+            self._size += 1
+            if self._size > self.max_entries:
+                self._evict()
+        return True
+
+    def learn(self, items: list, moved: dict, template: str) -> int:
+        """
+        Add the decisions of a run that were actually applied as moves.
+        Rule matches are skipped (see learnable): the rule already covers them.
+
+        :param items: (file_meta, suggestion) pairs of the run
+        :param moved: {source path: new path} from plan.execute_plan
+        :returns: Number of decisions added
+        """
+        added = 0
+        for file_meta, suggestion in items:
+            if file_meta['path'] in moved:
+                added += self.add(file_meta, suggestion, template)
+        return added
+
+    def _evict(self) -> None:
+        # Drop the oldest tenth beyond max_entries in one go, then rebuild the matrix
+        keep = int(self.max_entries * 0.9)
+        cutoff = self._rows[self._size - keep][0]
+        self._conn.execute("DELETE FROM decisions WHERE id < ?", (cutoff,))
+        self._conn.commit()
+        self._load()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'lookups': self.lookups, 'hits': self.hits, 'entries': self._size,
+                    'hit_rate': self.hits / self.lookups if self.lookups else 0.0}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def load_decision_index(config: dict) -> Optional[DecisionIndex]:
+    """
+    Build a DecisionIndex from the `similar` section of config.yaml.
+    Returns None if reuse of similar decisions is disabled.
+    """
+    options = config.get('similar') or {}
+    if not options.get('enabled', True):
+        return None
+    try:
+        return DecisionIndex(
+            path=options.get('path', DEFAULT_DECISION_INDEX_PATH),
+            threshold=options.get('threshold', DEFAULT_THRESHOLD),
+            dimensions=options.get('dimensions', DEFAULT_DIMENSIONS),
+            max_entries=options.get('max_entries', DEFAULT_MAX_ENTRIES)
+        )
+    except ImportError:
+        logging.warning("NumPy is not installed; similar-file reuse is disabled")
+        return None
@@ -0,0 +1,353 @@
+"""
+duplicates.py
+
+Local duplicate detection across monitor_folders and root_folder:
+- Groups files by size, then by a hash of their first and last blocks,
+  then by a full SHA-256 of the content read through mmap
+- Keeps hashes in a persistent SQLite index keyed by (path, size, mtime_ns),
+  so unchanged files are never re-hashed
+- The index also remembers every file it has seen, by size: the first run
+  walks monitor_folders and root_folder once, after that only the scanned
+  (new or changed) files are looked up against it
+- Picks one copy to keep and turns every other copy found in a monitored
+  folder into a delete suggestion, without asking the LLM
+"""
+import hashlib
+import json
+import logging
+import mmap
+import os
+import sqlite3
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+from file_scanner import iter_entries, make_scope_filter
+
+DEFAULT_HASH_INDEX_PATH = '~/.cache/auto_file_organizer/hashes.sqlite'
+
+# Bytes read from each end of a file for the partial hash
+BLOCK_SIZE = 64 * 1024
+
+
+def partial_hash(path, size: int) -> str:
+    """
+    Hash the size plus the first and last BLOCK_SIZE bytes of a file.
+    For files up to 2 * BLOCK_SIZE this covers the whole content.
+    """
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(BLOCK_SIZE))
+        if size > BLOCK_SIZE:
+            f.seek(max(BLOCK_SIZE, size - BLOCK_SIZE))
+            digest.update(f.read(BLOCK_SIZE))
+    return digest.hexdigest()
+
+
+def full_hash(path) -> str:
+    """
+    Return the SHA-256 of a file's content, reading it through mmap.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return digest.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            digest.update(mapped)
+    return digest.hexdigest()
+
+
+class HashIndex:
+    """
+    SQLite-backed store of partial and full hashes per file state.
+    Safe to share between threads.
+    """
+    def __init__(self, path: str = DEFAULT_HASH_INDEX_PATH):
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " partial TEXT,"
+            " full TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_hashes_size ON hashes(size)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS seeded (folders TEXT PRIMARY KEY)")
+        self._conn.commit()
+
+    def _get(self, path: str, stat: os.stat_result) -> tuple:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, partial, full FROM hashes WHERE path = ?", (path,)
+            ).fetchone()
+        if row is None or (row[0], row[1]) != (stat.st_size, stat.st_mtime_ns):
+            return None, None
+        return row[2], row[3]
+
+    def _put(self, path: str, stat: os.stat_result, partial: str, full: Optional[str]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO hashes (path, size, mtime_ns, partial, full)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime_ns, partial, full)
+            )
+            self._conn.commit()
+
+    def partial(self, path: str, stat: os.stat_result) -> str:
+        """
+        Return the partial hash of a file, computing and storing it if needed.
+        """
+        partial, full = self._get(path, stat)
+        if partial is None:
+            partial = partial_hash(path, stat.st_size)
+            self._put(path, stat, partial, None)
+        return partial
+
+    def full(self, path: str, stat: os.stat_result) -> str:
+        """
+        Return the full content hash of a file, computing and storing it if needed.
+        """
+        partial, full = self._get(path, stat)
+        if full is None:
+            full = full_hash(path)
+            self._put(path, stat, partial, full)
+        return full
+
+    def record(self, entries: Iterable[tuple]) -> None:
+        """
+        Remember (path, stat) entries without hashing them; stored hashes
+        are kept for files whose size and mtime did not change.
+        """
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO hashes (path, size, mtime_ns) VALUES (?, ?, ?)"
+                " ON CONFLICT(path) DO UPDATE SET size = excluded.size,"
+                " mtime_ns = excluded.mtime_ns, partial = NULL, full = NULL"
+                " WHERE size != excluded.size OR mtime_ns != excluded.mtime_ns",
+                ((str(path), stat.st_size, stat.st_mtime_ns) for path, stat in entries)
+            )
+            self._conn.commit()
+
+    def moved(self, moved: dict) -> None:
+        """
+        Follow files the organizer moved ({source path: new Path}, as
+        returned by plan.execute_plan); the content and hashes are unchanged.
+        """
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE OR REPLACE hashes SET path = ? WHERE path = ?",
+                [(str(dst), str(src)) for src, dst in moved.items()]
+            )
+            self._conn.commit()
+
+    def forget(self, paths: Iterable[str]) -> None:
+        with self._lock:
+            self._conn.executemany("DELETE FROM hashes WHERE path = ?", [(p,) for p in paths])
+            self._conn.commit()
+
+    def same_size(self, size: int) -> list:
+        """Return the known paths of files with this size."""
+        with self._lock:
+            rows = self._conn.execute("SELECT path FROM hashes WHERE size = ?", (size,)).fetchall()
+        return [row[0] for row in rows]
+
+    def is_seeded(self, config: dict) -> bool:
+        """Whether the folders of config were walked in full since the last clear_seeded()."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM seeded WHERE folders = ?", (_seed_key(config),)
+            ).fetchone()
+        return row is not None
+
+    def mark_seeded(self, config: dict) -> None:
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO seeded (folders) VALUES (?)", (_seed_key(config),))
+            self._conn.commit()
+
+    def clear_seeded(self) -> None:
+        """Make the next run walk every folder again (e.g. after --full-scan)."""
+        with self._lock:
+            self._conn.execute("DELETE FROM seeded")
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _seed_key(config: dict) -> str:
+    # A changed folder list needs a new full walk
+    return json.dumps([sorted(config.get('monitor_folders') or []), config.get('root_folder')])
+
+
+def find_duplicates(entries: Iterable[tuple], hash_index: HashIndex) -> list:
+    """
+    Group files with identical content.
+
+    :param entries: Iterable of (path, stat) pairs
+    :param hash_index: HashIndex used to look up or store hashes
+    :returns: List of groups, each a list of (Path, stat) with equal content
+    """
+    by_size = defaultdict(list)
+    for path, stat in entries:
+        if stat.st_size > 0:  # empty files are not worth deduplicating
+            by_size[stat.st_size].append((Path(path), stat))
+
+    groups = []
+    for size, same_size in by_size.items():
+        if len(same_size) < 2:
+            continue
+        by_partial = defaultdict(list)
+        for path, stat in same_size:
+            try:
+                by_partial[hash_index.partial(str(path), stat)].append((path, stat))
+            except OSError:
+                continue
+        for candidates in by_partial.values():
+            if len(candidates) < 2:
+                continue
+            if size <= 2 * BLOCK_SIZE:
+                # The partial hash already covered the whole content
+                groups.append(candidates)
+                continue
+            by_full = defaultdict(list)
+            for path, stat in candidates:
+                try:
+                    by_full[hash_index.full(str(path), stat)].append((path, stat))
+                except OSError:
+                    continue
+            groups.extend(group for group in by_full.values() if len(group) > 1)
+    return groups
+
+
+def choose_keeper(group: list, root_folder: Optional[str] = None) -> Path:
+    """
+    Pick the copy to keep: one already under root_folder if any, otherwise
+    the oldest, then the shortest path.
+    """
+    root = os.path.join(str(Path(root_folder).expanduser()), '') if root_folder else None
+
+    def rank(item):
+        path, stat = item
+        organized = root is not None and str(path).startswith(root)
+        return (not organized, stat.st_mtime_ns, len(str(path)), str(path))
+    return min(group, key=rank)[0]
+
+
+def _delete_suggestion(path: Path, keeper: Path) -> dict:
+    return {
+        'suggested_name': path.name,
+        'suggested_folder': '',
+        'delete': True,
+        'duplicate_of': str(keeper)
+    }
+
+
+def duplicate_decisions(config: dict, hash_index: HashIndex) -> dict:
+    """
+    Find duplicates across all of monitor_folders and root_folder and decide
+    which copies to delete. Only copies inside monitored folders are ever
+    deleted. Every file walked is remembered in hash_index, so later runs
+    can use filter_duplicates on the files they scan instead.
+
+    :returns: {path: suggestion} for every copy that should be deleted
+    """
+    monitored = list(iter_entries(config))
+    monitored_paths = {str(path) for path, _ in monitored}
+    entries = list(monitored)
+    root_folder = config.get('root_folder')
+    if root_folder:
+        # The organized tree is always searched in full
+        scan = dict(config.get('scan') or {}, recursive=True, max_depth=None)
+        root_config = dict(config, scan=scan)
+        entries.extend(
+            (path, stat) for path, stat in iter_entries(root_config, folders=[root_folder])
+            if str(path) not in monitored_paths
+        )
+    hash_index.record(entries)
+    hash_index.mark_seeded(config)
+
+    decisions = {}
+    for group in find_duplicates(entries, hash_index):
+        keeper = choose_keeper(group, root_folder)
+        for path, _ in group:
+            if path != keeper and str(path) in monitored_paths:
+                decisions[str(path)] = _delete_suggestion(path, keeper)
+    if decisions:
+        logging.info(f"Found {len(decisions)} duplicate files")
+    return decisions
+
+
+def _known_copies(hash_index: HashIndex, path: str, size: int, exclude) -> list:
+    # (Path, stat) of the other files of this size the index knows that still exist
+    copies, gone = [], []
+    for other in hash_index.same_size(size):
+        if other == path or other in exclude:
+            continue
+        try:
+            stat = os.stat(other)
+        except OSError:
+            gone.append(other)
+            continue
+        if stat.st_size == size:
+            copies.append((Path(other), stat))
+        else:
+            hash_index.record([(other, stat)])
+    if gone:
+        hash_index.forget(gone)
+    return copies
+
+
+def filter_duplicates(config: dict, entries: Iterable[tuple], hash_index: HashIndex,
+                      duplicates: dict) -> Iterator[tuple]:
+    """
+    Stream (path, stat) entries, leaving out exact duplicates of files the
+    hash index knows about. Only files of a size seen before are hashed.
+
+    A scanned file that is a copy of a file to keep is not yielded; if the
+    scanned file is the one to keep, the other copies in monitored folders
+    are deleted instead. Files yielded earlier in the same scan are always
+    kept. Decisions are added to `duplicates` ({path: suggestion}) as the
+    entries are consumed.
+    """
+    root_folder = config.get('root_folder')
+    in_scope = make_scope_filter(config)
+    kept = set()
+    for path, stat in entries:
+        key = str(path)
+        if key in duplicates:
+            continue
+        hash_index.record([(key, stat)])
+        copies = _known_copies(hash_index, key, stat.st_size, duplicates) if stat.st_size else []
+        group = next((group for group in find_duplicates([(path, stat)] + copies, hash_index)
+                      if any(str(p) == key for p, _ in group)), None)
+        if group is None:
+            kept.add(key)
+            yield path, stat
+            continue
+        earlier = [(p, s) for p, s in group if str(p) in kept]
+        keeper = choose_keeper(earlier or group, root_folder)
+        if str(keeper) != key:
+            duplicates[key] = _delete_suggestion(Path(path), keeper)
+            continue
+        for other, _ in group:
+            if str(other) != key and in_scope(other):
+                duplicates[str(other)] = _delete_suggestion(other, keeper)
+        kept.add(key)
+        yield path, stat
+
+
+def load_hash_index(config: dict) -> Optional[HashIndex]:
+    """
+    Build a HashIndex from the `duplicates` section of config.yaml.
+    Returns None if duplicate detection is disabled.
+    """
+    options = config.get('duplicates') or {}
+    if not options.get('enabled', True):
+        return None
+    return HashIndex(path=options.get('index_path', DEFAULT_HASH_INDEX_PATH))
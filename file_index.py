@@ -0,0 +1,132 @@
+"""
+file_index.py
+
+Persistent index of file states seen by the scanner:
+- Stores (path, inode, size, mtime_ns) for every processed file in SQLite
+- Lets file_scanner return only new or changed files and report deletions
+- Survives restarts, so a restart does not re-read unchanged files
+"""
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable, Optional
+
+DEFAULT_INDEX_PATH = '~/.cache/auto_file_organizer/file_index.sqlite'
+
+
+def file_state(stat: os.stat_result) -> tuple:
+    """
+    Return the (inode, size, mtime_ns) fingerprint used to detect changes.
+    """
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+class FileIndex:
+    """
+    SQLite-backed map from file path to its last processed state.
+    Safe to share between threads.
+    """
+    def __init__(self, path: str = DEFAULT_INDEX_PATH):
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(files)")}
+        if columns and 'parent' not in columns:
+            # Index from an older version: rebuild it (costs one full re-read)
+            self._conn.execute("DROP TABLE files")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY,"
+            " parent TEXT NOT NULL,"
+            " inode INTEGER NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_files_parent ON files(parent)")
+        self._conn.commit()
+
+    def lookup(self, path: str) -> Optional[tuple]:
+        """
+        Return the recorded (inode, size, mtime_ns) for path, or None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT inode, size, mtime_ns FROM files WHERE path = ?", (path,)
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def entries_in(self, directory: str) -> dict:
+        """
+        Return {path: (inode, size, mtime_ns)} for the recorded files directly in directory.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, inode, size, mtime_ns FROM files WHERE parent = ?", (directory,)
+            ).fetchall()
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    def directories_under(self, folder: str) -> list:
+        """
+        Return every directory at or below folder that has recorded files.
+        """
+        prefix = os.path.join(folder, '')
+        # Every path below prefix sorts between "folder/" and "folder0"
+        upper = prefix[:-1] + chr(ord(os.sep) + 1)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT parent FROM files WHERE parent = ? OR (parent >= ? AND parent < ?)",
+                (folder, prefix, upper)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def record(self, file_meta: dict) -> None:
+        """
+        Mark a file as processed in its current state.
+
+        :param file_meta: Metadata dict from file_scanner.get_file_metadata
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (path, parent, inode, size, mtime_ns)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (file_meta['path'], os.path.dirname(file_meta['path']), file_meta['inode'],
+                 file_meta['size_bytes'], file_meta['mtime_ns'])
+            )
+            self._conn.commit()
+
+    def forget(self, paths: Iterable[str]) -> None:
+        """
+        Remove paths from the index (e.g. after the file was deleted or moved).
+        """
+        with self._lock:
+            self._conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in paths])
+            self._conn.commit()
+
+    def clear(self) -> None:
+        """
+        Forget every file, forcing the next scan to re-read everything.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM files")
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def load_index(config: dict) -> Optional[FileIndex]:
+    """
+    Build a FileIndex from the `index` section of config.yaml.
+    Returns None if incremental scanning is disabled.
+    """
+    options = config.get('index') or {}
+    if not options.get('enabled', True):
+        return None
+    return FileIndex(path=options.get('path', DEFAULT_INDEX_PATH))
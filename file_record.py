@@ -0,0 +1,121 @@
+"""
+file_record.py
+
+Compact per-file metadata for large listings:
+- FileRecord keeps the path, size, inode and nanosecond timestamps in
+  __slots__ (no per-object dict); the name and the ISO date strings the
+  prompts use are derived on access
+- The content preview is read on first access, so a listing of a million
+  files does not hold a million previews
+- Reads like the metadata dicts it replaces (record['name'],
+  record.get('preview')), so the pipeline, rules and caches take either.
+  Comparing, iterating or copying a record ({**record}, to_dict()) never
+  reads the preview: it is only included once loaded
+"""
+import os
+from collections.abc import Mapping
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+
+class FileRecord(Mapping):
+    """
+    Metadata of one file. Fields: path, name, size_bytes, modified_time,
+    created_time, inode, mtime_ns, ctime_ns and preview.
+    """
+    __slots__ = ('path', 'size_bytes', 'mtime_ns', 'ctime_ns', 'inode', '_preview')
+
+    KEYS = ('path', 'name', 'size_bytes', 'modified_time', 'created_time',
+            'inode', 'mtime_ns', 'ctime_ns', 'preview')
+    _WRITABLE = ('path', 'size_bytes', 'mtime_ns', 'ctime_ns', 'inode', 'preview')
+
+    def __init__(self, path: str, size_bytes: int, mtime_ns: int, ctime_ns: int,
+                 inode: int = 0, preview: Optional[str] = None):
+        self.path = path
+        self.size_bytes = size_bytes
+        self.mtime_ns = mtime_ns
+        self.ctime_ns = ctime_ns
+        self.inode = inode
+        self._preview = preview   # None: not read yet
+
+    @classmethod
+    def from_stat(cls, path, stat: os.stat_result, preview: Optional[str] = None) -> 'FileRecord':
+        ctime_ns = getattr(stat, 'st_ctime_ns', int(stat.st_ctime * 1e9))
+        return cls(str(path), stat.st_size, stat.st_mtime_ns, ctime_ns, stat.st_ino, preview)
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.path)
+
+    @property
+    def modified_time(self) -> str:
+        return datetime.fromtimestamp(self.mtime_ns / 1e9).isoformat()
+
+    @property
+    def created_time(self) -> str:
+        return datetime.fromtimestamp(self.ctime_ns / 1e9).isoformat()
+
+    @property
+    def preview(self) -> str:
+        """The content preview, read from the file on first access."""
+        if self._preview is None:
+            from file_scanner import _timed_preview   # file_scanner imports this module
+            try:
+                self._preview = _timed_preview(Path(self.path))
+            except OSError:
+                self._preview = ''
+        return self._preview
+
+    @preview.setter
+    def preview(self, text: str) -> None:
+        self._preview = text
+
+    @property
+    def preview_loaded(self) -> bool:
+        return self._preview is not None
+
+    def drop_preview(self) -> None:
+        """Forget the preview; it is read again if needed."""
+        self._preview = None
+
+    # --- mapping interface, for code written against metadata dicts ---
+
+    def __getitem__(self, key: str):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value) -> None:
+        if key not in self._WRITABLE:
+            raise KeyError(f"FileRecord has no writable field {key!r}")
+        setattr(self, key, value)
+
+    def __contains__(self, key) -> bool:
+        # Without reading the preview, as Mapping.__contains__ would
+        return key in self.KEYS
+
+    def _keys(self) -> tuple:
+        return self.KEYS if self._preview is not None else self.KEYS[:-1]
+
+    def __iter__(self):
+        # The preview only once loaded, so items() and {**record} stay lazy
+        return iter(self._keys())
+
+    def __len__(self) -> int:
+        return len(self._keys())
+
+    def __eq__(self, other) -> bool:
+        # On the stat fields, without reading either preview
+        if isinstance(other, FileRecord):
+            return (self.path, self.size_bytes, self.mtime_ns, self.ctime_ns, self.inode) == \
+                   (other.path, other.size_bytes, other.mtime_ns, other.ctime_ns, other.inode)
+        return super().__eq__(other)
+
+    __hash__ = None
+
+    def to_dict(self) -> dict:
+        return {key: self[key] for key in self._keys()}
+
+    def __repr__(self) -> str:
+        return f"FileRecord({self.path!r}, size_bytes={self.size_bytes}, mtime_ns={self.mtime_ns})"
@@ -1,13 +1,19 @@
 import os 
+import re
 import yaml
+import atexit
+import time
+import fnmatch
+import logging
 from pathlib import Path
-from datetime import datetime
 
-#imports for previewing files
-from PyPDF2 import PdfReader
-from docx import Document
-import pytesseract
-from PIL import Image
+#the preview libraries (PyPDF2, python-docx, pytesseract, PIL) are imported
+#inside the preview functions, so only scans that need them pay for them
+
+from file_index import file_state
+from file_record import FileRecord
+from metrics import metrics
+from ocr import ImageOcr, load_ocr
 
 #Function to Load the Yaml configiration file specifying folers to monitor and scan interval
 def load_config(config_path: str = 'config.yaml') -> dict:
@@ -23,82 +29,530 @@ def preview_text(file_path: Path,max_chars:int = 500)-> str:
     except Exception:
         return ''
     
-#Function to extract text preview from the first page of the pdf file
-def preview_pdf(file_path:Path,max_chars:int = 500) -> str:
+#Most bytes a PDF or DOCX preview may read, so preview cost depends on the
+#preview size and not on the document size
+PREVIEW_MAX_BYTES = 8 * 1024 * 1024
+
+#Raised by _ReadCap once a preview has read its byte budget
+class PreviewBudgetExceeded(Exception):
+    pass
+
+#Binary file wrapper that counts the bytes read through it and raises
+#PreviewBudgetExceeded after max_bytes; seeks are free
+class _ReadCap:
+    def __init__(self, f, max_bytes: int):
+        self._f = f
+        self.remaining = max_bytes
+
+    def _take(self, data: bytes) -> bytes:
+        self.remaining -= len(data)
+        if self.remaining < 0:
+            raise PreviewBudgetExceeded()
+        return data
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = max(0, self.remaining) + 1  #never read a whole huge file
+        return self._take(self._f.read(size))
+
+    def readline(self, size: int = -1) -> bytes:
+        return self._take(self._f.readline(size))
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)  #seek, tell, mode, ...
+
+#Function to yield the first `limit` pages of a PDF by walking the page tree,
+#instead of reader.pages, which loads every page object of the document first
+def _iter_pdf_pages(reader, limit: int):
+    from PyPDF2 import PageObject
+    from PyPDF2.generic import IndirectObject, NameObject
+    inheritable = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+    stack = [(reader.trailer['/Root'].get_object()['/Pages'], {})]
+    count = 0
+    while stack and count < limit:
+        ref, inherit = stack.pop()
+        node = ref.get_object()
+        if node.get('/Type', '/Pages') == '/Pages' and '/Kids' in node:
+            inherit = dict(inherit, **{attr: node[attr] for attr in inheritable if attr in node})
+            stack.extend((kid, inherit) for kid in reversed(node['/Kids']))
+            continue
+        page = PageObject(reader, ref if isinstance(ref, IndirectObject) else None)
+        page.update(node)
+        for attr, value in inherit.items():
+            if attr not in page:
+                page[NameObject(attr)] = value
+        count += 1
+        yield page
+
+#Function to extract text preview from the first pages of the pdf file.
+#The file is read on demand (not loaded whole), only the first 2 pages are
+#loaded, and at most max_bytes are read
+def preview_pdf(file_path:Path,max_chars:int = 500, max_bytes: int = PREVIEW_MAX_BYTES) -> str:
+    text = ''
     try:
-        reader = PdfReader(str(file_path)) #loads the PDF file
-        text = ''
-        #loop through the first 2 pages or until max_char is reached
-        for page in reader.pages[:2]:
-            text_chunk = page.extract_text() or ''
-            text += text_chunk
-            if len(text) >= max_chars:
-                break
-        return text[:max_chars]
+        from PyPDF2 import PdfReader
+        with open(file_path, 'rb') as f:
+            reader = PdfReader(_ReadCap(f, max_bytes)) #reads only the trailer and xref
+            #loop through the first 2 pages or until max_char is reached
+            for page in _iter_pdf_pages(reader, 2):
+                text += page.extract_text() or ''
+                if len(text) >= max_chars:
+                    break
     except Exception:
-        return ''
-    
+        pass  #keep whatever text was extracted before the error or the byte cap
+    return text[:max_chars]
+
 
-#Function to exteacttext preview from a doxc file
-def preview_docx(file_path:Path,max_chars: int = 500) -> str:
+WORD_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+#Function to extract text preview from a docx file by streaming its
+#word/document.xml member, stopping at max_chars or after max_bytes of XML
+def preview_docx(file_path:Path,max_chars: int = 500, max_bytes: int = PREVIEW_MAX_BYTES) -> str:
+    import zipfile
+    from xml.etree.ElementTree import XMLPullParser
+    paragraphs, size, read = [], 0, 0
+    current = []
     try:
-        doc = Document(str(file_path))  # loads the docx file
-        #Join all the paragraphs text separated by lines(if any)
-        full_text = '\n'.join([p.text for p in doc.paragraphs])
-        return full_text[:max_chars]
+        with zipfile.ZipFile(file_path) as archive, archive.open('word/document.xml') as f:
+            parser = XMLPullParser(events=('end',))
+            while size < max_chars and read < max_bytes:
+                chunk = f.read(64 * 1024)
+                if not chunk:
+                    break
+                read += len(chunk)
+                parser.feed(chunk)
+                for _, elem in parser.read_events():
+                    tag = elem.tag
+                    if tag == WORD_NAMESPACE + 't':
+                        current.append(elem.text or '')
+                    elif tag == WORD_NAMESPACE + 'tab':
+                        current.append('\t')
+                    elif tag in (WORD_NAMESPACE + 'br', WORD_NAMESPACE + 'cr'):
+                        current.append('\n')
+                    elif tag == WORD_NAMESPACE + 'p':
+                        #one line per paragraph, like python-docx's paragraph.text
+                        paragraphs.append(''.join(current))
+                        size += len(paragraphs[-1]) + 1
+                        current = []
+                        elem.clear()
     except Exception:
-        return ''
+        pass  #keep the paragraphs read before the error
+    return '\n'.join(paragraphs)[:max_chars]
 
-#Function to preview image files using OCR
+#OCR settings from the `preview.ocr` section of config.yaml (see configure_previews)
+_image_ocr = None
+
+#Function to set the OCR settings used by preview_image in this process
+def configure_previews(config: dict):
+    global _image_ocr
+    _image_ocr = load_ocr(config)
+
+#Function to preview image files using OCR. Results are cached by content
+#hash, images without text are skipped and large images are downscaled first
 def preview_image(file_path: Path, max_chars: int = 500) -> str:
+    global _image_ocr
     try:
-        img = Image.open(file_path) # loads the image file
-        #using pytesseract to extract text from the image
-        text = pytesseract.image_to_string(img) or ''
+        if _image_ocr is None:
+            _image_ocr = ImageOcr()
+        text = _image_ocr.extract(file_path)
         return text[:max_chars]
     except Exception:
         return ''
 
-#Function to retrive metadata and a short content preview for a specified file
-def get_file_metadata(file_path: Path)-> dict:
-    stat = file_path.stat()  # get file statistics
-    #base metadata dictionary
-    metadata = {
-        'path': str(file_path),
-        'name': file_path.name,
-        'size_bytes': stat.st_size,
-        'modified_time': datetime.fromtimestamp(stat.st_mtime).isoformat(),
-        'created_time': datetime.fromtimestamp(stat.st_ctime).isoformat(),
-        'preview': ''
-    }
+#Extensions whose preview is cheap enough to build in the scanning process
+TEXT_EXTENSIONS = ['.txt', '.md', '.log']
+#Extensions whose preview (PDF parsing, DOCX parsing, OCR) is CPU-heavy and
+#is built in the preview process pool when one is configured
+HEAVY_EXTENSIONS = ['.pdf', '.docx', '.png', '.jpg', '.jpeg', '.bmp', '.tiff']
+
+#Function to build the content preview for a file based on its extension
+def get_preview(file_path: Path) -> str:
     ext = file_path.suffix.lower()  # get file extension
     #Determine the preview method based on file extension
-    if ext in ['.txt', '.md', '.log']:
-        metadata['preview'] = preview_text(file_path)
+    if ext in TEXT_EXTENSIONS:
+        return preview_text(file_path)
     elif ext == '.pdf':
-        metadata['preview'] = preview_pdf(file_path)
+        return preview_pdf(file_path)
     elif ext in ['.docx']:
-        metadata['preview'] = preview_docx(file_path)
+        return preview_docx(file_path)
     elif ext in ['.png', '.jpg', '.jpeg', '.bmp', '.tiff']:
-        metadata['preview'] = preview_image(file_path)
-    return metadata
+        return preview_image(file_path)
+    return ''
 
+#Function to build a preview and record how long it took, by extension
+def _timed_preview(file_path: Path) -> str:
+    if file_path.suffix.lower() not in TEXT_EXTENSIONS + HEAVY_EXTENSIONS:
+        return ''  #no preview for this type, nothing worth timing
+    start = time.perf_counter()
+    text = get_preview(file_path)
+    metrics.observe('preview_seconds', time.perf_counter() - start,
+                    ext=file_path.suffix.lower() or 'none')
+    return text
 
-#Function to scan each folder in config and collect metadata for each file.
-def scan_directories(config:dict) -> list:
-    results = []
-    #iterate over each directory to watch
-    for folder in config.get('monitor_folders',[]):
+#Function to retrive metadata and a short content preview for a specified file.
+#Returns a FileRecord, which reads like the metadata dict it replaced. With
+#preview=False the preview is read on first access (or filled in by a pool)
+def get_file_metadata(file_path: Path, stat=None, preview: bool = True) -> FileRecord:
+    if stat is None:
+        stat = file_path.stat()  # get file statistics
+    record = FileRecord.from_stat(file_path, stat)
+    if preview:
+        record.preview = _timed_preview(file_path)
+    return record
+
+
+#Worker initializer: cap the address space of each preview process so a
+#huge image or PDF fails with MemoryError instead of exhausting the machine
+def _init_preview_worker(max_memory_mb, image_ocr=None):
+    global _image_ocr
+    if image_ocr is not None:
+        _image_ocr = image_ocr
+    if not max_memory_mb:
+        return
+    try:
+        import resource
+        limit = int(max_memory_mb) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError):
+        pass  # not supported on this platform
+
+#Worker task: build one preview, giving up after timeout seconds.
+#Returns (preview, seconds) so the parent can record the preview time
+def _preview_worker(path: str, timeout: float) -> tuple:
+    alarm = None
+    start = time.perf_counter()
+    try:
+        import signal
+        if timeout and hasattr(signal, 'SIGALRM'):
+            def on_alarm(signum, frame):
+                raise TimeoutError(path)
+            signal.signal(signal.SIGALRM, on_alarm)
+            alarm = signal
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+        return get_preview(Path(path)), time.perf_counter() - start
+    except (TimeoutError, MemoryError):
+        return '', time.perf_counter() - start
+    finally:
+        if alarm is not None:
+            alarm.setitimer(alarm.ITIMER_REAL, 0)
+
+
+#Process pool that builds CPU-heavy previews in parallel.
+#Each file gets timeout_seconds inside the worker; if a worker does not answer
+#in time (e.g. stuck in native code or killed), the pool is torn down and
+#rebuilt, and that file keeps an empty preview.
+class PreviewPool:
+    def __init__(self, workers: int = None, timeout_seconds: float = 20,
+                 max_memory_mb: int = 1024, image_ocr: ImageOcr = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout_seconds
+        self.max_memory_mb = max_memory_mb
+        self.image_ocr = image_ocr
+        self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            import multiprocessing
+            self._pool = multiprocessing.Pool(
+                self.workers,
+                initializer=_init_preview_worker,
+                initargs=(self.max_memory_mb, self.image_ocr),
+                maxtasksperchild=100
+            )
+        return self._pool
+
+    #fill in the 'preview' field of each metadata dict, in place
+    def fill_previews(self, metas: list) -> list:
+        from multiprocessing import TimeoutError as WorkerTimeout
+        heavy = []
+        for meta in metas:
+            path = Path(meta['path'])
+            if path.suffix.lower() in HEAVY_EXTENSIONS:
+                heavy.append(meta)
+            else:
+                meta['preview'] = _timed_preview(path)
+        while heavy:
+            pool = self._get_pool()
+            jobs = [(meta, pool.apply_async(_preview_worker, (meta['path'], self.timeout)))
+                    for meta in heavy]
+            heavy = []
+            for position, (meta, job) in enumerate(jobs):
+                try:
+                    #the job ahead finished, so this one starts within one timeout
+                    meta['preview'] = self._result(meta, job.get(self.timeout * 2 + 5))
+                except WorkerTimeout:
+                    logging.warning(f"Preview timed out, skipping: {meta['path']}")
+                    metrics.inc('errors_total', stage='preview')
+                    meta['preview'] = ''
+                    self.close()
+                    #resubmit what had not finished to a fresh pool; a job that
+                    #failed gets an empty preview, never a lazy read in this process
+                    for m, j in jobs[position + 1:]:
+                        if not j.ready():
+                            heavy.append(m)
+                        elif j.successful():
+                            m['preview'] = self._result(m, j.get())
+                        else:
+                            metrics.inc('errors_total', stage='preview')
+                            m['preview'] = ''
+                    break
+                except Exception:
+                    metrics.inc('errors_total', stage='preview')
+                    meta['preview'] = ''
+        return metas
+
+    #record the worker's preview time and return the preview text
+    @staticmethod
+    def _result(meta: dict, result: tuple) -> str:
+        text, seconds = result
+        metrics.observe('preview_seconds', seconds,
+                        ext=Path(meta['path']).suffix.lower() or 'none')
+        return text
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+
+_preview_pool = None
+
+#Function to return the shared preview pool configured by the `preview`
+#section of config.yaml, or None when previews are built in-process
+def get_preview_pool(config: dict):
+    global _preview_pool
+    options = config.get('preview') or {}
+    workers = options.get('workers', 0)
+    if not workers or workers <= 1:
+        return None
+    if _preview_pool is None:
+        _preview_pool = PreviewPool(
+            workers=workers,
+            timeout_seconds=options.get('timeout_seconds', 20),
+            max_memory_mb=options.get('max_memory_mb', 1024),
+            image_ocr=load_ocr(config)
+        )
+        atexit.register(_preview_pool.close)
+    return _preview_pool
+
+#Function to build metadata lazily for (path, stat) entries. With a preview
+#pool, entries are read ahead in small chunks so the pool stays busy while
+#the first results are already flowing to the caller.
+def iter_metadata(config: dict, entries):
+    configure_previews(config)
+    pool = get_preview_pool(config)
+    if pool is None:
+        for path, stat in entries:
+            yield get_file_metadata(path, stat)
+        return
+    chunk = []
+    for path, stat in entries:
+        chunk.append(get_file_metadata(path, stat, preview=False))
+        if len(chunk) >= pool.workers * 4:
+            yield from pool.fill_previews(chunk)
+            chunk = []
+    if chunk:
+        yield from pool.fill_previews(chunk)
+
+#Function to build metadata for many files, using the preview pool if configured
+def collect_metadata(config: dict, entries: list) -> list:
+    return list(iter_metadata(config, entries))
+
+#Function to read the previews of FileRecords listed without them (e.g. from
+#a snapshot.Snapshot), using the preview pool if configured
+def fill_previews(config: dict, records: list) -> list:
+    configure_previews(config)
+    pool = get_preview_pool(config)
+    if pool is None:
+        for record in records:
+            record.preview = _timed_preview(Path(record.path))
+        return records
+    return pool.fill_previews(records)
+
+
+#Function to compile gitignore-style exclude patterns into one matcher.
+#A pattern without a slash matches a file or folder name at any depth, a
+#pattern containing a slash matches the path relative to the monitored
+#folder, and a trailing slash restricts the pattern to folders.
+#Returns a function (relative_path, is_dir) -> bool.
+def compile_excludes(patterns):
+    groups = {(False, False): [], (False, True): [], (True, False): [], (True, True): []}
+    for pattern in patterns or []:
+        dirs_only = pattern.endswith('/')
+        pattern = pattern.strip('/')
+        if not pattern:
+            continue
+        groups[('/' in pattern, dirs_only)].append(fnmatch.translate(pattern))
+    matchers = {key: re.compile('|'.join(parts)) for key, parts in groups.items() if parts}
+
+    def is_excluded(rel_path: str, is_dir: bool) -> bool:
+        name = rel_path.rsplit('/', 1)[-1]
+        for (by_path, dirs_only), regex in matchers.items():
+            if dirs_only and not is_dir:
+                continue
+            if regex.match(rel_path if by_path else name):
+                return True
+        return False
+    return is_excluded
+
+
+#Function to walk one monitored folder with os.scandir, depth first.
+#Yields (directory, files) where files lazily yields (Path, stat) for the
+#regular files directly in that directory; it must be consumed before the
+#next directory is produced, since subfolders are discovered while it runs.
+#Only one directory handle is open at a time, and the stat data cached on
+#each DirEntry is reused.
+def _walk(root: Path, recursive: bool, max_depth, is_excluded):
+    stack = [(str(root), 0)]
+    root_prefix = len(str(root)) + 1
+
+    #time spent here is recorded as scan_seconds once per directory,
+    #excluding the time the consumer spends between files
+    def files_in(directory, depth):
+        start = time.perf_counter()
+        elapsed = 0.0
+        found = 0
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        rel_path = entry.path[root_prefix:].replace(os.sep, '/')
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive and (max_depth is None or depth < max_depth) \
+                                    and not is_excluded(rel_path, True):
+                                stack.append((entry.path, depth + 1))
+                        elif entry.is_file() and not is_excluded(rel_path, False):
+                            item = Path(entry.path), entry.stat()
+                            found += 1
+                            elapsed += time.perf_counter() - start
+                            start = None
+                            yield item
+                            start = time.perf_counter()
+                    except OSError:
+                        #entry vanished between listing and stat
+                        continue
+        except OSError:
+            #folder vanished or is unreadable
+            metrics.inc('errors_total', stage='scan')
+            return
+        finally:
+            if start is not None:
+                elapsed += time.perf_counter() - start
+            metrics.observe('scan_seconds', elapsed)
+            metrics.inc('files_scanned_total', found)
+
+    while stack:
+        directory, depth = stack.pop()
+        yield directory, files_in(directory, depth)
+
+
+#Function to walk every monitored folder (or the given folders) using the
+#`scan` section of config.yaml: recursive, max_depth and exclude patterns
+def _walk_folders(config: dict, folders=None):
+    options = config.get('scan') or {}
+    recursive = options.get('recursive', False)
+    max_depth = options.get('max_depth')
+    is_excluded = compile_excludes(options.get('exclude', []))
+    for folder in config.get('monitor_folders', []) if folders is None else folders:
         p = Path(folder).expanduser()
-        if not p.exists():
+        if not p.is_dir():
             #skip if folder does not exist
             continue
-        #iterate over items in the directory
-        for file_path in p.iterdir():
-            if file_path.is_file():
-                #gets metadata and append to results
-                results.append(get_file_metadata(file_path))
-    return results
+        yield p, _walk(p, recursive, max_depth, is_excluded)
+
+
+#Function returning a predicate path -> bool that tells whether a scan with
+#this config would report the file (inside a monitored folder, within
+#max_depth and not excluded). Used to filter watcher events the same way.
+def make_scope_filter(config: dict):
+    options = config.get('scan') or {}
+    recursive = options.get('recursive', False)
+    max_depth = options.get('max_depth')
+    is_excluded = compile_excludes(options.get('exclude', []))
+    roots = [str(Path(folder).expanduser()) for folder in config.get('monitor_folders', [])]
+
+    def in_scope(path) -> bool:
+        path = str(path)
+        for root in roots:
+            if not path.startswith(os.path.join(root, '')):
+                continue
+            parts = path[len(root) + 1:].replace(os.sep, '/').split('/')
+            depth = len(parts) - 1
+            if depth and (not recursive or (max_depth is not None and depth > max_depth)):
+                return False
+            for i in range(1, len(parts)):
+                if is_excluded('/'.join(parts[:i]), True):
+                    return False
+            return not is_excluded('/'.join(parts), False)
+        return False
+    return in_scope
+
+
+#Function to stream (Path, stat) for every file in the monitored folders
+def iter_entries(config: dict, folders=None):
+    for _, directories in _walk_folders(config, folders):
+        for _, files in directories:
+            yield from files
+
+
+#Function to stream metadata for every file in the monitored folders
+def iter_files(config: dict, folders=None):
+    return iter_metadata(config, iter_entries(config, folders))
+
+
+#Function to stream (Path, stat) for new or changed files only, comparing
+#each directory against the persistent index. Once the generator is
+#exhausted, paths that no longer exist are appended to `deleted` and dropped
+#from the index; changed files are recorded by the caller once processed, so
+#an interrupted run picks them up again.
+def iter_changed_entries(config: dict, index, deleted: list = None, folders=None):
+    deleted = [] if deleted is None else deleted
+    for root, directories in _walk_folders(config, folders):
+        visited = set()
+        for directory, files in directories:
+            visited.add(directory)
+            known = index.entries_in(directory)
+            for file_path, stat in files:
+                previous = known.pop(str(file_path), None)
+                if previous != file_state(stat):
+                    yield file_path, stat
+            #whatever is left in the index no longer exists on disk
+            gone = list(known)
+            deleted.extend(gone)
+            index.forget(gone)
+        #folders that disappeared (or are now excluded) as a whole
+        for directory in index.directories_under(str(root)):
+            if directory not in visited:
+                gone = list(index.entries_in(directory))
+                deleted.extend(gone)
+                index.forget(gone)
+
+
+#Function to stream metadata for new or changed files only (see
+#iter_changed_entries). Previews are only built for files whose
+#(inode, size, mtime_ns) differ from the index.
+def iter_changes(config: dict, index, deleted: list = None, folders=None):
+    return iter_metadata(config, iter_changed_entries(config, index, deleted, folders))
+
+
+#Function to scan each folder in config and collect metadata for each file.
+#With a FileIndex only new or changed files are returned (see scan_changes).
+#The whole listing is kept, so previews are only read when accessed
+def scan_directories(config:dict, index=None) -> list:
+    if index is not None:
+        return scan_changes(config, index)[0]
+    configure_previews(config)
+    return [get_file_metadata(path, stat, preview=False) for path, stat in iter_entries(config)]
+
+#Function to compare each folder against the persistent index.
+#Returns (new or changed file metadata, deleted paths)
+def scan_changes(config:dict, index) -> tuple:
+    deleted = []
+    configure_previews(config)
+    changed = [get_file_metadata(path, stat, preview=False)
+               for path, stat in iter_changed_entries(config, index, deleted)]
+    return changed, deleted
 
 def main():
     #load settings from config.yaml
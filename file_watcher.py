@@ -1,64 +1,326 @@
+import os
 import time
 import logging
+import threading
+from pathlib import Path
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
-from file_scanner import load_config, scan_directories
-from organizer import suggest_actions
-from utils import apply_suggestion
+from action_log import log_suggestion
+from decision_index import learnable
+from duplicates import filter_duplicates
+from file_scanner import load_config, iter_entries, iter_metadata, collect_metadata, make_scope_filter
+from file_index import file_state
+from metrics import metrics
+from mover import load_mover
+from organizer import DEFAULT_PROMPT_TEMPLATE, llm_retry_after
+from pipeline import get_batching, get_concurrency, suggest_many
+from plan import build_plan, execute_plan, plan_item
+from rules import load_rules
+
+# Suffixes of files that are still being written and will be renamed when done
+TEMP_SUFFIXES = ('.crdownload', '.part', '.partial', '.download', '.tmp', '.swp')
+
+# Event types that mean a file's content or location changed. Opened and
+# closed-without-write events are ignored: our own previews produce them.
+CHANGE_EVENTS = {'created', 'modified', 'moved', 'closed'}
+
 
 class ChangeHandler(FileSystemEventHandler):
     """
-    Handler for filesystem events that triggers the organizing job.
+    Handler for filesystem events that organizes only the files named in them.
+
+    Events are collected per path and a path is processed once it has been
+    quiet for `watch.debounce_seconds`, so bursts (e.g. a browser writing a
+    .crdownload and renaming it) cost a single suggestion. Paths produced by
+    our own moves are ignored for `watch.suppress_seconds`.
+
+    With a `hash_index`, exact duplicates of known files are deleted before
+    anything else. With a `queue` (main.py --workers), settled paths are only
+    added to the durable work queue and the worker processes organize them.
     """
-    def __init__(self, config, dry_run=False, custom_prompt=None):
+    def __init__(self, config, dry_run=False, custom_prompt=None, cache=None, index=None,
+                 limiter=None, rules=None, decisions=None, queue=None, hash_index=None):
         super().__init__()
         self.config = config
         self.dry_run = dry_run
         self.custom_prompt = custom_prompt
+        self.cache = cache
+        self.index = None if dry_run else index
+        self.limiter = limiter
+        self.rules = rules if rules is not None else load_rules(config)
+        self.decisions = decisions
+        self.queue = queue
+        self.hash_index = hash_index
+        self.concurrency = get_concurrency(config)
+        self.batching = get_batching(config)
         self.auto_confirm = config.get('auto_confirm', False)
         self.root_folder = config.get('root_folder')
+        self.mover = load_mover(config)
+
+        options = config.get('watch') or {}
+        self.debounce_seconds = options.get('debounce_seconds', 2.0)
+        self.suppress_seconds = options.get('suppress_seconds', 10.0)
+        self.in_scope = make_scope_filter(config)
+
+        self._pending = {}      # path -> monotonic time of its latest event
+        self._suppressed = {}   # path -> monotonic time until which events are ignored
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._worker = None
 
     def on_any_event(self, event):  # covers create, modify, move, delete
-        logging.info(f"Detected filesystem event: {event.event_type} - {event.src_path}")
-        self.run_job()
+        if event.is_directory:
+            return
+        logging.debug(f"Detected filesystem event: {event.event_type} - {event.src_path}")
+        metrics.inc('watch_events_total', type=event.event_type)
+        if event.event_type == 'deleted':
+            self._discard(event.src_path)
+        elif event.event_type == 'moved':
+            self._discard(event.src_path)
+            self.schedule_path(event.dest_path)
+        elif event.event_type in CHANGE_EVENTS:
+            self.schedule_path(event.src_path)
+
+    def schedule_path(self, path, now=None):
+        """
+        Queue a path for processing, restarting its quiet window.
+        """
+        path = os.fsdecode(path)
+        if path.lower().endswith(TEMP_SUFFIXES) or not self.in_scope(path):
+            return
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self._suppressed.get(path, 0) > now:
+                return
+            self._pending[path] = now
+
+    def suppress_path(self, path, now=None):
+        """
+        Ignore events for a path we just created ourselves.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._suppressed[str(path)] = now + self.suppress_seconds
+            self._pending.pop(str(path), None)
+
+    def _discard(self, path):
+        path = os.fsdecode(path)
+        with self._lock:
+            self._pending.pop(path, None)
+        if self.index is not None:
+            self.index.forget([path])
+
+    def take_ready(self, now=None) -> list:
+        """
+        Remove and return the pending paths that have been quiet long enough.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            ready = sorted(p for p, t in self._pending.items() if now - t >= self.debounce_seconds)
+            for path in ready:
+                del self._pending[path]
+            self._suppressed = {p: t for p, t in self._suppressed.items() if t > now}
+        return ready
+
+    def process_ready(self, now=None) -> int:
+        """
+        Process every path whose quiet window has elapsed. Returns how many were handled.
+        """
+        ready = self.take_ready(now)
+        if ready:
+            metrics.inc('watch_batches_total')
+            self.process_paths(ready)
+        return len(ready)
+
+    def process_paths(self, paths):
+        """
+        Suggest and apply actions for the files named by events, keeping up
+        to `llm.concurrency` suggestions in flight.
+        """
+        entries = [entry for entry in map(self._prepare, paths) if entry is not None]
+        entries = list(self._without_duplicates(entries))
+        if self.queue is not None:
+            self.queue.enqueue(str(path) for path, _ in entries)
+            return
+        self._process_files(collect_metadata(self.config, entries))
+
+    def _without_duplicates(self, entries):
+        """
+        Stream (path, stat) entries that are not copies of known files; the
+        copies are deleted once the entries are consumed.
+        """
+        if self.hash_index is None:
+            yield from entries
+            return
+        duplicates = {}
+        yield from filter_duplicates(self.config, entries, self.hash_index, duplicates)
+        items = [({'path': path, 'name': Path(path).name}, suggestion)
+                 for path, suggestion in sorted(duplicates.items())]
+        for item in items:
+            log_suggestion(*item, prefix='[Watcher] ')
+        if self.dry_run or not items:
+            return
+        try:
+            execute_plan(build_plan(items), auto_confirm=self.auto_confirm, mover=self.mover)
+        except Exception as e:
+            metrics.inc('errors_total', stage='watch')
+            logging.error(f"[Watcher] Error deleting {len(items)} duplicates: {e}")
+            return
+        # Copies still there (delete declined or failed) stay out of the index,
+        # so the next scan offers to delete them again
+        if self.index is not None:
+            self.index.forget([path for path in sorted(duplicates) if not os.path.lexists(path)])
+
+    def _process_files(self, files):
+        suggestions = suggest_many(
+            files,
+            custom_prompt=self.custom_prompt,
+            cache=self.cache,
+            limiter=self.limiter,
+            concurrency=self.concurrency,
+            rules=self.rules,
+            decisions=self.decisions,
+            **self.batching
+        )
+        items = []
+        deferred = []
+        for file_meta, suggestion in suggestions:
+            if suggestion is None:
+                deferred.append(file_meta['path'])
+                continue
+            log_suggestion(file_meta, suggestion, prefix='[Watcher] ')
+            # Held until large moves finish: only the decision index needs the preview
+            keep = ('preview',) if self.decisions is not None and learnable(file_meta, suggestion) else ()
+            items.append(plan_item(file_meta, suggestion, keep))
+        if deferred:
+            # The LLM is unavailable: try these again once requests resume
+            delay = max(llm_retry_after(), self.debounce_seconds)
+            logging.warning(f"[Watcher] LLM unavailable: retrying {len(deferred)} files in {delay:.0f}s")
+            later = time.monotonic() + delay - self.debounce_seconds
+            for path in deferred:
+                self.schedule_path(path, now=later)
+        if self.dry_run or not items:
+            return
+
+        def record_moves(moved):
+            # Runs once large background copies are in place too
+            if self.hash_index is not None:
+                self.hash_index.moved(moved)
+            if self.decisions is not None:
+                self.decisions.learn(items, moved, self.custom_prompt or DEFAULT_PROMPT_TEMPLATE)
+            for file_meta, _ in items:
+                self._applied(file_meta, moved.get(file_meta['path']))
+
+        # Not waiting for large cross-device moves: the next files keep flowing
+        try:
+            execute_plan(build_plan(items, root_folder=self.root_folder),
+                         auto_confirm=self.auto_confirm, mover=self.mover, on_complete=record_moves)
+        except Exception as e:
+            metrics.inc('errors_total', stage='watch')
+            logging.error(f"[Watcher] Error applying {len(items)} suggestions: {e}")
+
+    def process_path(self, path):
+        """
+        Suggest and apply actions for a single file named by an event.
+        """
+        self.process_paths([path])
+
+    def _prepare(self, path):
+        """
+        Return (path, stat) for a settled file, or None if there is nothing to do.
+        """
+        file_path = Path(path)
+        try:
+            stat = file_path.stat()
+            if not file_path.is_file():
+                return None
+        except OSError:
+            return None  # gone before it settled
+        if self.index is not None and self.index.lookup(path) == file_state(stat):
+            return None  # already processed in this state
+        return file_path, stat
+
+    def _applied(self, file_meta, new_path):
+        """
+        Bookkeeping after a file's suggestion ran: suppress events for its new
+        location and update the index.
+        """
+        path = file_meta['path']
+        if new_path is not None:
+            self.suppress_path(new_path)
+        if self.index is not None:
+            if new_path is None and Path(path).exists():
+                self.index.record(file_meta)
+            else:
+                self.index.forget([path])
 
     def run_job(self):
-        files = scan_directories(self.config)
-        logging.info(f"[Watcher] Scanned {len(files)} files.")
-        for file_meta in files:
-            suggestion = suggest_actions(file_meta, custom_prompt=self.custom_prompt)
-            logging.info(
-                f"[Watcher] File: {file_meta['name']} | "
-                f"Rename → {suggestion.get('suggested_name')} | "
-                f"Move → {suggestion.get('suggested_folder')} | "
-                f"Delete? {suggestion.get('delete')}"
-            )
-            if not self.dry_run:
-                apply_suggestion(
-                    file_meta,
-                    suggestion,
-                    root_folder=self.root_folder,
-                    auto_confirm=self.auto_confirm
-                )
-
-
-def start_watcher(config, dry_run=False, custom_prompt=None):
+        """
+        Organize every file in the monitored folders (full sweep).
+        """
+        entries = self._without_duplicates(iter_entries(self.config))
+        if self.queue is not None:
+            self.queue.enqueue(str(path) for path, _ in entries)
+            return
+        self._process_files(iter_metadata(self.config, entries))
+
+    def start(self):
+        """
+        Start the background thread that drains settled paths.
+        """
+        self._stop.clear()
+        self._worker = threading.Thread(target=self._drain, name='watcher-drain', daemon=True)
+        self._worker.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._worker is not None:
+            self._worker.join()
+        self.mover.close()   # let background moves finish
+
+    def _drain(self):
+        interval = max(0.05, self.debounce_seconds / 4)
+        while not self._stop.wait(interval):
+            # An error in one batch must not stop the thread, and with it watch mode
+            try:
+                self.process_ready()
+            except Exception as e:
+                metrics.inc('errors_total', stage='watch')
+                logging.exception(f"[Watcher] Error processing changed files: {e}")
+
+
+def start_watcher(config, dry_run=False, custom_prompt=None, cache=None, index=None,
+                  limiter=None, rules=None, decisions=None, queue=None, hash_index=None):
     """
     Start the watchdog observer for real-time monitoring.
 
     :param config: Configuration dict from config.yaml
     :param dry_run: If True, suggestions are logged but not applied.
     :param custom_prompt: Optional custom prompt text for file organization
+    :param cache: Optional SuggestionCache shared across events
+    :param index: Optional FileIndex to skip files already processed
+    :param limiter: Optional RateLimiter throttling LLM calls
+    :param rules: Optional compiled RuleSet checked before the LLM
+    :param decisions: Optional DecisionIndex of past decisions, updated after each move
+    :param queue: Optional WorkQueue; settled paths are queued for worker
+        processes instead of being organized here
+    :param hash_index: Optional HashIndex; copies of known files are deleted
+        instead of being organized
     """
     paths = config.get('monitor_folders', [])
-    event_handler = ChangeHandler(config, dry_run=dry_run, custom_prompt=custom_prompt)
+    event_handler = ChangeHandler(
+        config, dry_run=dry_run, custom_prompt=custom_prompt, cache=cache, index=index,
+        limiter=limiter, rules=rules, decisions=decisions, queue=queue, hash_index=hash_index
+    )
     observer = Observer()
 
+    recursive = (config.get('scan') or {}).get('recursive', False)
     for path in paths:
-        observer.schedule(event_handler, path, recursive=False)
+        observer.schedule(event_handler, str(Path(path).expanduser()), recursive=recursive)
         logging.info(f"Watching directory: {path}")
 
+    event_handler.start()
     observer.start()
     try:
         while True:
@@ -67,3 +329,4 @@ def start_watcher(config, dry_run=False, custom_prompt=None):
         observer.stop()
         logging.info("File watcher stopped by user.")
     observer.join()
+    event_handler.stop()
@@ -0,0 +1,335 @@
+"""
+llm_backend.py
+
+Pluggable LLM backends behind organizer's chains, chosen with `llm.backend`:
+- `http` (default): a pooled keep-alive httpx client for any OpenAI-compatible
+  /chat/completions endpoint, the OpenAI API or a local server (llama.cpp,
+  Ollama, vLLM, a test stand-in) given as `llm.base_url`
+- `langchain`: LangChain's ChatOpenAI, as before, with the same timeout and
+  retry settings
+- Per-request timeouts and jittered exponential backoff on 429, 5xx and
+  connection errors; a request still failing after its retries raises
+  LLMUnavailable instead of looking like an answer
+- A circuit breaker that stops calling the provider for a while after
+  repeated failures, so files are deferred and retried later rather than
+  each waiting out its own retries
+"""
+import logging
+import os
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+from metrics import metrics
+
+DEFAULT_BASE_URL = 'https://api.openai.com/v1'
+DEFAULT_TIMEOUT = 60.0
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BACKOFF = 1.0
+DEFAULT_MAX_BACKOFF = 30.0
+DEFAULT_POOL_SIZE = 8
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_SECONDS = 60.0
+
+# Status codes worth retrying: rate limited, or a server-side problem
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LLMUnavailable(Exception):
+    """
+    The provider could not be reached or kept failing; the request should
+    be retried later.
+    """
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMRequestError(Exception):
+    """The provider rejected a request (e.g. bad key or model); retrying will not help."""
+
+
+def backoff_delay(attempt: int, base: float = DEFAULT_BACKOFF, cap: float = DEFAULT_MAX_BACKOFF,
+                  rand: Callable[[], float] = random.random) -> float:
+    """
+    Seconds to wait before retry number attempt + 1: a random share of
+    base * 2 ** attempt, capped ("full jitter"), so clients that failed
+    together do not retry together.
+    """
+    return rand() * min(cap, base * 2 ** attempt)
+
+
+def _retry_after(response) -> Optional[float]:
+    # Retry-After in seconds; the HTTP-date form is rare for APIs and ignored
+    try:
+        return max(0.0, float(response.headers.get('retry-after', '')))
+    except ValueError:
+        return None
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures and then refuses
+    requests for reset_seconds. After that, one request per reset_seconds is
+    let through as a probe: a success closes the breaker, a failure keeps it
+    open for another reset_seconds.
+    """
+    def __init__(self, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 reset_seconds: float = DEFAULT_RESET_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.failures = 0
+        self._open_until = None   # None while closed
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._open_until is None:
+                return 'closed'
+            return 'open' if self.clock() < self._open_until else 'half_open'
+
+    def allow(self) -> bool:
+        """Return whether a request may be sent now."""
+        with self._lock:
+            if self._open_until is None:
+                return True
+            now = self.clock()
+            if now < self._open_until:
+                return False
+            # Half-open: let this request probe, the next ones wait another period
+            self._open_until = now + self.reset_seconds
+            return True
+
+    def retry_after(self) -> float:
+        """Seconds until the breaker lets a request through again (0 if closed)."""
+        with self._lock:
+            if self._open_until is None:
+                return 0.0
+            return max(0.0, self._open_until - self.clock())
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._open_until is not None:
+                logging.info("LLM provider is reachable again; resuming LLM requests")
+            self.failures = 0
+            self._open_until = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._open_until is None and self.failures < self.failure_threshold:
+                return
+            if self._open_until is None:
+                metrics.inc('llm_circuit_opened_total')
+                logging.warning(
+                    f"LLM provider failed {self.failures} times in a row; pausing LLM "
+                    f"requests for {self.reset_seconds:g} seconds and deferring files"
+                )
+            self._open_until = self.clock() + self.reset_seconds
+
+
+class PromptChain:
+    """
+    Prompt template bound to a backend. Templates use LangChain's f-string
+    syntax ({field}, with {{ and }} for literal braces), so custom prompts
+    work with either backend.
+    """
+    def __init__(self, backend: 'HTTPBackend', template: str):
+        self.backend = backend
+        self.template = template
+
+    def run(self, **inputs) -> str:
+        return self.backend.complete(self.template.format(**inputs))
+
+
+class HTTPBackend:
+    """
+    Client for an OpenAI-compatible chat completions endpoint, sharing one
+    pool of keep-alive connections between threads.
+    """
+    def __init__(self, model: str, base_url: str = DEFAULT_BASE_URL, api_key: Optional[str] = None,
+                 timeout: float = DEFAULT_TIMEOUT, connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                 max_retries: int = DEFAULT_MAX_RETRIES, backoff: float = DEFAULT_BACKOFF,
+                 max_backoff: float = DEFAULT_MAX_BACKOFF, pool_size: int = DEFAULT_POOL_SIZE,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.model = model
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool_size = pool_size
+        self.sleep = sleep
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _get_client(self):
+        with self._lock:
+            if self._client is None:
+                import httpx
+                headers = {'Authorization': f"Bearer {self.api_key}"} if self.api_key else {}
+                self._client = httpx.Client(
+                    base_url=self.base_url, headers=headers,
+                    timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                    limits=httpx.Limits(max_connections=self.pool_size,
+                                        max_keepalive_connections=self.pool_size)
+                )
+            return self._client
+
+    def chain(self, template: str) -> PromptChain:
+        return PromptChain(self, template)
+
+    def complete(self, prompt: str) -> str:
+        """
+        Send one prompt and return the reply text, retrying transient failures.
+
+        :raises LLMUnavailable: if the provider still failed after max_retries retries
+        :raises LLMRequestError: if the provider rejected the request
+        """
+        import httpx
+        client = self._get_client()
+        payload = {'model': self.model, 'temperature': 0,
+                   'messages': [{'role': 'user', 'content': prompt}]}
+        for attempt in range(self.max_retries + 1):
+            wait = None
+            try:
+                response = client.post('/chat/completions', json=payload)
+            except httpx.TransportError as e:   # connection errors and timeouts
+                error = f"{type(e).__name__}: {e}"
+            else:
+                if response.status_code in RETRY_STATUS:
+                    error = f"HTTP {response.status_code}"
+                    wait = _retry_after(response)
+                elif response.is_error:
+                    raise LLMRequestError(f"HTTP {response.status_code}: {response.text[:200]}")
+                else:
+                    try:
+                        return response.json()['choices'][0]['message']['content']
+                    except (ValueError, KeyError, IndexError, TypeError):
+                        raise LLMRequestError(f"Unexpected reply: {response.text[:200]}")
+            if attempt == self.max_retries:
+                break
+            metrics.inc('llm_retries_total')
+            delay = backoff_delay(attempt, self.backoff, self.max_backoff)
+            if wait is not None:
+                delay = min(max(delay, wait), self.max_backoff)
+            logging.debug(f"LLM request failed ({error}); retrying in {delay:.1f}s")
+            self.sleep(delay)
+        raise LLMUnavailable(f"LLM request failed after {self.max_retries + 1} attempts: {error}")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+
+def _is_transient(error: Exception) -> bool:
+    # openai / httpx exceptions raised through LangChain, matched by name so
+    # neither package has to be imported here
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status in RETRY_STATUS
+    return type(error).__name__ in ('APIConnectionError', 'APITimeoutError', 'RateLimitError',
+                                    'InternalServerError', 'ConnectError', 'ReadTimeout',
+                                    'ConnectTimeout', 'RemoteProtocolError')
+
+
+class LangChainChain:
+    """LLMChain whose transient provider errors surface as LLMUnavailable."""
+    def __init__(self, chain):
+        self.chain = chain
+
+    def run(self, **inputs) -> str:
+        try:
+            return self.chain.run(**inputs)
+        except Exception as e:
+            if _is_transient(e):
+                raise LLMUnavailable(f"LLM request failed: {e}") from e
+            raise
+
+
+class LangChainBackend:
+    """
+    LangChain's ChatOpenAI; its OpenAI client does the retrying (with backoff).
+    """
+    def __init__(self, model: str, base_url: str = DEFAULT_BASE_URL, api_key: Optional[str] = None,
+                 timeout: float = DEFAULT_TIMEOUT, max_retries: int = DEFAULT_MAX_RETRIES, **_):
+        self.model = model
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._llm = None
+        self._lock = threading.Lock()
+
+    def get_llm(self):
+        with self._lock:
+            if self._llm is None:
+                from langchain_community.chat_models import ChatOpenAI   # community-maintained
+                self._llm = ChatOpenAI(
+                    model_name=self.model,
+                    temperature=0,
+                    openai_api_key=self.api_key,
+                    openai_api_base=self.base_url,
+                    request_timeout=self.timeout,
+                    max_retries=self.max_retries
+                )
+            return self._llm
+
+    def chain(self, template: str) -> LangChainChain:
+        from langchain.chains import LLMChain                        # still works for now
+        from langchain.prompts import ChatPromptTemplate
+        return LangChainChain(LLMChain(llm=self.get_llm(), prompt=ChatPromptTemplate.from_template(template)))
+
+    def close(self) -> None:
+        pass
+
+
+BACKENDS = {'http': HTTPBackend, 'langchain': LangChainBackend}
+
+
+def get_llm_options(config: dict) -> dict:
+    """
+    Read the backend settings from the `llm` section of config.yaml.
+
+    :returns: {'backend': name, 'options': backend keyword arguments,
+        'breaker': CircuitBreaker keyword arguments}
+    """
+    options = config.get('llm') or {}
+    backend = options.get('backend', 'http')
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown llm.backend {backend!r}; expected one of {', '.join(BACKENDS)}")
+    api_key_env = options.get('api_key_env', 'OPENAI_API_KEY')
+    breaker = options.get('circuit') or {}
+    return {
+        'backend': backend,
+        'options': {
+            'model': options.get('model') or os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo'),
+            'base_url': options.get('base_url') or os.getenv('OPENAI_BASE_URL', DEFAULT_BASE_URL),
+            # Read when the backend is built, after .env has been loaded
+            'api_key': os.getenv(api_key_env) if api_key_env else None,
+            'timeout': options.get('timeout_seconds', DEFAULT_TIMEOUT),
+            'connect_timeout': options.get('connect_timeout_seconds', DEFAULT_CONNECT_TIMEOUT),
+            'max_retries': options.get('max_retries', DEFAULT_MAX_RETRIES),
+            'backoff': options.get('backoff_seconds', DEFAULT_BACKOFF),
+            'max_backoff': options.get('max_backoff_seconds', DEFAULT_MAX_BACKOFF),
+            'pool_size': options.get('pool_size', options.get('concurrency', DEFAULT_POOL_SIZE)),
+        },
+        'breaker': {
+            'failure_threshold': breaker.get('failure_threshold', DEFAULT_FAILURE_THRESHOLD),
+            'reset_seconds': breaker.get('reset_seconds', DEFAULT_RESET_SECONDS),
+        }
+    }
+
+
+def create_backend(backend: str, options: dict):
+    """Build the named backend with options from get_llm_options."""
+    return BACKENDS[backend](**options)
@@ -3,19 +3,35 @@ main.py
 
 Entry point for Auto File Organizer:
 - Parses CLI args
-- Either schedules polling or starts real-time watch
+- Either polls the monitored folders (adaptively, per folder) or starts real-time watch
 - Generates LLM-based suggestions
 - Applies file operations (rename/move/delete)
 """
 import argparse
+import atexit
+import os
+import sys
 import time
-import schedule
 import logging
+from pathlib import Path
+from typing import Optional
 
-from file_scanner import load_config, scan_directories
-from organizer import suggest_actions
-from utils import apply_suggestion
-from file_watcher import start_watcher
+from action_log import action_log, configure_logging, load_action_log, log_suggestion
+from decision_index import DecisionIndex, learnable, load_decision_index
+from duplicates import HashIndex, duplicate_decisions, filter_duplicates, load_hash_index
+from file_scanner import load_config, iter_changed_entries, iter_entries, iter_metadata
+from file_index import FileIndex, load_index
+from metrics import load_metrics_server, metrics
+from mover import Mover, load_mover
+from organizer import DEFAULT_PROMPT_TEMPLATE, configure_llm, llm_retry_after, prompt_token_stats
+from pipeline import get_batching, get_concurrency, suggest_many
+from plan import (PlanJournal, build_plan, execute_plan, get_journal_options,
+                  latest_journal, plan_item, resume_plan, undo_plan)
+from plan_file import PlanWriter, load_plan_items
+from poll_scheduler import load_scheduler
+from rate_limiter import RateLimiter, load_limiter
+from rules import RuleSet, load_rules
+from suggestion_cache import DEFAULT_CACHE_PATH, SuggestionCache, load_cache
 
 
 def parse_args() -> argparse.Namespace:
@@ -47,38 +63,334 @@ def parse_args() -> argparse.Namespace:
         "--auto-confirm", action="store_true",
         help="Skip user confirmation prompts"
     )
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help="Bypass the suggestion cache and always query the LLM"
+    )
+    parser.add_argument(
+        "--purge-cache", action="store_true",
+        help="Delete all cached suggestions and exit"
+    )
+    parser.add_argument(
+        "--full-scan", action="store_true",
+        help="Clear the file-state index and re-read every file"
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="Finish the last interrupted run from its journal and exit"
+    )
+    parser.add_argument(
+        "--undo", action="store_true",
+        help="Move the files of the last run back to where they were and exit"
+    )
+    parser.add_argument(
+        "--save-plan", metavar="PATH",
+        help="With --dry-run: scan once and save the suggestions to a plan file"
+    )
+    parser.add_argument(
+        "--apply-plan", metavar="PATH",
+        help="Apply a saved plan without calling the LLM, skipping files changed since, and exit"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=0, metavar="N",
+        help="Queue files durably and organize them in N worker processes"
+    )
+    parser.add_argument(
+        "--startup-profile", action="store_true",
+        help="Run the command with import timing and print a startup report"
+    )
     return parser.parse_args()
 
 
-def job(config: dict, dry_run: bool = False, custom_prompt: str = None) -> None:
+def job(config: dict, dry_run: bool = False, custom_prompt: str = None,
+        cache: SuggestionCache = None, index: FileIndex = None,
+        limiter: RateLimiter = None, hash_index: HashIndex = None,
+        rules: RuleSet = None, decisions: DecisionIndex = None, folders: list = None,
+        plan_writer: PlanWriter = None, mover: Mover = None) -> Optional[float]:
     """
-    Scan directories, generate suggestions, and apply or log actions.
+    Scan directories, generate suggestions, and log them; unless dry_run,
+    apply them all as one journaled plan (see plan.py).
 
     :param config: Configuration dict from config.yaml
     :param dry_run: If True, do not apply file operations.
     :param custom_prompt: Optional custom prompt text for file organization
+    :param cache: Optional SuggestionCache to skip LLM calls for unchanged files
+    :param index: Optional FileIndex; only new or changed files are processed.
+        Ignored on dry runs so a later real run still sees every file.
+    :param limiter: Optional RateLimiter shared across runs; built from config if None
+    :param hash_index: Optional HashIndex; duplicates are then deleted up front
+        instead of being sent to the LLM
+    :param rules: Compiled RuleSet checked before the LLM; compiled from config if None
+    :param decisions: Optional DecisionIndex; similar past decisions are reused
+        instead of asking the LLM, and applied moves are added to it
+    :param folders: Monitored folders to scan; all of them if None
+    :param plan_writer: Optional PlanWriter every suggestion is saved to,
+        for a later --apply-plan
+    :param mover: Optional Mover shared across runs. Large cross-device moves
+        then finish in the background after job() returns, and the moved files
+        are recorded once they are in place; without one, job() waits for them.
+    :returns: Seconds after which to scan the folders again if files were
+        deferred because the LLM was unavailable, else None
     """
-    files = scan_directories(config)
-    logging.info(f"Scanned {len(files)} files.")
-
+    if dry_run:
+        index = None
     auto_confirm = config.get('auto_confirm', False)
     root_folder = config.get('root_folder')
 
-    for file_meta in files:
-        suggestion = suggest_actions(file_meta, custom_prompt=custom_prompt)
+    # Exact duplicates are handled locally, before any LLM work: across every
+    # folder on the first run, after that among the scanned files only
+    # (file_meta, suggestion) pairs applied as one plan at the end, with only
+    # the fields the plan and the indexes need (see plan.plan_item)
+    items = []
+    duplicates = {}
+    if hash_index is not None and not hash_index.is_seeded(config):
+        duplicates = duplicate_decisions(config, hash_index)
+
+    # Files are streamed from the scanner, so suggestions start with the first file found
+    deleted = []
+    if index is not None:
+        entries = iter_changed_entries(config, index, deleted, folders)
+    else:
+        entries = iter_entries(config, folders)
+    if hash_index is not None:
+        entries = filter_duplicates(config, entries, hash_index, duplicates)
+    if plan_writer is not None:
+        entries = plan_writer.scanned(entries)
+    files = iter_metadata(config, entries)
+
+    if limiter is None:
+        limiter = load_limiter(config)
+    if rules is None:
+        rules = load_rules(config)
+    suggestions = suggest_many(
+        files,
+        custom_prompt=custom_prompt,
+        cache=cache,
+        limiter=limiter,
+        concurrency=get_concurrency(config),
+        rules=rules,
+        decisions=decisions,
+        **get_batching(config)
+    )
+    scanned = 0
+    deferred = 0
+    for file_meta, suggestion in suggestions:
+        scanned += 1
+        if suggestion is None:
+            # Not recorded in the index, so the next scan picks it up again
+            deferred += 1
+            continue
+        log_suggestion(file_meta, suggestion)
+        if plan_writer is not None:
+            plan_writer.add(file_meta, suggestion)
+        if not dry_run:
+            # The preview is only kept for decisions the decision index will learn from
+            keep = ('preview',) if decisions is not None and learnable(file_meta, suggestion) else ()
+            items.append(plan_item(file_meta, suggestion, keep))
+    for path, suggestion in sorted(duplicates.items()):
+        file_meta = {'path': path, 'name': Path(path).name}
+        log_suggestion(file_meta, suggestion)
+        if plan_writer is not None:
+            plan_writer.add(file_meta, suggestion)
+        items.append((file_meta, suggestion))
+
+    # Apply everything as one batch: collisions resolved, folders created once, journaled
+    if not dry_run and items:
+        plan = build_plan(items, root_folder=root_folder)
+        options = get_journal_options(config)
+        journal = PlanJournal.create(**options) if options and len(plan) else None
+
+        def record_moves(moved: dict) -> None:
+            if hash_index is not None:
+                hash_index.moved(moved)
+            if decisions is not None:
+                decisions.learn(items, moved, custom_prompt or DEFAULT_PROMPT_TEMPLATE)
+
+        if mover is None:
+            record_moves(execute_plan(plan, journal, auto_confirm=auto_confirm,
+                                      mover=load_mover(config)))
+        else:
+            execute_plan(plan, journal, auto_confirm=auto_confirm, mover=mover,
+                         on_complete=record_moves)
+    # Recorded right away, so a scan while a large copy runs does not pick the file up again
+    if index is not None:
+        for file_meta, _ in items:
+            if file_meta['path'] not in duplicates:
+                index.record(file_meta)
+
+    if index is not None:
+        logging.info(f"Scanned {scanned} new or changed files, {len(deleted)} removed.")
+    else:
+        logging.info(f"Scanned {scanned} files.")
+    action_log.record('scan', files=scanned, removed=len(deleted), duplicates=len(duplicates),
+                      deferred=deferred, folders=folders)
+    retry_after = None
+    if deferred:
+        retry_after = llm_retry_after()
+        logging.warning(
+            f"Deferred {deferred} files: the LLM is unavailable"
+            + (f" (retrying in {retry_after:.0f} seconds)" if retry_after else "")
+        )
+
+    if decisions is not None:
+        stats = decisions.stats()
         logging.info(
-            f"File: {file_meta['name']} | "
-            f"Rename → {suggestion.get('suggested_name')} | "
-            f"Move → {suggestion.get('suggested_folder')} | "
-            f"Delete? {suggestion.get('delete')}"
+            f"Similar decisions: {stats['hits']} hits in {stats['lookups']} lookups "
+            f"({stats['hit_rate']:.0%}), {stats['entries']} entries"
         )
-        if not dry_run:
-            apply_suggestion(
-                file_meta,
-                suggestion,
-                root_folder=root_folder,
-                auto_confirm=auto_confirm
+
+    stats = prompt_token_stats()
+    if stats['files']:
+        logging.info(
+            f"LLM prompts since start: {stats['tokens_in']:.0f} estimated tokens for "
+            f"{stats['files']:.0f} files ({stats['tokens_per_file']:.0f} per file), "
+            f"{stats['previews_trimmed']:.0f} previews trimmed to the token budget"
+        )
+
+    if cache is not None:
+        stats = cache.stats()
+        logging.info(
+            f"Suggestion cache: {stats['hits']} hits, {stats['misses']} misses, "
+            f"{stats['entries']} entries"
+        )
+    return retry_after
+
+
+def apply_saved_plan(config: dict, path: str, index: FileIndex = None,
+                     hash_index: HashIndex = None) -> dict:
+    """
+    --apply-plan: apply the suggestions saved by --dry-run --save-plan as one
+    journaled plan, without any LLM call. Files that are gone or changed
+    since the plan was saved are skipped.
+
+    :param index: Optional FileIndex; applied files are recorded in it
+    :param hash_index: Optional HashIndex; moved files are followed in it
+    :returns: {source path: new Path} for every file that was moved
+    """
+    items, skipped = load_plan_items(path)
+    for file_path, reason in skipped:
+        logging.warning(f"Skipping {file_path}: {reason} since the plan was saved")
+        action_log.record('skip', path=file_path, status='stale', reason=reason)
+    logging.info(f"Applying {len(items)} saved suggestions from {path}, {len(skipped)} skipped")
+    if not items:
+        return {}
+    plan = build_plan(items, root_folder=config.get('root_folder'))
+    options = get_journal_options(config)
+    journal = PlanJournal.create(**options) if options and len(plan) else None
+    moved = execute_plan(plan, journal, auto_confirm=config.get('auto_confirm', False),
+                         mover=load_mover(config))
+    if hash_index is not None:
+        hash_index.moved(moved)
+    if index is not None:
+        for file_meta, _ in items:
+            index.record(file_meta)
+    return moved
+
+
+def enqueue_job(config: dict, queue, dry_run: bool = False, index: FileIndex = None,
+                hash_index: HashIndex = None, folders: list = None) -> int:
+    """
+    Producer side of --workers: add every new or changed file to the work
+    queue for the worker processes, and delete exact duplicates as job() does.
+
+    :param queue: WorkQueue drained by the workers
+    :param folders: Monitored folders to scan; all of them if None
+    :returns: Number of files newly queued
+    """
+    if dry_run:
+        index = None
+    duplicates = {}
+    if hash_index is not None and not hash_index.is_seeded(config):
+        duplicates = duplicate_decisions(config, hash_index)
+
+    # Only paths are queued; workers stat and preview the files themselves
+    deleted = []
+    if index is not None:
+        entries = iter_changed_entries(config, index, deleted, folders)
+    else:
+        entries = iter_entries(config, folders)
+    if hash_index is not None:
+        entries = filter_duplicates(config, entries, hash_index, duplicates)
+    queued = queue.enqueue(str(path) for path, _ in entries)
+    queue.purge_done()
+
+    items = []
+    for path, suggestion in sorted(duplicates.items()):
+        items.append(({'path': path, 'name': Path(path).name}, suggestion))
+        log_suggestion(*items[-1])
+    if not dry_run and items:
+        plan = build_plan(items, root_folder=config.get('root_folder'))
+        options = get_journal_options(config)
+        journal = PlanJournal.create(**options) if options and len(plan) else None
+        execute_plan(plan, journal, auto_confirm=config.get('auto_confirm', False),
+                     mover=load_mover(config))
+    action_log.record('scan', queued=queued, removed=len(deleted), duplicates=len(duplicates),
+                      folders=folders)
+    stats = queue.stats()
+    logging.info(
+        f"Queued {queued} new or changed files, {len(deleted)} removed. "
+        f"Queue: {stats['pending']} pending, {stats['leased']} in progress, {stats['dead']} dead"
+    )
+    return queued
+
+
+def run_workers(args: argparse.Namespace, config: dict, custom_prompt: str = None,
+                index: FileIndex = None, hash_index: HashIndex = None) -> None:
+    """
+    --workers N: feed the durable work queue from the scanner or watcher and
+    drain it with N worker processes (see worker.py).
+    """
+    if not args.dry_run and not config.get('auto_confirm', False):
+        logging.error("--workers needs auto_confirm (or --auto-confirm): worker processes cannot prompt")
+        return
+    from work_queue import get_queue_options, load_queue
+    from worker import start_workers, stop_workers
+    queue = load_queue(config)
+    # No worker is running yet, so any lease left is from a run that was killed
+    released = queue.release()
+    if released:
+        logging.info(f"Resuming {released} queued files left in progress by the last run")
+    if args.full_scan:
+        requeued = queue.requeue_dead()
+        if requeued:
+            logging.info(f"Retrying {requeued} dead-lettered files")
+    processes, stop = start_workers(
+        config, args.workers, dry_run=args.dry_run, custom_prompt=custom_prompt,
+        use_cache=not args.no_cache
+    )
+    logging.info(f"Started {args.workers} worker processes")
+    poll = get_queue_options(config)['poll_seconds']
+    try:
+        if args.watch:
+            logging.info("Entering watch mode (real-time monitoring)")
+            from file_watcher import start_watcher  # loads watchdog only when needed
+            start_watcher(config, dry_run=args.dry_run, index=index, hash_index=hash_index,
+                          queue=queue)
+        elif args.once:
+            logging.info("Running single scan (once)")
+            enqueue_job(config, queue, dry_run=args.dry_run, index=index, hash_index=hash_index)
+            # Failed files waiting for a retry stay queued for the next run
+            while queue.active() and any(p.is_alive() for p in processes):
+                time.sleep(poll)
+        else:
+            scheduler = load_scheduler(config)
+            logging.info(
+                f"Polling folders every {scheduler.min_interval:g}-{scheduler.max_interval:g} "
+                f"seconds, depending on how often they change"
             )
+            scheduler.run_forever(lambda folders: enqueue_job(
+                config, queue, dry_run=args.dry_run, index=index, hash_index=hash_index,
+                folders=folders
+            ))
+    except KeyboardInterrupt:
+        logging.info("Auto File Organizer stopped by user.")
+    finally:
+        logging.info("Waiting for workers to finish their current files")
+        stop_workers(processes, stop)
+        stats = queue.stats()
+        logging.info(
+            f"Queue: {stats['pending']} pending, {stats['done']} done, {stats['dead']} dead"
+        )
 
 
 def main() -> None:
@@ -86,29 +398,73 @@ def main() -> None:
     Main entry: parse args, configure logging, and dispatch mode.
     """
     args = parse_args()
+    if args.startup_profile:
+        from startup_profile import run_profiled
+        argv = [arg for arg in sys.argv if arg != '--startup-profile']
+        sys.exit(run_profiled(argv))
     config = load_config(args.config)
+    configure_llm(config)
 
     # Override auto_confirm from CLI
     if args.auto_confirm:
         config['auto_confirm'] = True
 
-    # Configure logging
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s %(levelname)s: %(message)s',
-        handlers=[
-            logging.FileHandler('logs/actions.log'),
-            logging.StreamHandler()
-        ]
-    )
+    # Configure logging: records are written by background threads, off the per-file path
+    listener = configure_logging('logs/actions.log')
+    atexit.register(listener.stop)
+    atexit.register(load_action_log(config).close)
     logging.info("Starting Auto File Organizer Agent")
 
-    # Real-time watch mode
-    if args.watch:
-        logging.info("Entering watch mode (real-time monitoring)")
-        start_watcher(config, dry_run=args.dry_run)
+    # Purge cached suggestions on request
+    if args.purge_cache:
+        cache_path = (config.get('cache') or {}).get('path', DEFAULT_CACHE_PATH)
+        purged = SuggestionCache(path=cache_path).purge()
+        logging.info(f"Purged {purged} cached suggestions")
+        return
+
+    # Resume or undo the last journaled run
+    if args.resume or args.undo:
+        journal_dir = get_journal_options(config).get('directory')
+        journal = journal_dir and latest_journal(
+            journal_dir, state='incomplete' if args.resume else 'complete'
+        )
+        if not journal:
+            logging.info("No run to resume" if args.resume else "No run to undo")
+        elif args.resume:
+            resume_plan(journal, auto_confirm=config.get('auto_confirm', False),
+                        mover=load_mover(config))
+        else:
+            logging.info(f"Undid {undo_plan(journal)} moves from {journal.path.name}")
+        return
+
+    # Apply a plan saved by an earlier dry run; no LLM services are needed
+    if args.apply_plan:
+        if args.dry_run:
+            logging.error("--apply-plan cannot be combined with --dry-run: the saved plan "
+                          "already is the dry run's output")
+            return
+        try:
+            apply_saved_plan(config, args.apply_plan, index=load_index(config),
+                             hash_index=load_hash_index(config))
+        except (OSError, ValueError) as e:
+            logging.error(f"Cannot apply plan {args.apply_plan}: {e}")
+        return
+    if args.save_plan and not args.dry_run:
+        logging.error("--save-plan needs --dry-run: the saved plan is applied later with --apply-plan")
         return
 
+    cache = None if args.no_cache else load_cache(config)
+    index = load_index(config)
+    limiter = load_limiter(config)
+    hash_index = load_hash_index(config)
+    rules = load_rules(config)
+    decisions = load_decision_index(config)
+    load_metrics_server(config)
+    if index is not None and args.full_scan:
+        index.clear()
+    if hash_index is not None and args.full_scan:
+        hash_index.clear_seeded()
+
     # Load custom prompt if provided
     custom_prompt = None
     if args.prompt_file and os.path.exists(args.prompt_file):
@@ -120,24 +476,72 @@ def main() -> None:
             logging.error(f"Error loading custom prompt: {e}")
             return
 
+    # Dry run saving its suggestions for a later --apply-plan
+    if args.save_plan:
+        logging.info(f"Saving a plan of suggestions to {args.save_plan}")
+        with PlanWriter(args.save_plan, custom_prompt=custom_prompt) as writer:
+            job(
+                config, dry_run=True, custom_prompt=custom_prompt,
+                cache=cache, limiter=limiter, hash_index=hash_index,
+                rules=rules, decisions=decisions, plan_writer=writer
+            )
+        logging.info(f"Saved {writer.count} suggestions to {args.save_plan}; "
+                     f"apply them with --apply-plan {args.save_plan}")
+        return
+
+    # Durable queue drained by worker processes
+    if args.workers > 0:
+        run_workers(args, config, custom_prompt=custom_prompt, index=index, hash_index=hash_index)
+        return
+
+    # Real-time watch mode
+    if args.watch:
+        logging.info("Entering watch mode (real-time monitoring)")
+        from file_watcher import start_watcher  # loads watchdog only when needed
+        start_watcher(
+            config, dry_run=args.dry_run, custom_prompt=custom_prompt,
+            cache=cache, index=index, limiter=limiter, hash_index=hash_index, rules=rules,
+            decisions=decisions
+        )
+        return
+
     # One-off execution
     if args.once:
         logging.info("Running single scan (once)")
-        job(config, dry_run=args.dry_run, custom_prompt=custom_prompt)
+        job(
+            config, dry_run=args.dry_run, custom_prompt=custom_prompt,
+            cache=cache, index=index, limiter=limiter, hash_index=hash_index,
+            rules=rules, decisions=decisions
+        )
+        logging.info(metrics.summary())
         return
 
-    # Scheduled polling mode
-    interval = config.get('check_interval_minutes', 10)
-    logging.info(f"Scheduling scans every {interval} minutes")
-    job(config, dry_run=args.dry_run, custom_prompt=custom_prompt)  # initial run
-    schedule.every(interval).minutes.do(job, config, args.dry_run, custom_prompt)
+    # Scheduled polling mode: each folder is checked (a stat of its
+    # directories) on its own interval and only scanned when it changed
+    scheduler = load_scheduler(config)
+    logging.info(
+        f"Polling folders every {scheduler.min_interval:g}-{scheduler.max_interval:g} "
+        f"seconds, depending on how often they change"
+    )
+    # Shared by every run, so a large copy does not hold up the next scans
+    mover = load_mover(config)
+
+    def scan(folders):
+        retry_after = job(
+            config, dry_run=args.dry_run, custom_prompt=custom_prompt,
+            cache=cache, index=index, limiter=limiter, hash_index=hash_index, rules=rules,
+            decisions=decisions, folders=folders, mover=mover
+        )
+        # Deferred files are in folders that may not change again: check them anyway
+        if retry_after is not None:
+            scheduler.invalidate(folders, delay=retry_after)
 
     try:
-        while True:
-            schedule.run_pending()
-            time.sleep(1)
+        scheduler.run_forever(scan)
     except KeyboardInterrupt:
         logging.info("Auto File Organizer stopped by user.")
+    finally:
+        mover.close()   # let background moves finish
 
 
 if __name__ == '__main__':
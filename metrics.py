@@ -0,0 +1,207 @@
+"""
+metrics.py
+
+Per-stage counters and timers for Auto File Organizer:
+- A process-wide registry (`metrics`) that the scanner, organizer,
+  apply_suggestion and the watcher record into
+- Counters (files scanned, cache hits, moves, deletes, errors, tokens, ...)
+  and timers (scan, preview by extension, LLM latency) with count, sum and max
+- An optional Prometheus-style text endpoint on localhost (`/metrics`)
+- A plain-text summary, logged at the end of `--once` runs
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_METRICS_HOST = '127.0.0.1'
+DEFAULT_METRICS_PORT = 9464
+PREFIX = 'afo_'
+
+HELP = {
+    'files_scanned_total': 'Files found by the scanner',
+    'scan_seconds': 'Time spent listing and stat-ing monitored folders',
+    'preview_seconds': 'Time spent building content previews, by extension',
+    'llm_requests_total': 'Requests sent to the LLM, by kind (single or batch)',
+    'llm_request_seconds': 'LLM request latency, by kind',
+    'llm_tokens_in_total': 'Estimated prompt tokens sent to the LLM',
+    'llm_tokens_out_total': 'Estimated completion tokens received from the LLM',
+    'llm_files_total': 'Files sent to the LLM (a batched request counts each of its files)',
+    'llm_previews_trimmed_total': 'Previews shortened to fit the prompt token budget',
+    'llm_parse_failures_total': 'LLM replies that were not valid suggestions',
+    'llm_retries_total': 'LLM requests retried after a 429, 5xx or connection error',
+    'llm_circuit_opened_total': 'Times LLM requests were paused after repeated failures',
+    'llm_deferred_total': 'Files left for later because the LLM was unavailable',
+    'local_suggestions_total': 'Suggestions answered without the LLM, by source',
+    'cache_lookups_total': 'Suggestion cache lookups, by result (hit or miss)',
+    'similar_lookups_total': 'Past-decision index lookups, by result (hit or miss)',
+    'moves_total': 'Files moved or renamed',
+    'deletes_total': 'Files deleted',
+    'skipped_total': 'Suggestions declined at the confirmation prompt',
+    'errors_total': 'Errors, by stage',
+    'watch_events_total': 'File system events received in watch mode',
+    'watch_batches_total': 'Debounced batches processed in watch mode',
+    'queue_dead_letters_total': 'Queued files given up on after max_attempts',
+}
+
+
+def _label_text(labels: tuple) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters and timers. Labels are passed as
+    keyword arguments, e.g. `metrics.inc('errors_total', stage='move')`.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}   # (name, labels) -> value
+        self._timers = {}     # (name, labels) -> [count, sum, max]
+        self.started = time.time()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """Add value to a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        """Record one duration for a timer."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            timer = self._timers.setdefault(key, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Time the enclosed block into a timer."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter(self, name: str, **labels) -> float:
+        """Return the current value of a counter (0 if never incremented)."""
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def snapshot(self) -> dict:
+        """
+        Return {'counters': {...}, 'timers': {...}} keyed by
+        (name, labels) tuples; timers are (count, sum, max).
+        """
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'timers': {key: tuple(value) for key, value in self._timers.items()},
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._timers.clear()
+            self.started = time.time()
+
+    def render_prometheus(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+        Timers are exposed as summaries (_count and _sum) plus a _max gauge.
+        """
+        snap = self.snapshot()
+        lines = []
+        for name in sorted({key[0] for key in snap['counters']}):
+            lines.append(f"# HELP {PREFIX}{name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {PREFIX}{name} counter")
+            for (metric, labels), value in sorted(snap['counters'].items()):
+                if metric == name:
+                    lines.append(f"{PREFIX}{name}{_label_text(labels)} {value:g}")
+        for name in sorted({key[0] for key in snap['timers']}):
+            lines.append(f"# HELP {PREFIX}{name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {PREFIX}{name} summary")
+            for (metric, labels), (count, total, _) in sorted(snap['timers'].items()):
+                if metric == name:
+                    lines.append(f"{PREFIX}{name}_count{_label_text(labels)} {count}")
+                    lines.append(f"{PREFIX}{name}_sum{_label_text(labels)} {total:.6f}")
+            lines.append(f"# TYPE {PREFIX}{name}_max gauge")
+            for (metric, labels), (_, _, peak) in sorted(snap['timers'].items()):
+                if metric == name:
+                    lines.append(f"{PREFIX}{name}_max{_label_text(labels)} {peak:.6f}")
+        lines.append(f"# TYPE {PREFIX}uptime_seconds gauge")
+        lines.append(f"{PREFIX}uptime_seconds {time.time() - self.started:.3f}")
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        """
+        Build a human-readable summary: timers sorted by total time, then counters.
+        """
+        snap = self.snapshot()
+        lines = ["Run summary:"]
+        timers = sorted(snap['timers'].items(), key=lambda item: item[1][1], reverse=True)
+        for (name, labels), (count, total, peak) in timers:
+            avg_ms = total / count * 1000 if count else 0
+            lines.append(
+                f"  {name}{_label_text(labels)}: {total:.3f}s total, {count} calls, "
+                f"{avg_ms:.1f}ms avg, {peak * 1000:.1f}ms max"
+            )
+        for (name, labels), value in sorted(snap['counters'].items()):
+            lines.append(f"  {name}{_label_text(labels)}: {value:g}")
+        return '\n'.join(lines)
+
+
+# Shared registry used by every module
+metrics = Metrics()
+
+
+def start_metrics_server(registry: Metrics = metrics, host: str = DEFAULT_METRICS_HOST,
+                         port: int = DEFAULT_METRICS_PORT):
+    """
+    Serve `registry` at http://host:port/metrics from a daemon thread.
+
+    :returns: The running ThreadingHTTPServer (call shutdown() to stop it)
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # keep scrapes out of the action log
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    logging.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def load_metrics_server(config: dict):
+    """
+    Start the metrics endpoint configured by the `metrics` section of
+    config.yaml. Returns None if it is disabled or the port is taken.
+    """
+    options = config.get('metrics') or {}
+    if not options.get('enabled', False):
+        return None
+    try:
+        return start_metrics_server(
+            host=options.get('host', DEFAULT_METRICS_HOST),
+            port=options.get('port', DEFAULT_METRICS_PORT)
+        )
+    except OSError as e:
+        logging.error(f"Could not start metrics endpoint: {e}")
+        return None
@@ -0,0 +1,283 @@
+"""
+mover.py
+
+File move layer used by the plan executor:
+- Same filesystem: a single rename, no data copied
+- Across filesystems: kernel-side copy (copy_file_range, else sendfile) into
+  a hidden temp file next to the target, fsync, atomic rename into place,
+  then the source is removed; a crash never leaves a half-written target
+- Targets are never overwritten: files are published with a rename that
+  refuses to replace (renameat2 RENAME_NOREPLACE, else a hard link), so a
+  background copy, another plan or another worker process that picked the
+  same name gets FileExistsError instead of clobbering a file
+- Large cross-device moves run on a background worker, so small files keep
+  flowing while a multi-GB video is copied
+"""
+import ctypes
+import errno
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+DEFAULT_BACKGROUND_MIN_MB = 256
+DEFAULT_BACKGROUND_WORKERS = 1
+
+# Bytes handed to the kernel per copy call
+COPY_CHUNK = 64 * 1024 * 1024
+
+RENAME_NOREPLACE = 1
+_AT_FDCWD = -100
+# Errors meaning the filesystem or kernel cannot do this kind of rename or link
+_UNSUPPORTED = {errno.EINVAL, errno.ENOSYS, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EPERM}
+_renameat2 = None
+
+
+def _load_renameat2():
+    # libc's renameat2 (glibc 2.28+), or False where it is missing
+    global _renameat2
+    if _renameat2 is None:
+        _renameat2 = False
+        if os.name == 'posix':
+            try:
+                func = ctypes.CDLL(None, use_errno=True).renameat2
+            except (OSError, AttributeError):
+                pass
+            else:
+                func.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p,
+                                 ctypes.c_uint)
+                func.restype = ctypes.c_int
+                _renameat2 = func
+    return _renameat2
+
+
+def rename_noreplace(src: str, dst: str) -> None:
+    """
+    Rename src to dst, failing instead of replacing an existing dst: the
+    check and the rename are one atomic step, unlike lexists() + rename().
+
+    :raises FileExistsError: if dst exists
+    :raises OSError: e.g. EXDEV if src and dst are on different filesystems
+    """
+    if os.name == 'nt':
+        os.rename(src, dst)   # never replaces an existing file on Windows
+        return
+    renameat2 = _load_renameat2()
+    if renameat2:
+        if renameat2(_AT_FDCWD, os.fsencode(src), _AT_FDCWD, os.fsencode(dst), RENAME_NOREPLACE) == 0:
+            return
+        err = ctypes.get_errno()
+        if err not in _UNSUPPORTED - {errno.EPERM}:
+            raise OSError(err, os.strerror(err), src, None, dst)
+    # No RENAME_NOREPLACE here (kernel, libc or filesystem): link() refuses
+    # an existing target too
+    try:
+        os.link(src, dst, follow_symlinks=False)
+    except OSError as e:
+        if e.errno not in _UNSUPPORTED:
+            raise
+        # No hard links either (e.g. FAT): the best left is check, then rename
+        if os.path.lexists(dst):
+            raise FileExistsError(errno.EEXIST, "Target already exists", dst)
+        os.rename(src, dst)
+        return
+    os.unlink(src)
+
+
+def _copy_range(src_fd: int, dst_fd: int, size: int) -> None:
+    """
+    Copy size bytes between file descriptors inside the kernel when possible:
+    copy_file_range (Linux, can reflink), then sendfile, then read/write.
+    """
+    copied = 0
+    for method in ('copy_file_range', 'sendfile'):
+        func = getattr(os, method, None)
+        if func is None:
+            continue
+        try:
+            while copied < size:
+                if method == 'copy_file_range':
+                    n = func(src_fd, dst_fd, min(COPY_CHUNK, size - copied))
+                else:
+                    n = func(dst_fd, src_fd, copied, min(COPY_CHUNK, size - copied))
+                if n == 0:
+                    break
+                copied += n
+            if copied >= size:
+                return
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.ENOTSUP,
+                               errno.EOPNOTSUPP, errno.EBADF, errno.ENOTSOCK):
+                raise
+        # Unsupported for this pair of files: continue where we stopped
+        os.lseek(src_fd, copied, os.SEEK_SET)
+        os.lseek(dst_fd, copied, os.SEEK_SET)
+    while True:
+        chunk = os.read(src_fd, 1024 * 1024)
+        if not chunk:
+            return
+        os.write(dst_fd, chunk)
+
+
+def _fsync_dir(folder: str) -> None:
+    """Flush a directory entry change (the rename) to disk where supported."""
+    try:
+        fd = os.open(folder, os.O_RDONLY)
+    except OSError:
+        return  # e.g. Windows
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def copy_across(src: str, dst: str) -> None:
+    """
+    Move src to dst on another filesystem: copy into a temp file beside dst,
+    fsync it, rename it into place, then delete src.
+
+    :raises FileExistsError: if dst appeared while the copy ran; src is kept
+    """
+    folder, name = os.path.split(dst)
+    tmp = os.path.join(folder, f".{name}.{os.getpid()}.afo.tmp")
+    try:
+        if os.path.islink(src):
+            os.symlink(os.readlink(src), tmp)
+        else:
+            src_fd = os.open(src, os.O_RDONLY)
+            try:
+                dst_fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                try:
+                    _copy_range(src_fd, dst_fd, os.fstat(src_fd).st_size)
+                    os.fsync(dst_fd)
+                finally:
+                    os.close(dst_fd)
+            finally:
+                os.close(src_fd)
+            shutil.copystat(src, tmp)
+        rename_noreplace(tmp, dst)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    _fsync_dir(folder)
+    os.unlink(src)
+
+
+def move_file(src: str, dst: str, src_stat: os.stat_result = None, dst_dev: int = None) -> None:
+    """
+    Move a file, renaming in place when src and dst share a filesystem.
+
+    :param src_stat: lstat of src, if the caller already has it
+    :param dst_dev: st_dev of dst's folder, if the caller already has it
+    :raises FileExistsError: if dst exists (e.g. another worker process or a
+        background copy just used the same name); the file is never overwritten
+    """
+    # Checked first only to avoid a needless copy; rename_noreplace decides
+    if os.path.lexists(dst):
+        raise FileExistsError(errno.EEXIST, "Target already exists", dst)
+    if src_stat is None:
+        src_stat = os.lstat(src)
+    if dst_dev is None:
+        dst_dev = os.stat(os.path.dirname(dst) or '.').st_dev
+    if src_stat.st_dev == dst_dev:
+        try:
+            rename_noreplace(src, dst)
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:  # e.g. a bind mount of the same device
+                raise
+    copy_across(src, dst)
+
+
+class Mover:
+    """
+    Moves files for the plan executor. Cross-device moves of files of at
+    least `background_min_bytes` are handed to a background thread; all
+    others complete before move() returns. Call wait() before relying on
+    queued moves having finished, and close() at shutdown.
+    """
+    def __init__(self, background_min_bytes: int = DEFAULT_BACKGROUND_MIN_MB * 1024 * 1024,
+                 workers: int = DEFAULT_BACKGROUND_WORKERS):
+        self.background_min_bytes = background_min_bytes
+        self.workers = workers
+        self._devices = {}    # folder -> st_dev
+        self._executor = None
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def _device(self, folder: str) -> int:
+        if folder not in self._devices:
+            self._devices[folder] = os.stat(folder).st_dev
+        return self._devices[folder]
+
+    def move(self, src: str, dst: str,
+             on_done: Optional[Callable[[Optional[BaseException]], None]] = None) -> bool:
+        """
+        Move src to dst.
+
+        :param on_done: Called with None on success or the exception on failure,
+            from the background thread for queued moves
+        :returns: True if the move finished (or failed) now, False if it was queued
+        """
+        try:
+            src_stat = os.lstat(src)
+            dst_dev = self._device(os.path.dirname(dst))
+        except OSError as e:
+            if on_done is not None:
+                on_done(e)
+            return True
+        if src_stat.st_dev != dst_dev and src_stat.st_size >= self.background_min_bytes \
+                and self.workers > 0:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='mover')
+                self._futures = [future for future in self._futures if not future.done()]
+                self._futures.append(
+                    self._executor.submit(self._run, src, dst, src_stat, dst_dev, on_done)
+                )
+            logging.info(f"Moving {src} to another filesystem in the background")
+            return False
+        self._run(src, dst, src_stat, dst_dev, on_done)
+        return True
+
+    @staticmethod
+    def _run(src, dst, src_stat, dst_dev, on_done):
+        try:
+            move_file(src, dst, src_stat, dst_dev)
+        except Exception as e:
+            if on_done is not None:
+                on_done(e)
+            return
+        if on_done is not None:
+            on_done(None)
+
+    def wait(self) -> None:
+        """Block until every queued move has finished."""
+        with self._lock:
+            futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def close(self) -> None:
+        self.wait()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+def load_mover(config: dict) -> Mover:
+    """
+    Build a Mover from the `move` section of config.yaml.
+    """
+    options = config.get('move') or {}
+    return Mover(
+        background_min_bytes=int(options.get('background_min_mb', DEFAULT_BACKGROUND_MIN_MB) * 1024 * 1024),
+        workers=options.get('background_workers', DEFAULT_BACKGROUND_WORKERS)
+    )
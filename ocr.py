@@ -0,0 +1,156 @@
+"""
+ocr.py
+
+Image text extraction for previews, kept cheap:
+- Results are stored in a persistent SQLite cache keyed by the image's
+  content hash, so an unchanged screenshot is never OCR'd twice
+- A quick check on a small grayscale thumbnail (contrast and edge density)
+  skips OCR for images that almost certainly contain no text
+- Images are downscaled to a maximum dimension before Tesseract runs
+"""
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from suggestion_cache import hash_file
+
+DEFAULT_OCR_CACHE_PATH = '~/.cache/auto_file_organizer/ocr.sqlite'
+DEFAULT_MAX_DIMENSION = 1600
+# Thumbnail size used for the text check
+PROBE_SIZE = 256
+# Below these an image is treated as having no text
+DEFAULT_MIN_STDDEV = 12.0
+DEFAULT_MIN_EDGE_DENSITY = 0.02
+# Characters of OCR output kept in the cache
+CACHED_CHARS = 4000
+
+
+class OcrCache:
+    """
+    SQLite-backed map from image content hash to OCR text. Opened separately
+    in each preview worker process; SQLite serializes the writes.
+    """
+    def __init__(self, path: str = DEFAULT_OCR_CACHE_PATH):
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ocr ("
+            " key TEXT PRIMARY KEY,"
+            " text TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT text FROM ocr WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, text: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ocr (key, text, created_at) VALUES (?, ?, ?)",
+                (key, text[:CACHED_CHARS], time.time())
+            )
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM ocr").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def likely_has_text(img, min_stddev: float = DEFAULT_MIN_STDDEV,
+                    min_edge_density: float = DEFAULT_MIN_EDGE_DENSITY) -> bool:
+    """
+    Cheap test on a small grayscale copy: text needs contrast (pixel standard
+    deviation) and many sharp edges (share of strong edge pixels).
+    """
+    from PIL import ImageFilter, ImageStat
+    probe = img.convert('L')
+    probe.thumbnail((PROBE_SIZE, PROBE_SIZE))
+    if ImageStat.Stat(probe).stddev[0] < min_stddev:
+        return False
+    edges = probe.filter(ImageFilter.FIND_EDGES)
+    histogram = edges.histogram()
+    strong = sum(histogram[64:])
+    return strong / max(1, probe.width * probe.height) >= min_edge_density
+
+
+def downscale(img, max_dimension: int):
+    """Return img shrunk so its longer side is at most max_dimension."""
+    if max_dimension and max(img.size) > max_dimension:
+        img = img.copy()
+        img.thumbnail((max_dimension, max_dimension))
+    return img
+
+
+class ImageOcr:
+    """
+    OCR with caching, a no-text check and downscaling, configured by the
+    `preview.ocr` section of config.yaml.
+    """
+    def __init__(self, max_dimension: int = DEFAULT_MAX_DIMENSION,
+                 min_stddev: float = DEFAULT_MIN_STDDEV,
+                 min_edge_density: float = DEFAULT_MIN_EDGE_DENSITY,
+                 cache_path: Optional[str] = DEFAULT_OCR_CACHE_PATH):
+        self.max_dimension = max_dimension
+        self.min_stddev = min_stddev
+        self.min_edge_density = min_edge_density
+        self.cache_path = cache_path
+        self._cache = None
+
+    @property
+    def cache(self) -> Optional[OcrCache]:
+        # Opened on first use, so each preview worker process gets its own connection
+        if self._cache is None and self.cache_path:
+            self._cache = OcrCache(self.cache_path)
+        return self._cache
+
+    def _key(self, file_path) -> str:
+        # The settings change the output, so they are part of the key
+        return f"{hash_file(file_path)}:{self.max_dimension}:{self.min_stddev}:{self.min_edge_density}"
+
+    def extract(self, file_path) -> str:
+        """
+        Return the text in an image, from the cache when its content was seen before.
+        """
+        cache = self.cache
+        key = self._key(file_path) if cache is not None else None
+        if key is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+        text = self._ocr(file_path)
+        if key is not None:
+            cache.put(key, text)
+        return text
+
+    def _ocr(self, file_path) -> str:
+        import pytesseract
+        from PIL import Image
+        with Image.open(file_path) as img:
+            img.draft('L', (self.max_dimension, self.max_dimension))  # JPEG: decode at reduced size
+            if not likely_has_text(img, self.min_stddev, self.min_edge_density):
+                return ''
+            return pytesseract.image_to_string(downscale(img, self.max_dimension)) or ''
+
+
+def load_ocr(config: dict) -> ImageOcr:
+    """
+    Build an ImageOcr from the `preview.ocr` section of config.yaml.
+    """
+    options = (config.get('preview') or {}).get('ocr') or {}
+    return ImageOcr(
+        max_dimension=options.get('max_dimension', DEFAULT_MAX_DIMENSION),
+        min_stddev=options.get('min_stddev', DEFAULT_MIN_STDDEV),
+        min_edge_density=options.get('min_edge_density', DEFAULT_MIN_EDGE_DENSITY),
+        cache_path=options.get('cache_path', DEFAULT_OCR_CACHE_PATH) if options.get('cache', True) else None
+    )
@@ -1,25 +1,67 @@
-from dotenv import load_dotenv
-load_dotenv() 
-
-
 import os
 import json
+import time
 import logging
-from langchain.chat_models import ChatOpenAI
-from langchain.chains import LLMChain
-from langchain_community.chat_models import ChatOpenAI       # community-maintained
-from langchain.chains import LLMChain                        # still works for now
-from langchain.prompts import ChatPromptTemplate
+import threading
+from functools import lru_cache
 from typing import Optional
 
-# Initialize LLM client (ensure OPENAI_API_KEY is set in environment)
-llm = ChatOpenAI(
-    temperature=0,
-    openai_api_key=os.getenv("OPENAI_API_KEY")
-)
+from decision_index import DecisionIndex
+from llm_backend import CircuitBreaker, LLMUnavailable, create_backend, get_llm_options
+from metrics import metrics
+from rate_limiter import CHARS_PER_TOKEN, RateLimiter, estimate_tokens
+from rules import RuleSet
+from suggestion_cache import SuggestionCache, hash_text
 
-# Default prompt template for generating file suggestions
-DEFAULT_PROMPT_TEMPLATE = """
+# Model used for suggestions; also part of the suggestion cache key
+MODEL_NAME = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+
+# The LLM backend (see llm_backend.py) and chains are built on first use (see
+# get_backend / get_default_chain), so importing this module does not load
+# LangChain or httpx or read the API key.
+backend = None
+default_chain = None
+batch_chain = None
+# Chains for custom prompts, keyed by the hash of their template
+_chains = {}
+_chains_lock = threading.Lock()
+# `llm` section of config.yaml, set by configure_llm
+_llm_config = {}
+# Shared by every thread of the process: once the provider keeps failing,
+# files are deferred instead of each one waiting out its retries
+breaker = CircuitBreaker()
+
+
+def configure_llm(config: dict) -> None:
+    """
+    Use the backend, model and retry settings from the `llm` section of
+    config.yaml. Chains built before are dropped.
+    """
+    global _llm_config, breaker, MODEL_NAME
+    _llm_config = {'llm': dict(config.get('llm') or {})}
+    settings = get_llm_options(_llm_config)
+    MODEL_NAME = settings['options']['model']
+    breaker = CircuitBreaker(**settings['breaker'])
+    reset_chains()
+
+
+def llm_retry_after() -> float:
+    """Seconds until LLM requests resume, if they are paused (0 otherwise)."""
+    return breaker.retry_after()
+
+
+def get_backend():
+    """Return the shared LLM backend, creating it on first use."""
+    global backend
+    if backend is None:
+        from dotenv import load_dotenv
+        load_dotenv()   # OPENAI_API_KEY may come from .env
+        settings = get_llm_options(_llm_config)
+        backend = create_backend(settings['backend'], settings['options'])
+    return backend
+
+# Instructions shared by the single-file and batched prompts
+PROMPT_RULES = """
 You are an EXTREMELY AGGRESSIVE file organizer assistant. Your goal is to organize files into a clean, consistent structure.
 Be PROACTIVE and CONFIDENT in your suggestions. Don't be afraid to make bold suggestions for renaming and organizing files.
 
@@ -29,14 +71,14 @@ RULES:
 3. Group similar files in logical folders
 4. Be more aggressive with temporary or poorly named files
 5. Don't be conservative - better to suggest too much organization than too little
+"""
 
-File metadata:
-Name: {name}
-Size (bytes): {size_bytes}
-Created: {created_time}
-Modified: {modified_time}
-Content preview: {preview}
+# The prompts put everything that is the same for every request first (rules,
+# output format, examples) and the file's metadata last, so providers that
+# cache prompt prefixes can reuse the static part.
 
+# Default prompt template for generating file suggestions
+DEFAULT_PROMPT_TEMPLATE = PROMPT_RULES + """
 Return a JSON object with these keys:
 - suggested_name: string (new filename, ALWAYS suggest a change)
 - suggested_folder: string (folder path, ALWAYS suggest a folder)
@@ -56,15 +98,127 @@ Example outputs:
   "delete": false
 }}
 ```
+
+File metadata:
+Name: {name}
+Size (bytes): {size_bytes}
+Created: {created_time}
+Modified: {modified_time}
+Content preview: {preview}
+"""
+
+# Prompt template for suggesting actions for several files in one request
+BATCH_PROMPT_TEMPLATE = PROMPT_RULES + """
+You will get a JSON array of files, one object per file. Return a JSON array
+with exactly one object per file, each with these keys:
+- id: integer (the "id" of the file in the input)
+- suggested_name: string (new filename, ALWAYS suggest a change)
+- suggested_folder: string (folder path, ALWAYS suggest a folder)
+- delete: boolean (true if file is clearly temporary, duplicate, or unnecessary)
+
+Example output:
+```json
+[
+  {{"id": 0, "suggested_name": "resume_john_smith_2025.pdf", "suggested_folder": "documents/resumes", "delete": false}},
+  {{"id": 1, "suggested_name": "screenshot_2025_07_18_1445.png", "suggested_folder": "media/screenshots/2025_07", "delete": false}}
+]
+```
+
+Files (JSON array, one object per file):
+{files}
 """
+
+# Default token budget for one batched request
+DEFAULT_BATCH_TOKEN_BUDGET = 6000
+# Default token budget for one single-file request; previews are trimmed to fit
+DEFAULT_PROMPT_TOKEN_BUDGET = 1000
+
 def create_chain(custom_prompt: Optional[str] = None):
-    """Create a new LLMChain with the specified or default prompt."""
+    """Create a new chain on the LLM backend with the specified or default prompt."""
     template = custom_prompt if custom_prompt else DEFAULT_PROMPT_TEMPLATE
-    prompt = ChatPromptTemplate.from_template(template)
-    return LLMChain(llm=llm, prompt=prompt)
+    return get_backend().chain(template)
+
+
+def get_chain(template: str):
+    """
+    Return the chain for a prompt template, compiling it once per distinct
+    template (custom prompts are otherwise rebuilt for every file).
+    """
+    key = hash_text(template)
+    with _chains_lock:
+        chain = _chains.get(key)
+    if chain is None:
+        chain = create_chain(template)
+        with _chains_lock:
+            chain = _chains.setdefault(key, chain)
+    return chain
+
+
+def reset_chains() -> None:
+    """Drop the backend and every compiled chain, e.g. after changing the LLM settings."""
+    global backend, default_chain, batch_chain
+    with _chains_lock:
+        _chains.clear()
+    if backend is not None:
+        backend.close()
+    backend = None
+    default_chain = None
+    batch_chain = None
+
+
+@lru_cache(maxsize=64)
+def template_tokens(template: str) -> int:
+    """Estimated tokens of a template's static text."""
+    return estimate_tokens(template)
+
+
+def fit_preview(inputs: dict, fixed_tokens: int, budget: Optional[int]) -> dict:
+    """
+    Trim inputs['preview'] so that the estimated prompt (fixed_tokens for
+    the template plus the metadata fields) stays within budget.
+
+    :param inputs: Prompt inputs from prompt_inputs; changed in place
+    :param budget: Estimated prompt tokens allowed; no trimming if None or 0
+    :returns: inputs
+    """
+    preview = inputs.get('preview') or ''
+    if not budget or not preview:
+        return inputs
+    other = sum(estimate_tokens(str(value)) for key, value in inputs.items() if key != 'preview')
+    # estimate_tokens rounds up by one token per field, the preview included
+    max_chars = max(0, (budget - fixed_tokens - other - 1) * CHARS_PER_TOKEN)
+    if len(preview) > max_chars:
+        inputs['preview'] = preview[:max_chars]
+        metrics.inc('llm_previews_trimmed_total')
+    return inputs
+
+
+def prompt_token_stats() -> dict:
+    """
+    Return the estimated prompt tokens sent so far and the average per file
+    asked about (batched files share their request's tokens).
+    """
+    files = metrics.counter('llm_files_total')
+    tokens = metrics.counter('llm_tokens_in_total')
+    return {'files': files, 'tokens_in': tokens,
+            'tokens_per_file': tokens / files if files else 0.0,
+            'previews_trimmed': metrics.counter('llm_previews_trimmed_total')}
+
+
+def get_default_chain():
+    """Return the chain for the default prompt, creating it on first use."""
+    global default_chain
+    if default_chain is None:
+        default_chain = create_chain()
+    return default_chain
 
-# Default chain instance
-default_chain = create_chain()
+
+def get_batch_chain():
+    """Return the chain for the batched prompt, creating it on first use."""
+    global batch_chain
+    if batch_chain is None:
+        batch_chain = create_chain(BATCH_PROMPT_TEMPLATE)
+    return batch_chain
 
 def should_delete_file(filename: str) -> bool:
     """Check if the file should be deleted based on its extension."""
@@ -82,39 +236,154 @@ def should_delete_file(filename: str) -> bool:
     return any(filename_lower.endswith(ext) for ext in delete_extensions)
 
 
-def suggest_actions(file_meta: dict, custom_prompt: Optional[str] = None) -> dict:
+def prompt_inputs(file_meta: dict) -> dict:
+    """Return the metadata fields sent to the LLM for a file."""
+    return {
+        'name': file_meta.get('name', ''),
+        'size_bytes': file_meta.get('size_bytes', 0),
+        'created_time': file_meta.get('created_time', ''),
+        'modified_time': file_meta.get('modified_time', ''),
+        'preview': file_meta.get('preview', '')
+    }
+
+
+def _cache_key(cache: Optional[SuggestionCache], file_meta: dict, template: str) -> Optional[str]:
+    """Return the cache key for a file under a prompt template and the current model."""
+    if cache is None:
+        return None
+    return cache.make_key(file_meta, f"{MODEL_NAME}\n{template}")
+
+
+def _installer_suggestion(filename: str) -> dict:
+    return {
+        'suggested_name': filename,  # Keep original name for logging
+        'suggested_folder': '',
+        'delete': True
+    }
+
+
+def local_suggestion(file_meta: dict, rules: Optional[RuleSet] = None) -> Optional[dict]:
+    """
+    Return the suggestion for a file that needs no LLM call (installer files
+    and files matched by a configured rule), or None.
+    """
+    filename = file_meta.get('name', '')
+    if should_delete_file(filename):
+        metrics.inc('local_suggestions_total', source='installer')
+        return _installer_suggestion(filename)
+    if rules is not None:
+        suggestion = rules.match(file_meta)
+        if suggestion is not None:
+            metrics.inc('local_suggestions_total', source='rule')
+        return suggestion
+    return None
+
+
+def _cached(cache: SuggestionCache, cache_key: str) -> Optional[dict]:
+    """Look up a cached suggestion and count the hit or miss."""
+    cached = cache.get(cache_key)
+    metrics.inc('cache_lookups_total', result='miss' if cached is None else 'hit')
+    return cached
+
+
+def _run_chain(chain, kind: str, tokens_in: int, file_count: int = 1, **inputs) -> str:
+    """
+    Run an LLM chain, recording latency, estimated tokens and errors.
+
+    :raises LLMUnavailable: if the circuit breaker is open or the provider
+        kept failing; the files should be retried later
+    """
+    if not breaker.allow():
+        raise LLMUnavailable("LLM requests are paused", retry_after=breaker.retry_after())
+    metrics.inc('llm_requests_total', kind=kind)
+    metrics.inc('llm_tokens_in_total', tokens_in)
+    metrics.inc('llm_files_total', file_count)
+    start = time.perf_counter()
+    try:
+        raw = chain.run(**inputs)
+    except LLMUnavailable as e:
+        metrics.inc('errors_total', stage='llm')
+        breaker.record_failure()
+        e.retry_after = breaker.retry_after()
+        raise
+    except Exception:
+        metrics.inc('errors_total', stage='llm')
+        raise
+    finally:
+        metrics.observe('llm_request_seconds', time.perf_counter() - start, kind=kind)
+    breaker.record_success()
+    metrics.inc('llm_tokens_out_total', estimate_tokens(raw))
+    return raw
+
+
+def suggest_actions(file_meta: dict, custom_prompt: Optional[str] = None,
+                    cache: Optional[SuggestionCache] = None,
+                    limiter: Optional[RateLimiter] = None,
+                    rules: Optional[RuleSet] = None,
+                    decisions: Optional[DecisionIndex] = None,
+                    token_budget: Optional[int] = DEFAULT_PROMPT_TOKEN_BUDGET) -> dict:
     """
     Call the LLM chain with file metadata and parse its JSON response.
     Automatically deletes installer files and other specified types.
 
     :param file_meta: Metadata dict from file_scanner.get_file_metadata
+    :param custom_prompt: Optional custom prompt text for file organization
+    :param cache: Optional SuggestionCache consulted before calling the LLM
+    :param limiter: Optional RateLimiter to wait on before calling the LLM
+    :param rules: Optional compiled RuleSet checked before calling the LLM
+    :param decisions: Optional DecisionIndex; a similar enough past decision
+        is reused instead of calling the LLM
+    :param token_budget: Estimated prompt tokens allowed per request; the
+        preview is trimmed to fit. None sends the whole preview.
     :returns: Parsed suggestions dict
+    :raises LLMUnavailable: if the LLM provider is down; unlike a bad reply,
+        this gets no "keep the file" fallback, so the file can be retried
     """
-    # First check if this is a file type we want to delete
-    filename = file_meta.get('name', '')
-    if should_delete_file(filename):
-        return {
-            'suggested_name': filename,  # Keep original name for logging
-            'suggested_folder': '',
-            'delete': True
-        }
+    # First check installer files and configured rules
+    local = local_suggestion(file_meta, rules)
+    if local is not None:
+        return local
 
     # Prepare input mapping for prompt for non-installer files
-    inputs = {
-        'name': filename,
-        'size_bytes': file_meta.get('size_bytes', 0),
-        'created_time': file_meta.get('created_time', ''),
-        'modified_time': file_meta.get('modified_time', ''),
-        'preview': file_meta.get('preview', '').replace('"', '\\"')
-    }
+    inputs = prompt_inputs(file_meta)
+    inputs['preview'] = inputs['preview'].replace('"', '\\"')
+
+    # Reuse a cached suggestion for unchanged content under the same prompt
+    template = custom_prompt if custom_prompt else DEFAULT_PROMPT_TEMPLATE
+    cache_key = _cache_key(cache, file_meta, template)
+    if cache_key:
+        cached = _cached(cache, cache_key)
+        if cached is not None:
+            return cached
+
+    # Reuse the decision made for a very similar file
+    if decisions is not None:
+        similar = decisions.lookup(file_meta, template)
+        if similar is not None:
+            return similar
+
+    # Compiled once per template, custom or default
+    chain = get_chain(custom_prompt) if custom_prompt else get_default_chain()
+
+    fixed = template_tokens(template)
+    fit_preview(inputs, fixed, token_budget)
+    tokens = fixed + estimate_tokens(inputs['name'] + inputs['preview'])
+    if limiter is not None:
+        limiter.acquire(tokens)
 
-    # Create chain with custom prompt if provided
-    chain = create_chain(custom_prompt) if custom_prompt else default_chain
-    
     # Generate suggestion
     try:
-        raw = chain.run(**inputs)
-        suggestion = json.loads(raw)
+        raw = _run_chain(chain, 'single', tokens, **inputs)
+        try:
+            suggestion = json.loads(raw)
+        except json.JSONDecodeError:
+            metrics.inc('llm_parse_failures_total', kind='single')
+            raise
+        # Only successful LLM answers are cached, never the fallback
+        if cache_key:
+            cache.put(cache_key, suggestion)
+    except LLMUnavailable:
+        raise
     except (json.JSONDecodeError, Exception) as e:
         logging.warning(f"Error generating suggestion: {str(e)}")
         # If parsing fails, return fallback structure
@@ -125,6 +394,137 @@ def suggest_actions(file_meta: dict, custom_prompt: Optional[str] = None) -> dic
         }
     return suggestion
 
+def _is_valid_suggestion(item) -> bool:
+    """Check that a parsed batch item has the keys and types we apply."""
+    return (
+        isinstance(item, dict)
+        and isinstance(item.get('suggested_name'), str) and item['suggested_name'] != ''
+        and isinstance(item.get('suggested_folder'), str)
+        and isinstance(item.get('delete'), bool)
+    )
+
+
+def _parse_json(raw: str):
+    """Parse a JSON reply, tolerating a surrounding ```json code fence."""
+    text = raw.strip()
+    if text.startswith('```'):
+        text = text.split('\n', 1)[1] if '\n' in text else ''
+        text = text.rsplit('```', 1)[0]
+    return json.loads(text)
+
+
+def plan_batches(files: list, max_batch_size: int,
+                 token_budget: int = DEFAULT_BATCH_TOKEN_BUDGET) -> list:
+    """
+    Split files into batches of at most max_batch_size, packing each batch so
+    the estimated prompt stays within token_budget. Files with long previews
+    therefore end up in smaller batches; a file that is over budget on its
+    own is sent alone.
+
+    :returns: List of lists of metadata dicts, in input order
+    """
+    overhead = template_tokens(BATCH_PROMPT_TEMPLATE)
+    batches = []
+    current, used = [], overhead
+    for file_meta in files:
+        # suggest_batch trims previews so a single file always fits
+        inputs = fit_preview(prompt_inputs(file_meta), overhead, token_budget)
+        cost = estimate_tokens(json.dumps(inputs, default=str))
+        if current and (len(current) >= max_batch_size or used + cost > token_budget):
+            batches.append(current)
+            current, used = [], overhead
+        current.append(file_meta)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def suggest_batch(files: list, cache: Optional[SuggestionCache] = None,
+                  limiter: Optional[RateLimiter] = None,
+                  rules: Optional[RuleSet] = None,
+                  decisions: Optional[DecisionIndex] = None,
+                  token_budget: Optional[int] = DEFAULT_BATCH_TOKEN_BUDGET) -> list:
+    """
+    Suggest actions for several files with a single LLM request.
+    Installer files, rule matches, cache hits and similar past decisions are
+    answered locally; items missing or malformed in the reply are retried one
+    at a time with suggest_actions. Results share cache entries with the
+    default prompt.
+
+    :param files: List of metadata dicts from file_scanner.get_file_metadata
+    :param cache: Optional SuggestionCache consulted before calling the LLM
+    :param limiter: Optional RateLimiter to wait on before calling the LLM
+    :param rules: Optional compiled RuleSet checked before calling the LLM
+    :param decisions: Optional DecisionIndex of past decisions checked before the LLM
+    :param token_budget: Estimated prompt tokens allowed for the request; a
+        preview too long to fit even alone is trimmed
+    :returns: List of suggestion dicts, one per file, in input order
+    :raises LLMUnavailable: if the LLM provider is down
+    """
+    results = [None] * len(files)
+    pending = {}   # batch id -> (position in files, cache key)
+    payload = []
+    for position, file_meta in enumerate(files):
+        local = local_suggestion(file_meta, rules)
+        if local is not None:
+            results[position] = local
+            continue
+        cache_key = _cache_key(cache, file_meta, DEFAULT_PROMPT_TEMPLATE)
+        if cache_key:
+            cached = _cached(cache, cache_key)
+            if cached is not None:
+                results[position] = cached
+                continue
+        if decisions is not None:
+            similar = decisions.lookup(file_meta, DEFAULT_PROMPT_TEMPLATE)
+            if similar is not None:
+                results[position] = similar
+                continue
+        item_id = len(payload)
+        pending[item_id] = (position, cache_key)
+        inputs = fit_preview(prompt_inputs(file_meta), template_tokens(BATCH_PROMPT_TEMPLATE),
+                             token_budget)
+        payload.append(dict(id=item_id, **inputs))
+
+    if payload:
+        files_json = json.dumps(payload, indent=1, default=str)
+        tokens = template_tokens(BATCH_PROMPT_TEMPLATE) + estimate_tokens(files_json)
+        if limiter is not None:
+            limiter.acquire(tokens)
+        try:
+            raw = _run_chain(get_batch_chain(), 'batch', tokens, len(payload), files=files_json)
+            try:
+                reply = _parse_json(raw)
+                if not isinstance(reply, list):
+                    raise ValueError("batch reply is not a JSON array")
+            except ValueError:
+                metrics.inc('llm_parse_failures_total', kind='batch')
+                raise
+        except LLMUnavailable:
+            raise
+        except Exception as e:
+            logging.warning(f"Error generating batch suggestion: {str(e)}")
+            reply = []
+
+        for item in reply:
+            if not _is_valid_suggestion(item) or item.get('id') not in pending:
+                continue
+            position, cache_key = pending.pop(item['id'])
+            suggestion = {k: item[k] for k in ('suggested_name', 'suggested_folder', 'delete')}
+            results[position] = suggestion
+            if cache_key:
+                cache.put(cache_key, suggestion)
+
+        # Retry only the items the batch reply did not answer properly
+        if pending and reply:
+            metrics.inc('llm_parse_failures_total', len(pending), kind='batch_item')
+        if pending:
+            logging.info(f"Retrying {len(pending)} of {len(payload)} batch items individually")
+        for position, _ in pending.values():
+            results[position] = suggest_actions(files[position], cache=cache, limiter=limiter)
+    return results
+
 # Example usage if run directly
 if __name__ == '__main__':
     # Sample metadata stub
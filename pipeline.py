@@ -0,0 +1,124 @@
+"""
+pipeline.py
+
+Concurrent suggestion pipeline:
+- Keeps up to `llm.concurrency` suggest_actions calls in flight on a thread pool
+- Optionally packs several files into one batched request (llm.batch_size),
+  sized to stay under llm.batch_token_budget
+- Consumes files lazily and yields (file_meta, suggestion) pairs in input
+  order, so apply_suggestion always runs in a deterministic order
+- Files that could not be asked about because the LLM provider is down are
+  yielded with a suggestion of None, for the caller to retry later
+"""
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, Optional
+
+from decision_index import DecisionIndex
+from llm_backend import LLMUnavailable
+from metrics import metrics
+from organizer import (DEFAULT_BATCH_TOKEN_BUDGET, DEFAULT_PROMPT_TOKEN_BUDGET, plan_batches,
+                       suggest_actions, suggest_batch)
+from rate_limiter import RateLimiter
+from rules import RuleSet
+from suggestion_cache import SuggestionCache
+
+DEFAULT_CONCURRENCY = 4
+
+
+def suggest_many(files: Iterable[dict], custom_prompt: Optional[str] = None,
+                 cache: Optional[SuggestionCache] = None,
+                 limiter: Optional[RateLimiter] = None,
+                 concurrency: int = DEFAULT_CONCURRENCY,
+                 batch_size: int = 1,
+                 batch_token_budget: int = DEFAULT_BATCH_TOKEN_BUDGET,
+                 prompt_token_budget: Optional[int] = DEFAULT_PROMPT_TOKEN_BUDGET,
+                 rules: Optional[RuleSet] = None,
+                 decisions: Optional[DecisionIndex] = None) -> Iterator[tuple]:
+    """
+    Generate suggestions for many files with bounded parallelism.
+
+    :param files: Iterable of metadata dicts from file_scanner
+    :param custom_prompt: Optional custom prompt text for file organization
+    :param cache: Optional SuggestionCache shared by all workers
+    :param limiter: Optional RateLimiter throttling the LLM calls
+    :param concurrency: Maximum number of requests in flight
+    :param batch_size: Files per LLM request; batching is only used with the
+        default prompt, since custom prompts describe a single file
+    :param batch_token_budget: Estimated prompt tokens allowed per batched request
+    :param prompt_token_budget: Estimated prompt tokens allowed per single-file
+        request; longer previews are trimmed
+    :param rules: Optional compiled RuleSet answering files without the LLM
+    :param decisions: Optional DecisionIndex reusing similar past decisions
+    :returns: Iterator of (file_meta, suggestion) in the order of `files`;
+        the suggestion is None for files deferred because the LLM is unavailable
+    """
+    if batch_size > 1 and not custom_prompt:
+        def ask(group):
+            return suggest_batch(group, cache=cache, limiter=limiter, rules=rules,
+                                 decisions=decisions, token_budget=batch_token_budget)
+        groups = _batched(files, batch_size, batch_token_budget)
+    else:
+        def ask(group):
+            return [suggest_actions(group[0], custom_prompt=custom_prompt, cache=cache,
+                                    limiter=limiter, rules=rules, decisions=decisions,
+                                    token_budget=prompt_token_budget)]
+        groups = ([file_meta] for file_meta in files)
+
+    def suggest(group):
+        try:
+            return ask(group)
+        except LLMUnavailable as e:
+            metrics.inc('llm_deferred_total', len(group))
+            logging.debug(f"Deferring {len(group)} files: {e}")
+            return [None] * len(group)
+
+    if concurrency <= 1:
+        for group in groups:
+            yield from zip(group, suggest(group))
+        return
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='suggest') as pool:
+        in_flight = deque()
+        for group in groups:
+            in_flight.append((group, pool.submit(suggest, group)))
+            # Allow a small read-ahead so workers never idle while we yield
+            if len(in_flight) >= concurrency * 2:
+                group, future = in_flight.popleft()
+                yield from zip(group, future.result())
+        while in_flight:
+            group, future = in_flight.popleft()
+            yield from zip(group, future.result())
+
+
+def _batched(files: Iterable[dict], batch_size: int, token_budget: int) -> Iterator[list]:
+    """
+    Lazily split files into token-budgeted batches of at most batch_size.
+    """
+    iterator = iter(files)
+    while True:
+        chunk = list(islice(iterator, batch_size))
+        if not chunk:
+            return
+        yield from plan_batches(chunk, batch_size, token_budget)
+
+
+def get_batching(config: dict) -> dict:
+    """
+    Return the batching and prompt budget keyword arguments for suggest_many from config.
+    """
+    options = config.get('llm') or {}
+    return {
+        'batch_size': int(options.get('batch_size', 1)),
+        'batch_token_budget': int(options.get('batch_token_budget', DEFAULT_BATCH_TOKEN_BUDGET)),
+        'prompt_token_budget': options.get('prompt_token_budget', DEFAULT_PROMPT_TOKEN_BUDGET)
+    }
+
+
+def get_concurrency(config: dict) -> int:
+    """
+    Return the configured number of suggestions to keep in flight.
+    """
+    return int((config.get('llm') or {}).get('concurrency', DEFAULT_CONCURRENCY))
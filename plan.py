@@ -0,0 +1,482 @@
+"""
+plan.py
+
+Batch execution of the file operations suggested in one run:
+- Collects every (file, suggestion) pair and turns them into a plan of
+  move and delete actions before touching the disk
+- Resolves name collisions up front, against files already in each target
+  folder and against other files in the same plan (name_1.ext, name_2.ext, ...)
+- Lists each target folder and creates missing ones exactly once, and runs
+  the moves grouped by destination
+- Records the plan in a write-ahead journal, so an interrupted run can be
+  resumed (--resume) and a finished one undone (--undo)
+"""
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from action_log import action_log
+from metrics import metrics
+from mover import Mover, move_file
+
+DEFAULT_JOURNAL_DIR = '~/.cache/auto_file_organizer/journal'
+DEFAULT_JOURNAL_KEEP = 20
+
+# Metadata fields build_plan, the file index and the journal need from each item
+PLAN_FIELDS = ('path', 'name', 'inode', 'size_bytes', 'mtime_ns')
+
+# Journals created by this process, so two plans in one second get different files
+_journal_numbers = itertools.count(1)
+
+# Name comparisons follow the filesystem: case-insensitive on macOS and Windows
+if sys.platform in ('darwin', 'win32'):
+    def _name_key(name: str) -> str:
+        return name.casefold()
+else:
+    def _name_key(name: str) -> str:
+        return name
+
+
+class Plan:
+    """
+    Ordered list of actions plus the folders that must be created first.
+    Each action is a dict with 'seq', 'op' ('move' or 'delete'), 'src' and,
+    for moves, 'dst'.
+    """
+    def __init__(self, actions: list = None, directories: list = None):
+        self.actions = actions or []
+        self.directories = directories or []
+
+    def __len__(self) -> int:
+        return len(self.actions)
+
+    def to_dict(self) -> dict:
+        return {'actions': self.actions, 'directories': self.directories}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Plan':
+        return cls(data.get('actions', []), data.get('directories', []))
+
+
+def plan_item(file_meta: dict, suggestion: dict, keep: tuple = ()) -> tuple:
+    """
+    Return (file_meta, suggestion) with file_meta cut down to PLAN_FIELDS
+    and the `keep` fields, so a run holding its items until the plan is
+    applied does not also hold every preview.
+    """
+    return {key: file_meta[key] for key in PLAN_FIELDS + keep if key in file_meta}, suggestion
+
+
+def target_path(file_meta: dict, suggestion: dict, root_folder: Optional[str] = None) -> Path:
+    """
+    Return where a suggestion would put a file, before collision handling.
+    """
+    original = Path(file_meta['path'])
+    base_dir = Path(root_folder) if root_folder else original.parent
+    target = suggestion.get('suggested_folder', '')
+    dest = base_dir / target if target else base_dir
+    return dest / suggestion.get('suggested_name', original.name)
+
+
+def _free_name(name: str, taken: set) -> str:
+    """Return name, or name_1, name_2, ... (before the extension) if it is taken."""
+    if _name_key(name) not in taken:
+        return name
+    path = Path(name)
+    stem, suffix = (path.stem, path.suffix) if path.stem else (name, '')
+    n = 1
+    while _name_key(f"{stem}_{n}{suffix}") in taken:
+        n += 1
+    return f"{stem}_{n}{suffix}"
+
+
+def build_plan(items: Iterable[tuple], root_folder: Optional[str] = None) -> Plan:
+    """
+    Turn (file_meta, suggestion) pairs into a Plan.
+
+    Each target folder is listed once to learn which names are taken; files
+    that would collide with an existing file or with another file in the plan
+    get a numbered name instead of overwriting it.
+
+    :param items: Iterable of (file_meta, suggestion) pairs
+    :param root_folder: Base folder for suggested_folder; each file's own
+        folder if None
+    """
+    taken = {}          # destination folder -> set of name keys in use
+    missing = set()     # destination folders that do not exist yet
+    moves, deletes = [], []
+    planned = set()     # sources already in the plan
+
+    def names_in(folder: str) -> set:
+        if folder not in taken:
+            try:
+                with os.scandir(folder) as it:
+                    taken[folder] = {_name_key(entry.name) for entry in it}
+            except FileNotFoundError:
+                taken[folder] = set()
+                missing.add(folder)
+        return taken[folder]
+
+    for file_meta, suggestion in items:
+        src = str(file_meta['path'])
+        if src in planned:
+            continue
+        planned.add(src)
+        if suggestion.get('delete'):
+            deletes.append({'op': 'delete', 'src': src})
+            continue
+        original = Path(src)
+        dest = target_path(file_meta, suggestion, root_folder)
+        if dest == original:
+            continue  # nothing to do
+        folder = str(dest.parent)
+        in_use = names_in(folder)
+        name = dest.name
+        # A case-only rename of a file does not collide with the file itself
+        if not (folder == str(original.parent) and _name_key(name) == _name_key(original.name)):
+            name = _free_name(name, in_use)
+        in_use.add(_name_key(name))
+        moves.append({'op': 'move', 'src': src, 'dst': os.path.join(folder, name)})
+
+    # Group moves by destination folder, deletes last; keep input order within a group
+    order = {}
+    for action in moves:
+        order.setdefault(os.path.dirname(action['dst']), len(order))
+    moves.sort(key=lambda action: order[os.path.dirname(action['dst'])])
+    actions = moves + deletes
+    for seq, action in enumerate(actions):
+        action['seq'] = seq
+    # Folders to create, parents before children
+    used = {os.path.dirname(action['dst']) for action in moves}
+    return Plan(actions, sorted(missing & used, key=lambda folder: (folder.count(os.sep), folder)))
+
+
+class PlanJournal:
+    """
+    Write-ahead journal of one plan, stored as JSON lines:
+    the plan itself, then one record per finished action, then 'complete'.
+    The plan line is fsynced before any file is touched.
+    """
+    def __init__(self, path):
+        self.path = Path(path).expanduser()
+        self._file = None
+        self._lock = threading.Lock()   # background moves record from other threads
+
+    @classmethod
+    def create(cls, directory: str = DEFAULT_JOURNAL_DIR, keep: int = DEFAULT_JOURNAL_KEEP) -> 'PlanJournal':
+        """
+        Start a new journal file in directory, dropping the oldest finished
+        journals beyond `keep`. Interrupted ones are kept for --resume.
+        """
+        folder = Path(directory).expanduser()
+        folder.mkdir(parents=True, exist_ok=True)
+        existing = list_journals(directory)
+        if keep and len(existing) >= keep:
+            for old in existing[:len(existing) - keep + 1]:
+                journal = cls(old)
+                try:
+                    plan, _, state = journal.load()
+                    if state == 'incomplete' and len(plan):
+                        continue
+                    old.unlink()
+                except OSError:
+                    pass
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        while True:
+            path = folder / f"plan-{stamp}-{os.getpid()}-{next(_journal_numbers)}.jsonl"
+            try:
+                # Created exclusively: no other plan ever writes into this file
+                open(path, 'x').close()
+                return cls(path)
+            except FileExistsError:
+                continue
+
+    def _write(self, record: dict, sync: bool = False) -> None:
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+
+    def begin(self, plan: Plan) -> None:
+        self._write({'type': 'plan', 'created': time.time(), **plan.to_dict()}, sync=True)
+
+    def record(self, seq: int, status: str) -> None:
+        self._write({'type': 'action', 'seq': seq, 'status': status})
+
+    def finish(self, kind: str = 'complete') -> None:
+        self._write({'type': kind}, sync=True)
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def load(self) -> tuple:
+        """
+        Read the journal back.
+
+        :returns: (plan, statuses {seq: status}, state) where state is
+            'incomplete', 'complete' or 'undone'
+        """
+        plan, statuses, state = Plan(), {}, 'incomplete'
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # torn last line from a crash
+                if record['type'] == 'plan':
+                    plan = Plan.from_dict(record)
+                elif record['type'] == 'action':
+                    statuses[record['seq']] = record['status']
+                elif record['type'] in ('complete', 'undone'):
+                    state = record['type']
+        return plan, statuses, state
+
+
+def list_journals(directory: str = DEFAULT_JOURNAL_DIR) -> list:
+    """Return journal files in directory, oldest first."""
+    folder = Path(directory).expanduser()
+    if not folder.is_dir():
+        return []
+    return sorted(folder.glob('plan-*.jsonl'), key=lambda path: (path.stat().st_mtime, path.name))
+
+
+def latest_journal(directory: str = DEFAULT_JOURNAL_DIR, state: str = None) -> Optional[PlanJournal]:
+    """Return the newest journal, optionally only one in the given state."""
+    for path in reversed(list_journals(directory)):
+        journal = PlanJournal(path)
+        if state is None or journal.load()[2] == state:
+            return journal
+    return None
+
+
+def _confirm(action: dict) -> bool:
+    src = Path(action['src'])
+    if action['op'] == 'delete':
+        return input(f"Delete {src.name}? [y/N]: ").lower() == 'y'
+    dst = Path(action['dst'])
+    changes = []
+    if dst.name != src.name:
+        changes.append(f"rename to '{dst.name}'")
+    if dst.parent != src.parent:
+        changes.append(f"move to '{dst.parent}'")
+    return input(f"Apply to {src.name}: " + ", ".join(changes) + "? [y/N]: ").lower() == 'y'
+
+
+def _delete(action: dict) -> str:
+    """Delete one file and return the action's status."""
+    src = action['src']
+    try:
+        os.unlink(src)
+        metrics.inc('deletes_total')
+        logging.info(f"Deleted {src}")
+        action_log.record('delete', path=src, status='done')
+        return 'done'
+    except Exception as e:
+        metrics.inc('errors_total', stage='delete')
+        logging.error(f"Error deleting {src}: {e}")
+        action_log.record('delete', path=src, status='failed', error=str(e))
+        return 'failed'
+
+
+def _move_status(action: dict, error: Optional[BaseException]) -> str:
+    """Report a finished move and return the action's status."""
+    if error is not None:
+        metrics.inc('errors_total', stage='move')
+        logging.error(f"Error moving {action['src']}: {error}")
+        action_log.record('move', path=action['src'], dst=action['dst'], status='failed',
+                          error=str(error))
+        return 'failed'
+    metrics.inc('moves_total')
+    logging.info(f"Moved {action['src']} -> {action['dst']}")
+    action_log.record('move', path=action['src'], dst=action['dst'], status='done')
+    return 'done'
+
+
+def execute_plan(plan: Plan, journal: Optional[PlanJournal] = None, auto_confirm: bool = False,
+                 confirm: Callable[[dict], bool] = _confirm, statuses: dict = None,
+                 mover: Optional[Mover] = None,
+                 on_complete: Optional[Callable[[dict], None]] = None,
+                 errors: Optional[dict] = None) -> dict:
+    """
+    Run a plan: create the missing folders once, then apply each action.
+
+    :param plan: Plan from build_plan
+    :param journal: Optional PlanJournal; the plan is written to it before
+        any action runs and every action's outcome after it runs
+    :param auto_confirm: Skip the per-action confirmation prompt
+    :param confirm: Callable asking the user about one action
+    :param statuses: {seq: status} of actions already finished; given when
+        resuming, in which case the plan is not written to the journal again
+    :param mover: Mover used for moves; large cross-device moves it queues are
+        waited for before this returns, unless on_complete is given
+    :param on_complete: Called with the result once every action has
+        finished, background moves included (from the mover's thread if the
+        last one was queued). The plan then returns without waiting for
+        queued moves, and the journal is finished by the last of them.
+    :param errors: Optional dict filled with {source path: exception} for
+        every move that failed, e.g. FileExistsError for a taken target
+    :returns: {source path: new Path} for every file that was moved; with
+        on_complete, only the moves finished so far
+    """
+    if journal is not None and statuses is None:
+        journal.begin(plan)
+    statuses = statuses or {}
+    mover = mover or Mover()
+    for folder in plan.directories:
+        try:
+            os.makedirs(folder, exist_ok=True)
+        except OSError as e:
+            logging.error(f"Could not create {folder}: {e}")
+    moved = {}
+    pending = [1]    # the loop below, plus each move not settled yet
+    lock = threading.Lock()
+
+    def finished(action: dict, status: str) -> None:
+        if status == 'done' and action['op'] == 'move':
+            moved[action['src']] = Path(action['dst'])
+        if journal is not None:
+            journal.record(action['seq'], status)
+
+    def settle() -> None:
+        with lock:
+            pending[0] -= 1
+            if pending[0]:
+                return
+        if journal is not None:
+            journal.finish()
+        if on_complete is not None:
+            on_complete(moved)
+
+    def move_done(action: dict, error: Optional[BaseException]) -> None:
+        try:
+            if error is not None and errors is not None:
+                errors[action['src']] = error
+            finished(action, _move_status(action, error))
+        finally:
+            settle()
+
+    try:
+        for action in plan.actions:
+            if action['seq'] in statuses:
+                if statuses[action['seq']] == 'done' and action['op'] == 'move':
+                    moved[action['src']] = Path(action['dst'])
+                continue
+            if not auto_confirm and not confirm(action):
+                metrics.inc('skipped_total')
+                logging.info(f"Skipped {action['src']}")
+                action_log.record('skip', path=action['src'], status='skipped')
+                finished(action, 'skipped')
+            elif action['op'] == 'delete':
+                finished(action, _delete(action))
+            else:
+                with lock:
+                    pending[0] += 1
+                mover.move(action['src'], action['dst'],
+                           on_done=lambda error, action=action: move_done(action, error))
+    except BaseException:
+        mover.wait()
+        if journal is not None:
+            journal.close()
+        raise
+    if on_complete is None:
+        mover.wait()
+    settle()
+    return moved
+
+
+def resume_plan(journal: PlanJournal, auto_confirm: bool = False,
+                mover: Optional[Mover] = None) -> dict:
+    """
+    Finish an interrupted plan. Actions with no recorded outcome are checked
+    against the disk first: a move whose source is gone and whose target
+    exists already happened before the crash.
+
+    :returns: {source path: new Path} for every file moved by the plan
+    """
+    plan, statuses, state = journal.load()
+    if state != 'incomplete':
+        logging.info(f"Plan {journal.path.name} is already {state}")
+        return {}
+    for action in plan.actions:
+        if action['seq'] in statuses:
+            continue
+        src_exists = os.path.lexists(action['src'])
+        if action['op'] == 'move' and not src_exists and os.path.lexists(action['dst']):
+            statuses[action['seq']] = 'done'
+            journal.record(action['seq'], 'done')
+        elif not src_exists:
+            statuses[action['seq']] = 'failed'
+            journal.record(action['seq'], 'failed')
+    journal.close()
+    logging.info(f"Resuming plan {journal.path.name}: "
+                 f"{len(plan) - len(statuses)} of {len(plan)} actions left")
+    return execute_plan(plan, journal, auto_confirm=auto_confirm, statuses=statuses, mover=mover)
+
+
+def undo_plan(journal: PlanJournal) -> int:
+    """
+    Move every file the plan moved back to where it was, newest first, and
+    remove the folders the plan created if they are empty again. Deleted
+    files cannot be restored.
+
+    :returns: Number of moves undone
+    """
+    plan, statuses, state = journal.load()
+    if state == 'undone':
+        logging.info(f"Plan {journal.path.name} was already undone")
+        return 0
+    undone = 0
+    for action in reversed(plan.actions):
+        if statuses.get(action['seq']) != 'done':
+            continue
+        if action['op'] == 'delete':
+            logging.warning(f"Cannot undo delete of {action['src']}")
+            continue
+        if not os.path.lexists(action['dst']) or os.path.lexists(action['src']):
+            logging.warning(f"Cannot undo move of {action['src']}: files changed since")
+            continue
+        try:
+            os.makedirs(os.path.dirname(action['src']), exist_ok=True)
+            move_file(action['dst'], action['src'])
+            logging.info(f"Moved {action['dst']} -> {action['src']}")
+            # Recorded as a move back, so "where did it go" follows it home
+            action_log.record('move', path=action['dst'], dst=action['src'], status='done', undo=True)
+            undone += 1
+        except Exception as e:
+            metrics.inc('errors_total', stage='undo')
+            logging.error(f"Error moving {action['dst']} back: {e}")
+    for folder in reversed(plan.directories):
+        try:
+            os.rmdir(folder)
+        except OSError:
+            pass  # not empty or already gone
+    journal.finish('undone')
+    return undone
+
+
+def get_journal_options(config: dict) -> dict:
+    """
+    Read the `plan` section of config.yaml.
+
+    :returns: {'directory': str, 'keep': int}, or {} if journaling is disabled
+    """
+    options = config.get('plan') or {}
+    if not options.get('journal', True):
+        return {}
+    return {
+        'directory': options.get('journal_dir', DEFAULT_JOURNAL_DIR),
+        'keep': options.get('keep', DEFAULT_JOURNAL_KEEP),
+    }
@@ -0,0 +1,197 @@
+"""
+plan_file.py
+
+Saved plans: the suggestions of a dry run, written to a file so they can be
+applied later without asking the LLM again (--save-plan, --apply-plan):
+- One JSON line per file with its identity (path, size, mtime_ns and the
+  partial content hash from duplicates.py) and its suggestion. The identity
+  is the one the suggestion was made from: size and mtime_ns from the
+  scanned metadata, the hash taken as the file was scanned
+- Duplicate deletes also record the identity of the copy that is kept
+- Written to a temporary file and renamed into place when complete, so a
+  half-written plan is never applied
+- On apply, entries whose file is gone or no longer matches its identity
+  are skipped instead of being moved on stale advice; a duplicate is only
+  deleted while the kept copy still exists with the same content
+"""
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+from duplicates import full_hash, partial_hash
+
+PLAN_FILE_VERSION = 1
+
+
+def file_identity(path, stat: os.stat_result = None) -> dict:
+    """
+    Return the identity recorded for a file: path, size, mtime_ns and hash.
+    """
+    stat = stat or os.stat(path)
+    return {
+        'path': str(path),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'hash': partial_hash(path, stat.st_size)
+    }
+
+
+class PlanWriter:
+    """
+    Streams (file_meta, suggestion) pairs into a plan file.
+    """
+    def __init__(self, path, custom_prompt: Optional[str] = None):
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._tmp = self.path.with_name(self.path.name + '.tmp')
+        self._file = open(self._tmp, 'w', encoding='utf-8')
+        self.count = 0
+        self._hashes = {}   # path -> partial hash taken at scan time
+        self._write({'type': 'header', 'version': PLAN_FILE_VERSION, 'created': time.time(),
+                     'custom_prompt': bool(custom_prompt)})
+
+    def _write(self, record: dict) -> None:
+        self._file.write(json.dumps(record) + '\n')
+
+    def scanned(self, entries):
+        """
+        Pass (path, stat) entries through, hashing each file as it is
+        scanned, before its preview is read for the suggestion.
+        """
+        for path, stat in entries:
+            try:
+                self._hashes[str(path)] = partial_hash(path, stat.st_size)
+            except OSError as e:
+                logging.warning(f"Cannot hash {path} for the plan: {e}")
+            yield path, stat
+
+    def add(self, file_meta: dict, suggestion: dict) -> None:
+        """
+        Record one file's suggestion with the identity it was made from.
+        Scanned files need to have passed through scanned(); duplicates,
+        which are decided from the hash index, are identified as they are now.
+        """
+        path = str(file_meta['path'])
+        try:
+            if 'mtime_ns' in file_meta:
+                if path not in self._hashes:
+                    logging.warning(f"Not saving {path} in the plan: not hashed when it was scanned")
+                    return
+                identity = {'path': path, 'size': file_meta['size_bytes'],
+                            'mtime_ns': file_meta['mtime_ns'], 'hash': self._hashes.pop(path)}
+            else:
+                identity = file_identity(path)
+            if 'duplicate_of' in suggestion:
+                identity['keeper'] = file_identity(suggestion['duplicate_of'])
+        except OSError as e:
+            logging.warning(f"Not saving {path} in the plan: {e}")
+            return
+        self._write({'type': 'file', **identity, 'suggestion': suggestion})
+        self.count += 1
+
+    def close(self) -> None:
+        """
+        Finish the plan file and move it into place.
+        """
+        if self._file is None:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+        os.replace(self._tmp, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            self._tmp.unlink(missing_ok=True)
+
+
+def read_plan_file(path) -> tuple:
+    """
+    Read a plan file.
+
+    :returns: (header dict, list of file entries)
+    :raises ValueError: if the file is not a plan file of a known version
+    """
+    header, entries = None, []
+    with open(Path(path).expanduser(), encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get('type') == 'header':
+                header = record
+            elif record.get('type') == 'file':
+                entries.append(record)
+    if header is None or header.get('version') != PLAN_FILE_VERSION:
+        raise ValueError(f"{path} is not a version {PLAN_FILE_VERSION} plan file")
+    return header, entries
+
+
+def _check_identity(identity: dict) -> tuple:
+    # (stat, None) if the file still matches the identity, else (None, reason)
+    path = identity['path']
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None, 'missing'
+    if stat.st_size != identity['size'] or stat.st_mtime_ns != identity['mtime_ns']:
+        return None, 'modified'
+    try:
+        if partial_hash(path, stat.st_size) != identity['hash']:
+            return None, 'modified'
+    except OSError:
+        return None, 'unreadable'
+    return stat, None
+
+
+def check_entry(entry: dict) -> tuple:
+    """
+    Compare a plan entry with the file on disk. A duplicate delete also
+    needs the kept copy unchanged and still identical to the duplicate.
+
+    :returns: (file_meta, None) if the file is unchanged, else (None, reason)
+    """
+    path = entry['path']
+    stat, reason = _check_identity(entry)
+    if reason is not None:
+        return None, reason
+    if 'duplicate_of' in entry['suggestion']:
+        keeper = entry.get('keeper')
+        if keeper is None or keeper['path'] != entry['suggestion']['duplicate_of']:
+            return None, 'kept copy not recorded'
+        _, reason = _check_identity(keeper)
+        if reason is not None:
+            return None, f'kept copy {reason}'
+        try:
+            if full_hash(path) != full_hash(keeper['path']):
+                return None, 'no longer a duplicate'
+        except OSError:
+            return None, 'unreadable'
+    return {'path': path, 'name': os.path.basename(path), 'inode': stat.st_ino,
+            'size_bytes': stat.st_size, 'mtime_ns': stat.st_mtime_ns}, None
+
+
+def load_plan_items(path) -> tuple:
+    """
+    Return the entries of a plan file that still match their files.
+
+    :returns: (items, skipped) where items are (file_meta, suggestion) pairs
+        for plan.build_plan and skipped is a list of (path, reason)
+    """
+    _, entries = read_plan_file(path)
+    items, skipped = [], []
+    for entry in entries:
+        file_meta, reason = check_entry(entry)
+        if file_meta is None:
+            skipped.append((entry['path'], reason))
+        else:
+            items.append((file_meta, entry['suggestion']))
+    return items, skipped
@@ -0,0 +1,206 @@
+"""
+poll_scheduler.py
+
+Adaptive per-folder polling, replacing one fixed interval for every folder:
+- Before a folder is scanned, the modification times of its directory (and
+  of the subdirectories found last time, for recursive scans) are compared
+  with the previous check; an unchanged folder is not scanned at all
+- Each folder has its own interval: it drops to the minimum when the folder
+  changes and doubles (up to the maximum) every time it is found unchanged,
+  so a busy Downloads folder is polled often and an idle one rarely
+- The loop sleeps until the next folder is due instead of waking every second
+- A file edited in place does not change its directory's mtime, so every
+  folder is still scanned in full once per `verify_hours`
+"""
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+DEFAULT_MIN_INTERVAL = 30.0
+DEFAULT_BACKOFF = 2.0
+DEFAULT_VERIFY_HOURS = 24.0
+
+
+def directory_signature(folder: str, known: list = None) -> Optional[dict]:
+    """
+    Return {directory: mtime_ns} for folder and the given known
+    subdirectories, or None if folder does not exist. Only stats the
+    directories; nothing is listed.
+    """
+    signature = {}
+    for directory in [folder] + list(known or []):
+        try:
+            signature[directory] = os.stat(directory).st_mtime_ns
+        except OSError:
+            if directory == folder:
+                return None
+            signature[directory] = None  # removed: differs from the recorded mtime
+    return signature
+
+
+def list_subdirectories(folder: str, max_depth: Optional[int] = None, is_excluded=None) -> list:
+    """
+    Return every subdirectory of folder down to max_depth, skipping excluded ones.
+    """
+    found = []
+    stack = [(folder, 0)]
+    prefix = len(folder) + 1
+    while stack:
+        directory, depth = stack.pop()
+        if max_depth is not None and depth >= max_depth:
+            continue
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        rel_path = entry.path[prefix:].replace(os.sep, '/')
+                        if is_excluded is None or not is_excluded(rel_path, True):
+                            found.append(entry.path)
+                            stack.append((entry.path, depth + 1))
+        except OSError:
+            continue
+    return found
+
+
+class FolderState:
+    """Polling state of one monitored folder."""
+    __slots__ = ('folder', 'interval', 'next_due', 'signature', 'subdirectories',
+                 'verified_at', 'changes', 'checks')
+
+    def __init__(self, folder: str, interval: float, now: float):
+        self.folder = folder
+        self.interval = interval
+        self.next_due = now          # first check right away
+        self.signature = None        # None: never scanned, so it counts as changed
+        self.subdirectories = []
+        self.verified_at = now
+        self.changes = 0
+        self.checks = 0
+
+
+class FolderScheduler:
+    """
+    Decides which monitored folders need a scan and when to check again.
+
+    :param folders: Monitored folders
+    :param min_interval: Seconds between checks of a folder that just changed
+    :param max_interval: Upper bound for the interval of an idle folder
+    :param backoff: Factor the interval grows by after each unchanged check
+    :param verify_seconds: Scan a folder in full at least this often, changed or not
+    :param recursive: Whether subdirectories are scanned (their mtimes are then checked too)
+    :param max_depth: Depth limit of recursive scans
+    :param is_excluded: Exclude matcher from file_scanner.compile_excludes
+    """
+    def __init__(self, folders: list, min_interval: float = DEFAULT_MIN_INTERVAL,
+                 max_interval: float = 600.0, backoff: float = DEFAULT_BACKOFF,
+                 verify_seconds: float = DEFAULT_VERIFY_HOURS * 3600, recursive: bool = False,
+                 max_depth: Optional[int] = None, is_excluded=None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff = backoff
+        self.verify_seconds = verify_seconds
+        self.recursive = recursive
+        self.max_depth = max_depth
+        self.is_excluded = is_excluded
+        self.clock = clock
+        now = clock()
+        self.folders = [FolderState(str(Path(folder).expanduser()), min_interval, now)
+                        for folder in folders]
+
+    def due(self, now: float = None) -> list:
+        """
+        Check every folder whose time has come and return those that changed
+        (or are due for their periodic full scan). Intervals are adjusted for
+        every folder checked.
+        """
+        now = self.clock() if now is None else now
+        changed = []
+        for state in self.folders:
+            if state.next_due > now:
+                continue
+            state.checks += 1
+            signature = directory_signature(state.folder, state.subdirectories)
+            verify = now - state.verified_at >= self.verify_seconds
+            if signature is not None and (signature != state.signature or verify):
+                if signature != state.signature:
+                    state.changes += 1
+                    state.interval = self.min_interval
+                else:
+                    state.interval = min(self.max_interval, state.interval * self.backoff)
+                changed.append(state.folder)
+                state.verified_at = now
+                if self.recursive and self.max_depth != 0:
+                    # New subdirectories change their parent's mtime, so the set is refreshed here
+                    state.subdirectories = list_subdirectories(
+                        state.folder, self.max_depth, self.is_excluded
+                    )
+                    signature = directory_signature(state.folder, state.subdirectories)
+            else:
+                state.interval = min(self.max_interval, state.interval * self.backoff)
+            state.signature = signature
+            state.next_due = now + state.interval
+        return changed
+
+    def invalidate(self, folders: list, delay: float = None) -> None:
+        """
+        Forget the recorded state of folders, e.g. after their scan failed,
+        so they are scanned again after min_interval (or delay, if longer).
+        """
+        delay = max(self.min_interval, delay or 0)
+        for state in self.folders:
+            if state.folder in folders:
+                state.signature = None
+                state.interval = self.min_interval
+                state.next_due = min(state.next_due, self.clock() + delay)
+
+    def next_wakeup(self) -> float:
+        """Clock time at which the next folder is due."""
+        return min((state.next_due for state in self.folders), default=self.clock() + self.max_interval)
+
+    def stats(self) -> list:
+        """Return per-folder interval, change and check counts."""
+        return [{'folder': s.folder, 'interval': s.interval, 'changes': s.changes, 'checks': s.checks}
+                for s in self.folders]
+
+    def run_forever(self, scan: Callable[[list], None],
+                    sleep: Callable[[float], None] = time.sleep) -> None:
+        """
+        Call scan(folders) with the changed folders whenever some are due,
+        sleeping in between. Runs until interrupted.
+        """
+        while True:
+            folders = self.due()
+            if folders:
+                logging.info(f"Scanning {len(folders)} changed folders: {', '.join(folders)}")
+                try:
+                    scan(folders)
+                except Exception as e:
+                    logging.error(f"Error during scheduled scan: {e}")
+                    self.invalidate(folders)
+            sleep(max(0.0, self.next_wakeup() - self.clock()))
+
+
+def load_scheduler(config: dict) -> FolderScheduler:
+    """
+    Build a FolderScheduler for monitor_folders from the `poll` and `scan`
+    sections of config.yaml. The maximum interval defaults to
+    check_interval_minutes.
+    """
+    from file_scanner import compile_excludes
+    options = config.get('poll') or {}
+    scan = config.get('scan') or {}
+    max_interval = options.get('max_interval_seconds',
+                               config.get('check_interval_minutes', 10) * 60)
+    return FolderScheduler(
+        config.get('monitor_folders', []),
+        min_interval=options.get('min_interval_seconds', DEFAULT_MIN_INTERVAL),
+        max_interval=max_interval,
+        backoff=options.get('backoff', DEFAULT_BACKOFF),
+        verify_seconds=options.get('verify_hours', DEFAULT_VERIFY_HOURS) * 3600,
+        recursive=scan.get('recursive', False),
+        max_depth=scan.get('max_depth'),
+        is_excluded=compile_excludes(scan.get('exclude', []))
+    )
@@ -0,0 +1,98 @@
+"""
+rate_limiter.py
+
+Token-bucket rate limiting for LLM requests:
+- TokenBucket refills continuously at a per-minute rate
+- RateLimiter combines a requests/min and a tokens/min bucket
+- Both are thread-safe and block the caller until capacity is available
+"""
+import threading
+import time
+from typing import Optional
+
+
+# Average characters per token assumed by estimate_tokens
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count for a prompt (about 4 characters per token).
+    """
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class TokenBucket:
+    """
+    Bucket holding up to `capacity` tokens, refilled at `rate_per_minute`.
+    """
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, amount: float = 1) -> float:
+        """
+        Take `amount` tokens if available. Returns 0 on success, otherwise the
+        number of seconds to wait before trying again.
+        """
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return 0.0
+            return (amount - self._tokens) / self.rate
+
+    def acquire(self, amount: float = 1) -> None:
+        """
+        Block until `amount` tokens have been taken from the bucket.
+        """
+        while True:
+            wait = self.try_acquire(amount)
+            if not wait:
+                return
+            self._sleep(wait)
+
+
+class RateLimiter:
+    """
+    Limits LLM calls by requests per minute and prompt tokens per minute.
+    Either limit may be None to leave it unbounded.
+    """
+    def __init__(self, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def acquire(self, tokens: int = 0) -> None:
+        """
+        Block until one request carrying `tokens` prompt tokens may be sent.
+        """
+        if self.requests is not None:
+            self.requests.acquire(1)
+        if self.tokens is not None and tokens:
+            self.tokens.acquire(tokens)
+
+
+def load_limiter(config: dict) -> Optional[RateLimiter]:
+    """
+    Build a RateLimiter from the `llm` section of config.yaml.
+    Returns None if no limits are configured.
+    """
+    options = config.get('llm') or {}
+    rpm = options.get('requests_per_minute')
+    tpm = options.get('tokens_per_minute')
+    if not rpm and not tpm:
+        return None
+    return RateLimiter(requests_per_minute=rpm, tokens_per_minute=tpm)
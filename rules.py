@@ -0,0 +1,179 @@
+"""
+rules.py
+
+Declarative rules from config.yaml that organize files without the LLM:
+- Each rule matches on extension, glob, regex on the name, size range and
+  age range, and maps to a delete decision or a rename template and folder
+- Rules are compiled once into a RuleSet; the first matching rule wins
+- Templates can use {name}, {stem}, {ext}, {slug}, {size_bytes}, named regex
+  groups and the {mtime}/{ctime} datetimes with a format, e.g. {mtime:%Y_%m}
+"""
+import fnmatch
+import re
+import time
+from datetime import datetime
+from pathlib import PurePath
+from typing import Optional
+
+
+def slugify(text: str) -> str:
+    """
+    Lowercase text and replace runs of other characters with underscores.
+    """
+    return re.sub(r'[^a-z0-9]+', '_', text.lower()).strip('_')
+
+
+def _file_datetime(file_meta: dict, ns_key: str, iso_key: str) -> datetime:
+    if file_meta.get(ns_key) is not None:
+        return datetime.fromtimestamp(file_meta[ns_key] / 1e9)
+    if file_meta.get(iso_key):
+        return datetime.fromisoformat(file_meta[iso_key])
+    return datetime.now()
+
+
+class Rule:
+    """
+    One compiled rule. See `RuleSet` for the config format.
+    """
+    def __init__(self, spec: dict, position: int):
+        self.name = spec.get('name', f'rule_{position}')
+        self.extensions = tuple(ext.lower() if ext.startswith('.') else '.' + ext.lower()
+                                for ext in spec.get('extensions', []))
+        self.glob = re.compile(fnmatch.translate(spec['glob']), re.IGNORECASE) \
+            if spec.get('glob') else None
+        try:
+            self.regex = re.compile(spec['regex']) if spec.get('regex') else None
+        except re.error as e:
+            raise ValueError(f"Invalid regex in rule '{self.name}': {e}")
+        self.min_size = spec.get('min_size')
+        self.max_size = spec.get('max_size')
+        self.min_age = spec['min_age_days'] * 86400 if spec.get('min_age_days') is not None else None
+        self.max_age = spec['max_age_days'] * 86400 if spec.get('max_age_days') is not None else None
+        self.delete = bool(spec.get('delete', False))
+        self.rename = spec.get('rename')
+        self.folder = spec.get('folder', '')
+        if not (self.extensions or self.glob or self.regex):
+            raise ValueError(f"Rule '{self.name}' needs extensions, glob or regex")
+        if not (self.delete or self.rename or self.folder):
+            raise ValueError(f"Rule '{self.name}' needs delete, rename or folder")
+
+    def match(self, file_meta: dict, now: float) -> Optional[dict]:
+        """
+        Return the template fields if the rule matches the file, otherwise None.
+        """
+        name = file_meta.get('name', '')
+        lowered = name.lower()
+        if self.extensions and not lowered.endswith(self.extensions):
+            return None
+        if self.glob is not None and not self.glob.match(name):
+            return None
+        groups = {}
+        if self.regex is not None:
+            found = self.regex.search(name)
+            if found is None:
+                return None
+            groups = {k: v for k, v in found.groupdict().items() if v is not None}
+        size = file_meta.get('size_bytes', 0)
+        if self.min_size is not None and size < self.min_size:
+            return None
+        if self.max_size is not None and size > self.max_size:
+            return None
+        mtime = _file_datetime(file_meta, 'mtime_ns', 'modified_time')
+        if self.min_age is not None or self.max_age is not None:
+            age = now - mtime.timestamp()
+            if self.min_age is not None and age < self.min_age:
+                return None
+            if self.max_age is not None and age > self.max_age:
+                return None
+        path = PurePath(name)
+        fields = {
+            'name': name,
+            'stem': path.stem,
+            'ext': path.suffix.lower(),
+            'slug': slugify(path.stem),
+            'size_bytes': size,
+            'mtime': mtime,
+            'ctime': _file_datetime(file_meta, 'ctime_ns', 'created_time'),
+        }
+        fields.update(groups)
+        return fields
+
+    def suggestion(self, fields: dict) -> dict:
+        """
+        Build the suggestion dict for a matched file.
+        """
+        if self.delete:
+            return {'suggested_name': fields['name'], 'suggested_folder': '',
+                    'delete': True, 'rule': self.name}
+        return {
+            'suggested_name': self.rename.format(**fields) if self.rename else fields['name'],
+            'suggested_folder': self.folder.format(**fields),
+            'delete': False,
+            'rule': self.name
+        }
+
+
+class RuleSet:
+    """
+    Rules compiled into a single matcher. Rules are indexed by the last
+    extension they require, so a file is only tested against the rules for
+    its own extension plus the rules without an extension condition.
+
+    Config format (list under `rules` in config.yaml), every key optional
+    except at least one condition and one action:
+
+        - name: screenshots
+          extensions: [.png, .jpg]
+          glob: "Screenshot*"
+          regex: '(?P<date>\\d{4}-\\d{2}-\\d{2})'
+          min_size: 0
+          max_size: 10000000
+          min_age_days: 0
+          max_age_days: 365
+          rename: "screenshot_{date}{ext}"
+          folder: "media/screenshots/{mtime:%Y_%m}"
+          delete: false
+    """
+    def __init__(self, specs: list):
+        self.rules = [Rule(spec, position) for position, spec in enumerate(specs or [])]
+        self._any_extension = []
+        self._by_extension = {}
+        for position, rule in enumerate(self.rules):
+            if not rule.extensions:
+                self._any_extension.append(position)
+            for ext in rule.extensions:
+                key = PurePath('x' + ext).suffix
+                self._by_extension.setdefault(key, []).append(position)
+        # Pre-merge each extension's rules with the generic ones, in config order
+        self._candidates = {
+            key: [self.rules[i] for i in sorted(set(positions) | set(self._any_extension))]
+            for key, positions in self._by_extension.items()
+        }
+        self._generic = [self.rules[i] for i in self._any_extension]
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def match(self, file_meta: dict, now: Optional[float] = None) -> Optional[dict]:
+        """
+        Return the suggestion of the first rule matching the file, or None.
+        """
+        if not self.rules:
+            return None
+        now = time.time() if now is None else now
+        ext = PurePath(file_meta.get('name', '')).suffix.lower()
+        for rule in self._candidates.get(ext, self._generic):
+            fields = rule.match(file_meta, now)
+            if fields is not None:
+                try:
+                    return rule.suggestion(fields)
+                except (KeyError, IndexError, ValueError):
+                    continue  # template refers to a field this file lacks
+        return None
+
+
+def load_rules(config: dict) -> RuleSet:
+    """
+    Compile the `rules` section of config.yaml.
+    """
+    return RuleSet(config.get('rules') or [])
@@ -0,0 +1,248 @@
+"""
+snapshot.py
+
+Columnar snapshot of a full listing, for trees with millions of files:
+- One file holding fixed-width arrays (size, mtime_ns, ctime_ns, inode) and
+  the names and directories as offset-indexed UTF-8 blobs; each directory
+  is stored once, with the range of entries in it
+- Opened with mmap: loading reads a small JSON header and nothing else, and
+  the operating system pages columns in as they are used
+- Entries come back as FileRecords built on access; find(path) is a binary
+  search within the entry's directory
+- Written in one pass over the scanner's stream. The columns are built in
+  memory (about 40 bytes per entry plus the names and directories, far
+  less than a list of stat results) and written out from those buffers
+  without another copy
+
+Usage:
+    python snapshot.py save listing.snap          # scan monitor_folders
+    python snapshot.py info listing.snap
+"""
+import argparse
+import array
+import bisect
+import json
+import mmap
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+from file_record import FileRecord
+
+MAGIC = b'AFOSNAP1'
+SNAPSHOT_VERSION = 1
+# Column name -> array typecode; offsets index into the name and directory blobs
+COLUMNS = {'size': 'q', 'mtime_ns': 'q', 'ctime_ns': 'q', 'inode': 'Q',
+           'name_offsets': 'q', 'dir_offsets': 'q', 'dir_starts': 'q'}
+ALIGN = 8
+
+
+def _encode(text: str) -> bytes:
+    # Paths may hold undecodable bytes; keep them as they came from os.fsdecode
+    return text.encode('utf-8', 'surrogateescape')
+
+
+def _decode(data) -> str:
+    return bytes(data).decode('utf-8', 'surrogateescape')
+
+
+def write_snapshot(path, entries: Iterable[tuple]) -> int:
+    """
+    Write (path, stat) entries, e.g. from file_scanner.iter_entries, to a
+    snapshot file. Entries of one directory are expected together, as the
+    scanner yields them; they are sorted by name within it.
+
+    :returns: Number of entries written
+    """
+    # The columns grow in memory; only the sorting buffer is per directory
+    columns = {name: array.array(code) for name, code in COLUMNS.items()}
+    names = bytearray()
+    dirs = bytearray()
+    columns['name_offsets'].append(0)
+    columns['dir_offsets'].append(0)
+    current_dir, pending = None, []
+
+    def flush() -> None:
+        if current_dir is None:
+            return
+        columns['dir_starts'].append(len(columns['size']))
+        dirs.extend(_encode(current_dir))
+        columns['dir_offsets'].append(len(dirs))
+        for name, stat in sorted(pending, key=lambda item: item[0]):
+            columns['size'].append(stat.st_size)
+            columns['mtime_ns'].append(stat.st_mtime_ns)
+            columns['ctime_ns'].append(getattr(stat, 'st_ctime_ns', int(stat.st_ctime * 1e9)))
+            columns['inode'].append(stat.st_ino)
+            names.extend(name)
+            columns['name_offsets'].append(len(names))
+
+    for file_path, stat in entries:
+        directory, name = os.path.split(str(file_path))
+        if directory != current_dir:
+            flush()
+            current_dir, pending = directory, []
+        pending.append((_encode(name), stat))
+    flush()
+    columns['dir_starts'].append(len(columns['size']))
+
+    count = len(columns['size'])
+    # Written through memoryviews, not copied again with tobytes() / bytes()
+    blobs = {**{name: memoryview(column).cast('B') for name, column in columns.items()},
+             'names': memoryview(names), 'dirs': memoryview(dirs)}
+    layout, offset = {}, 0
+    for name, data in blobs.items():
+        layout[name] = [offset, data.nbytes]
+        offset += -(-data.nbytes // ALIGN) * ALIGN
+    header = json.dumps({
+        'version': SNAPSHOT_VERSION, 'count': count, 'directories': len(columns['dir_starts']) - 1,
+        'byteorder': sys.byteorder, 'created': time.time(), 'columns': layout
+    }).encode()
+    header += b' ' * (-(len(MAGIC) + 8 + len(header)) % ALIGN)
+
+    target = Path(path).expanduser()
+    tmp = target.with_name(target.name + '.tmp')
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        for data in blobs.values():
+            f.write(data)
+            f.write(b'\0' * (-data.nbytes % ALIGN))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, target)
+    return count
+
+
+class Snapshot:
+    """
+    Read-only, memory-mapped view of a snapshot file.
+    """
+    def __init__(self, path):
+        self.path = Path(path).expanduser()
+        self._file = open(self.path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:   # empty file
+            self._file.close()
+            raise ValueError(f"{path} is not a snapshot file")
+        if self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a snapshot file")
+        size = int.from_bytes(self._map[len(MAGIC):len(MAGIC) + 8], 'little')
+        start = len(MAGIC) + 8
+        self.header = json.loads(self._map[start:start + size])
+        if self.header['version'] != SNAPSHOT_VERSION or self.header['byteorder'] != sys.byteorder:
+            self.close()
+            raise ValueError(f"{path} was written by an incompatible version or machine")
+        data = memoryview(self._map)[start + size:]
+        self._views = [data]
+        self.columns = {}
+        for name, (offset, length) in self.header['columns'].items():
+            view = data[offset:offset + length]
+            self.columns[name] = view.cast(COLUMNS[name]) if name in COLUMNS else view
+            self._views.append(self.columns[name])
+        self._dir_index = None
+
+    def __len__(self) -> int:
+        return self.header['count']
+
+    @property
+    def directory_count(self) -> int:
+        return self.header['directories']
+
+    def directory(self, d: int) -> str:
+        offsets = self.columns['dir_offsets']
+        return _decode(self.columns['dirs'][offsets[d]:offsets[d + 1]])
+
+    def name(self, i: int) -> str:
+        offsets = self.columns['name_offsets']
+        return _decode(self.columns['names'][offsets[i]:offsets[i + 1]])
+
+    def path_of(self, i: int) -> str:
+        d = bisect.bisect_right(self.columns['dir_starts'], i) - 1
+        return os.path.join(self.directory(d), self.name(i))
+
+    def __getitem__(self, i: int) -> FileRecord:
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        c = self.columns
+        return FileRecord(self.path_of(i), c['size'][i], c['mtime_ns'][i], c['ctime_ns'][i], c['inode'][i])
+
+    def __iter__(self) -> Iterator[FileRecord]:
+        c = self.columns
+        starts = c['dir_starts']
+        for d in range(self.directory_count):
+            directory = self.directory(d)
+            for i in range(starts[d], starts[d + 1]):
+                yield FileRecord(os.path.join(directory, self.name(i)), c['size'][i],
+                                 c['mtime_ns'][i], c['ctime_ns'][i], c['inode'][i])
+
+    def find(self, path: str) -> Optional[int]:
+        """Return the index of the entry for path, or None."""
+        if self._dir_index is None:
+            self._dir_index = {}
+            for d in range(self.directory_count):
+                self._dir_index.setdefault(self.directory(d), []).append(d)
+        directory, name = os.path.split(str(path))
+        starts = self.columns['dir_starts']
+        for d in self._dir_index.get(directory, ()):
+            lo, hi = starts[d], starts[d + 1]
+            i = bisect.bisect_left(range(lo, hi), name, key=self.name) + lo
+            if i < hi and self.name(i) == name:
+                return i
+        return None
+
+    def total_size(self) -> int:
+        """Sum of all file sizes, computed on the size column alone."""
+        return sum(self.columns['size'])
+
+    def close(self) -> None:
+        for view in reversed(getattr(self, '_views', [])):
+            view.release()
+        self._views = []
+        self.columns = {}
+        if getattr(self, '_map', None) is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self) -> 'Snapshot':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def save_listing(config: dict, path) -> int:
+    """Scan the monitored folders (paths and stat only) into a snapshot file."""
+    from file_scanner import iter_entries
+    return write_snapshot(path, iter_entries(config))
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Save or inspect a listing snapshot")
+    parser.add_argument("-c", "--config", default="config.yaml", help="Path to YAML configuration file")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('save', help="Scan monitor_folders into a snapshot").add_argument('path')
+    sub.add_parser('info', help="Print a snapshot's size and timings").add_argument('path')
+    args = parser.parse_args(argv)
+    if args.command == 'save':
+        from file_scanner import load_config
+        start = time.perf_counter()
+        count = save_listing(load_config(args.config), args.path)
+        print(f"Saved {count} entries to {args.path} in {time.perf_counter() - start:.2f}s")
+        return 0
+    start = time.perf_counter()
+    with Snapshot(args.path) as snapshot:
+        opened = time.perf_counter() - start
+        print(f"{len(snapshot)} files in {snapshot.directory_count} folders, "
+              f"{snapshot.total_size() / 1024 ** 3:.2f} GB, "
+              f"{os.path.getsize(args.path) / 1024 ** 2:.1f} MB on disk, opened in {opened * 1000:.2f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""
+startup_profile.py
+
+Import-time report for `main.py --startup-profile`:
+- Re-runs the same command in a child interpreter with `-X importtime`
+- Passes the child's normal output through unchanged
+- Prints the total run time, total import time and the slowest imports
+"""
+import subprocess
+import sys
+import time
+
+IMPORTTIME_PREFIX = 'import time:'
+
+
+def parse_importtime(lines) -> list:
+    """
+    Parse `-X importtime` lines into (module, self_us, cumulative_us) tuples.
+    Nested modules keep their leading indentation stripped.
+    """
+    results = []
+    for line in lines:
+        if not line.startswith(IMPORTTIME_PREFIX):
+            continue
+        fields = line[len(IMPORTTIME_PREFIX):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # header line
+        results.append((fields[2].strip(), int(fields[0]), int(fields[1])))
+    return results
+
+
+def format_report(imports: list, wall_seconds: float, top: int = 15) -> str:
+    """
+    Build the human-readable startup report.
+    """
+    # Self times never overlap, so they add up to the total import time
+    total_us = sum(self_us for _, self_us, _ in imports)
+    lines = [
+        f"Startup profile: {wall_seconds:.3f}s wall, {total_us / 1e6:.3f}s importing "
+        f"{len(imports)} modules",
+        f"{'cumulative':>12} {'self':>10}  module",
+    ]
+    slowest = sorted(imports, key=lambda item: item[2], reverse=True)[:top]
+    for module, self_us, cumulative_us in slowest:
+        lines.append(f"{cumulative_us / 1000:>10.1f}ms {self_us / 1000:>8.1f}ms  {module}")
+    return '\n'.join(lines)
+
+
+def run_profiled(argv: list, top: int = 15) -> int:
+    """
+    Run `python <argv>` with import timing and print the report to stderr.
+
+    :param argv: Script path followed by its arguments (without --startup-profile)
+    :returns: The child's exit code
+    """
+    start = time.perf_counter()
+    child = subprocess.Popen(
+        [sys.executable, '-X', 'importtime'] + list(argv),
+        stderr=subprocess.PIPE,
+        text=True
+    )
+    timing_lines = []
+    for line in child.stderr:
+        if line.startswith(IMPORTTIME_PREFIX):
+            timing_lines.append(line)
+        else:
+            sys.stderr.write(line)
+    returncode = child.wait()
+    wall = time.perf_counter() - start
+    print(format_report(parse_importtime(timing_lines), wall, top=top), file=sys.stderr)
+    return returncode
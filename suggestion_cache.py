@@ -0,0 +1,176 @@
+"""
+suggestion_cache.py
+
+Persistent on-disk cache for LLM suggestions:
+- Entries are keyed by file content hash, file name and prompt template hash,
+  so editing the prompt (e.g. via --prompt-file) invalidates old entries
+- Backed by SQLite so it survives restarts
+- Evicts by age and by entry count (least recently used first)
+- Tracks hit/miss counters for the current process
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+DEFAULT_CACHE_PATH = '~/.cache/auto_file_organizer/suggestions.sqlite'
+
+
+def hash_file(file_path, chunk_size: int = 1 << 20) -> str:
+    """
+    Return the SHA-256 hex digest of a file's content, read in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_text(text: str) -> str:
+    """
+    Return the SHA-256 hex digest of a string.
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class SuggestionCache:
+    """
+    SQLite-backed cache mapping (content, name, prompt) keys to suggestion dicts.
+    Safe to share between threads.
+    """
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = 50000,
+                 max_age_days: float = 90):
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS suggestions ("
+            " key TEXT PRIMARY KEY,"
+            " suggestion TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_suggestions_last_used ON suggestions(last_used)"
+        )
+        self._conn.commit()
+        self.evict()
+
+    def make_key(self, file_meta: dict, template: str) -> Optional[str]:
+        """
+        Build the cache key for a file and prompt template.
+        Returns None if the file content cannot be read.
+
+        :param file_meta: Metadata dict from file_scanner.get_file_metadata
+        :param template: Prompt template text used to query the LLM
+        """
+        content_hash = file_meta.get('sha256')
+        if not content_hash:
+            path = file_meta.get('path')
+            if not path:
+                return None
+            try:
+                content_hash = hash_file(path)
+            except OSError:
+                return None
+        parts = (content_hash, file_meta.get('name', ''), hash_text(template))
+        return hash_text('\0'.join(parts))
+
+    def get(self, key: str) -> Optional[dict]:
+        """
+        Return the cached suggestion for key, or None on a miss.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT suggestion FROM suggestions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE suggestions SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, suggestion: dict) -> None:
+        """
+        Store a suggestion under key, replacing any previous entry.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO suggestions (key, suggestion, created_at, last_used)"
+                " VALUES (?, ?, ?, ?)",
+                (key, json.dumps(suggestion), now, now)
+            )
+            self._conn.commit()
+
+    def evict(self) -> int:
+        """
+        Drop entries older than max_age_days, then the least recently used
+        entries beyond max_entries. Returns the number of rows removed.
+        """
+        removed = 0
+        with self._lock:
+            if self.max_age_days:
+                cutoff = time.time() - self.max_age_days * 86400
+                removed += self._conn.execute(
+                    "DELETE FROM suggestions WHERE created_at < ?", (cutoff,)
+                ).rowcount
+            if self.max_entries:
+                removed += self._conn.execute(
+                    "DELETE FROM suggestions WHERE key IN ("
+                    " SELECT key FROM suggestions ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                ).rowcount
+            self._conn.commit()
+        return removed
+
+    def purge(self) -> int:
+        """
+        Remove every entry. Returns the number of rows removed.
+        """
+        with self._lock:
+            removed = self._conn.execute("DELETE FROM suggestions").rowcount
+            self._conn.commit()
+        return removed
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM suggestions").fetchone()[0]
+
+    def stats(self) -> dict:
+        """
+        Return hit/miss counters for this process and the current entry count.
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self)}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def load_cache(config: dict) -> Optional[SuggestionCache]:
+    """
+    Build a SuggestionCache from the `cache` section of config.yaml.
+    Returns None if caching is disabled.
+    """
+    options = config.get('cache') or {}
+    if not options.get('enabled', True):
+        return None
+    return SuggestionCache(
+        path=options.get('path', DEFAULT_CACHE_PATH),
+        max_entries=options.get('max_entries', 50000),
+        max_age_days=options.get('max_age_days', 90)
+    )
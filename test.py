@@ -6,6 +6,7 @@ Run with pytest.
 """
 import os
 import json
+import time
 import shutil
 import tempfile
 from pathlib import Path
@@ -97,5 +98,1293 @@ def test_suggest_actions_json_parse(monkeypatch):
     assert suggestion['suggested_folder'] == 'Docs'
     assert suggestion['delete'] is False
 
+# --- Tests for the suggestion cache ---
+
+class CountingChain:
+    """Stand-in for the LLM chain that counts calls."""
+    def __init__(self, response):
+        self.response = response
+        self.calls = 0
+
+    def run(self, **kwargs):
+        self.calls += 1
+        return json.dumps(self.response)
+
+
+def test_suggestion_cache_skips_llm_for_unchanged_file(tmp_path, sample_text_file, monkeypatch):
+    import organizer
+    from suggestion_cache import SuggestionCache
+    fake = CountingChain({'suggested_name': 'note.txt', 'suggested_folder': 'notes', 'delete': False})
+    monkeypatch.setattr(organizer, 'default_chain', fake)
+    cache = SuggestionCache(path=str(tmp_path / 'cache.sqlite'))
+    fm = get_file_metadata(sample_text_file)
+
+    first = suggest_actions(fm, cache=cache)
+    second = suggest_actions(fm, cache=cache)
+    assert first == second
+    assert fake.calls == 1
+    assert cache.stats()['hits'] == 1
+
+    # A different prompt template must not reuse the entry
+    monkeypatch.setattr(organizer, 'create_chain', lambda prompt: fake)
+    suggest_actions(fm, custom_prompt='Other prompt {name}', cache=cache)
+    assert fake.calls == 2
+
+
+def test_suggestion_cache_eviction_and_purge(tmp_path):
+    from suggestion_cache import SuggestionCache
+    cache = SuggestionCache(path=str(tmp_path / 'cache.sqlite'), max_entries=2)
+    for i in range(4):
+        cache.put(f'k{i}', {'suggested_name': f'f{i}'})
+    assert cache.evict() == 2
+    assert cache.get('k3') == {'suggested_name': 'f3'}
+    assert cache.get('k0') is None
+    assert cache.purge() == 2
+    assert len(cache) == 0
+
+# --- Tests for incremental scanning ---
+
+def test_scan_changes_returns_only_new_changed_and_deleted(tmp_path, tmp_config, sample_text_file):
+    from file_index import FileIndex
+    from file_scanner import scan_changes
+    cfg = load_config(tmp_config)
+    index = FileIndex(path=str(tmp_path / 'index.sqlite'))
+
+    changed, deleted = scan_changes(cfg, index)
+    assert [m['name'] for m in changed] == ['note.txt']
+    assert deleted == []
+    for meta in changed:
+        index.record(meta)
+
+    # Unchanged tree: nothing to do
+    assert scan_changes(cfg, index) == ([], [])
+
+    # Modified and new files are reported, removed files are listed as deleted
+    other = sample_text_file.parent / 'other.txt'
+    other.write_text('new file')
+    st = sample_text_file.stat()
+    os.utime(sample_text_file, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    changed, deleted = scan_changes(cfg, index)
+    assert sorted(m['name'] for m in changed) == ['note.txt', 'other.txt']
+    for meta in changed:
+        index.record(meta)
+    other.unlink()
+    changed, deleted = scan_changes(cfg, index)
+    assert changed == []
+    assert deleted == [str(other)]
+    assert index.lookup(str(other)) is None
+
+# --- Tests for the event-driven watcher ---
+
+def test_change_handler_debounces_and_suppresses_own_moves(tmp_config, sample_text_file, monkeypatch):
+    import file_watcher
+    from watchdog.events import FileCreatedEvent, FileModifiedEvent, FileMovedEvent
+    calls = []
+    import pipeline
+    monkeypatch.setattr(pipeline, "suggest_actions", lambda meta, **kw: calls.append(meta['name']) or {
+        'suggested_name': 'renamed.txt', 'suggested_folder': 'notes', 'delete': False
+    })
+    cfg = load_config(tmp_config)
+    cfg['watch'] = {'debounce_seconds': 5, 'suppress_seconds': 30}
+    handler = file_watcher.ChangeHandler(cfg)
+
+    # A burst of events for the same file, plus a partial download, collapses
+    # into one suggestion once the quiet window has passed
+    path = str(sample_text_file)
+    partial = path + '.crdownload'
+    handler.on_any_event(FileCreatedEvent(partial))
+    handler.on_any_event(FileMovedEvent(partial, path))
+    handler.on_any_event(FileModifiedEvent(path))
+    assert handler.process_ready(now=time.monotonic()) == 0
+    assert handler.process_ready(now=time.monotonic() + 10) == 1
+    assert calls == ['note.txt']
+
+    # The move we just made must not trigger another round
+    new_path = Path(cfg['root_folder']) / 'notes' / 'renamed.txt'
+    assert new_path.exists()
+    handler.on_any_event(FileCreatedEvent(str(new_path)))
+    assert handler.process_ready(now=time.monotonic() + 10) == 0
+    assert calls == ['note.txt']
+
+# --- Tests for the concurrent pipeline ---
+
+def test_token_bucket_waits_for_refill():
+    from rate_limiter import TokenBucket
+    clock = [0.0]
+    slept = []
+    def sleep(seconds):
+        slept.append(seconds)
+        clock[0] += seconds
+    bucket = TokenBucket(60, capacity=2, clock=lambda: clock[0], sleep=sleep)
+    bucket.acquire()
+    bucket.acquire()
+    assert slept == []
+    bucket.acquire()  # empty bucket refills at one token per second
+    assert slept == [pytest.approx(1.0)]
+
+
+def test_suggest_many_keeps_input_order(monkeypatch):
+    import random
+    import pipeline
+    def slow_suggest(meta, **kwargs):
+        time.sleep(random.random() / 100)
+        return {'suggested_name': meta['name'].upper()}
+    monkeypatch.setattr(pipeline, 'suggest_actions', slow_suggest)
+    files = [{'name': f'f{i}'} for i in range(50)]
+    results = list(pipeline.suggest_many(files, concurrency=8))
+    assert [meta['name'] for meta, _ in results] == [f['name'] for f in files]
+    assert all(s['suggested_name'] == m['name'].upper() for m, s in results)
+
+# --- Tests for batched prompts ---
+
+def test_suggest_batch_maps_results_and_retries_malformed_items(monkeypatch):
+    import organizer
+    reply = json.dumps([
+        {'id': 1, 'suggested_name': 'b.txt', 'suggested_folder': 'docs', 'delete': False},
+        {'id': 0, 'suggested_name': 'a.txt'},  # malformed: missing keys
+    ])
+    batch = CountingChain(None)
+    batch.run = lambda **kwargs: reply
+    single = CountingChain({'suggested_name': 'a_retry.txt', 'suggested_folder': 'misc', 'delete': False})
+    monkeypatch.setattr(organizer, 'batch_chain', batch)
+    monkeypatch.setattr(organizer, 'default_chain', single)
+    files = [
+        {'name': 'a', 'size_bytes': 1, 'preview': ''},
+        {'name': 'b', 'size_bytes': 2, 'preview': ''},
+        {'name': 'setup.exe', 'size_bytes': 3, 'preview': ''},
+    ]
+    results = organizer.suggest_batch(files)
+    assert results[0]['suggested_name'] == 'a_retry.txt'
+    assert results[1]['suggested_name'] == 'b.txt'
+    assert results[2]['delete'] is True
+    assert single.calls == 1
+
+
+def test_plan_batches_respects_token_budget():
+    from organizer import BATCH_PROMPT_TEMPLATE, plan_batches
+    from rate_limiter import estimate_tokens
+    short = [{'name': f's{i}', 'preview': 'x' * 10} for i in range(6)]
+    long = [{'name': f'l{i}', 'preview': 'x' * 4000} for i in range(3)]
+    budget = estimate_tokens(BATCH_PROMPT_TEMPLATE) + 1500
+    batches = plan_batches(short + long, max_batch_size=4, token_budget=budget)
+    assert [len(b) for b in batches] == [4, 3, 1, 1]
+    assert [f['name'] for f in batches[1]] == ['s4', 's5', 'l0']
+
+# --- Tests for the preview process pool ---
+
+@pytest.mark.skipif(
+    __import__('multiprocessing').get_start_method() != 'fork',
+    reason="patched preview functions only reach forked workers"
+)
+def test_preview_pool_skips_slow_files(tmp_path, monkeypatch):
+    import file_scanner
+    def slow_pdf(file_path, max_chars=500):
+        import signal
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGALRM})   # stuck in native code
+        time.sleep(30)
+        return 'never'
+    def docx(file_path, max_chars=500):
+        if 'broken' in file_path.name:
+            raise ValueError('corrupt archive')   # must not be retried outside the pool
+        return 'docx text'
+    monkeypatch.setattr(file_scanner, 'preview_pdf', slow_pdf)
+    monkeypatch.setattr(file_scanner, 'preview_docx', docx)
+    (tmp_path / 'huge.pdf').write_bytes(b'%PDF')
+    (tmp_path / 'report.docx').write_bytes(b'PK')
+    (tmp_path / 'z_broken.docx').write_bytes(b'PK')
+    (tmp_path / 'note.txt').write_text('plain text')
+    metas = [get_file_metadata(p, preview=False) for p in sorted(tmp_path.iterdir())]
+
+    pool = file_scanner.PreviewPool(workers=2, timeout_seconds=0.5)
+    try:
+        start = time.monotonic()
+        previews = {m['name']: m['preview'] for m in pool.fill_previews(metas)}
+    finally:
+        pool.close()
+    assert previews == {'huge.pdf': '', 'note.txt': 'plain text', 'report.docx': 'docx text',
+                        'z_broken.docx': ''}
+    assert time.monotonic() - start < 10
+
+# --- Tests for lazy imports and the startup profile ---
+
+def test_importing_core_modules_does_not_load_heavy_dependencies():
+    import subprocess
+    import sys
+    code = (
+        "import sys, main, file_scanner, organizer; "
+        "heavy = ['langchain', 'langchain_community', 'openai', 'PyPDF2', 'docx', "
+        "'pytesseract', 'PIL', 'watchdog']; "
+        "print([m for m in heavy if m in sys.modules])"
+    )
+    env = {k: v for k, v in os.environ.items() if k != 'OPENAI_API_KEY'}
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    assert out.returncode == 0, out.stderr
+    assert out.stdout.strip() == '[]'
+
+
+def test_startup_profile_report():
+    from startup_profile import format_report, parse_importtime
+    lines = [
+        'import time: self [us] | cumulative | imported package\n',
+        'import time:       120 |        120 |   yaml.reader\n',
+        'import time:      1000 |       1500 | yaml\n',
+        'import time:       300 |        300 | organizer\n',
+        'INFO: unrelated output\n',
+    ]
+    imports = parse_importtime(lines)
+    assert imports == [('yaml.reader', 120, 120), ('yaml', 1000, 1500), ('organizer', 300, 300)]
+    report = format_report(imports, wall_seconds=0.25, top=2)
+    assert 'importing 3 modules' in report
+    assert report.splitlines()[2].endswith('yaml')
+    assert len(report.splitlines()) == 4
+
+# --- Tests for the streaming scanner ---
+
+def test_iter_files_recursion_depth_and_excludes(tmp_path):
+    from file_scanner import iter_files
+    inbox = tmp_path / 'inbox'
+    for rel in ['a.txt', '.DS_Store', 'proj/b.txt', 'proj/node_modules/c.txt',
+                'proj/deep/d.txt', 'proj/deep/deeper/e.txt', 'build/f.txt', 'logs/build']:
+        path = inbox / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(rel)
+    cfg = {
+        'monitor_folders': [str(inbox)],
+        'scan': {'recursive': True, 'max_depth': 2,
+                 'exclude': ['node_modules', '.DS_Store', 'build/']},
+    }
+    files = iter_files(cfg)
+    assert not isinstance(files, list)
+    names = sorted(m['name'] for m in files)
+    # build/ only excludes folders, so the file logs/build is kept; e.txt is too deep
+    assert names == ['a.txt', 'b.txt', 'build', 'd.txt']
+
+    cfg['scan']['recursive'] = False
+    assert sorted(m['name'] for m in iter_files(cfg)) == ['a.txt']
+
+
+def test_iter_changes_reports_removed_subfolders(tmp_path):
+    import shutil
+    from file_index import FileIndex
+    from file_scanner import iter_changes
+    inbox = tmp_path / 'inbox'
+    (inbox / 'sub').mkdir(parents=True)
+    (inbox / 'sub' / 'x.txt').write_text('x')
+    (inbox / 'y.txt').write_text('y')
+    cfg = {'monitor_folders': [str(inbox)], 'scan': {'recursive': True}}
+    index = FileIndex(path=str(tmp_path / 'index.sqlite'))
+    for meta in iter_changes(cfg, index):
+        index.record(meta)
+    assert len(index) == 2
+
+    shutil.rmtree(inbox / 'sub')
+    deleted = []
+    assert list(iter_changes(cfg, index, deleted)) == []
+    assert deleted == [str(inbox / 'sub' / 'x.txt')]
+    assert len(index) == 1
+
+# --- Tests for duplicate detection ---
+
+def test_duplicate_decisions_keep_organized_or_oldest_copy(tmp_path, tmp_config, monkeypatch):
+    from duplicates import BLOCK_SIZE, HashIndex, duplicate_decisions
+    import main
+    cfg = load_config(tmp_config)
+    inbox, organized = tmp_path / 'inbox', tmp_path / 'organized'
+    (inbox / 'report.txt').write_text('same content')
+    (inbox / 'report (1).txt').write_text('same content')
+    os.utime(inbox / 'report.txt', (1_000_000, 1_000_000))
+    (organized / 'docs').mkdir()
+    (organized / 'docs' / 'photo.bin').write_bytes(b'p' * 10)
+    (inbox / 'IMG_0001.bin').write_bytes(b'p' * 10)
+    # Large files that differ only in the middle are not duplicates
+    big = bytearray(b'x' * (3 * BLOCK_SIZE))
+    (inbox / 'big1.bin').write_bytes(bytes(big))
+    big[BLOCK_SIZE + 10] = ord('y')
+    (inbox / 'big2.bin').write_bytes(bytes(big))
+
+    index = HashIndex(path=str(tmp_path / 'hashes.sqlite'))
+    decisions = duplicate_decisions(cfg, index)
+    assert sorted(decisions) == [str(inbox / 'IMG_0001.bin'), str(inbox / 'report (1).txt')]
+    assert decisions[str(inbox / 'IMG_0001.bin')]['duplicate_of'] == str(organized / 'docs' / 'photo.bin')
+    assert all(d['delete'] for d in decisions.values())
+
+    # job() deletes duplicates without sending them to the LLM
+    sent = []
+    monkeypatch.setattr('pipeline.suggest_actions', lambda meta, **kw: sent.append(meta['name']) or {
+        'suggested_name': meta['name'], 'suggested_folder': '', 'delete': False
+    })
+    main.job(cfg, hash_index=index)
+    assert not (inbox / 'report (1).txt').exists()
+    assert not (inbox / 'IMG_0001.bin').exists()
+    assert sorted(sent) == ['big1.bin', 'big2.bin', 'report.txt']
+
+def test_later_scans_check_only_scanned_files_against_the_hash_index(tmp_path, tmp_config, monkeypatch):
+    import duplicates, file_watcher, main
+    from duplicates import HashIndex
+    cfg = load_config(tmp_config)
+    cfg['index'] = {'path': str(tmp_path / 'files.sqlite')}
+    inbox, organized = tmp_path / 'inbox', tmp_path / 'organized'
+    monkeypatch.setattr('pipeline.suggest_actions', lambda meta, **kw: {
+        'suggested_name': meta['name'], 'suggested_folder': 'docs', 'delete': False
+    })
+    (inbox / 'report.pdf').write_bytes(b'quarterly numbers')
+    hash_index = HashIndex(path=str(tmp_path / 'hashes.sqlite'))
+    index = main.load_index(cfg)
+    main.job(cfg, index=index, hash_index=hash_index)   # first run walks every folder
+    assert (organized / 'docs' / 'report.pdf').exists()
+
+    walks = []
+    monkeypatch.setattr(duplicates, 'iter_entries', lambda *a, **kw: walks.append(a) or iter(()))
+    (inbox / 'report (1).pdf').write_bytes(b'quarterly numbers')
+    (inbox / 'notes.txt').write_bytes(b'other content')
+    main.job(cfg, index=index, hash_index=hash_index, folders=[str(inbox)])
+    assert walks == []
+    assert not (inbox / 'report (1).pdf').exists()      # copy of the organized file
+    assert (organized / 'docs' / 'notes.txt').exists()
+
+    # The watcher deletes copies of known files too
+    (inbox / 'again.pdf').write_bytes(b'quarterly numbers')
+    handler = file_watcher.ChangeHandler(cfg, hash_index=hash_index)
+    handler.process_paths([str(inbox / 'again.pdf')])
+    assert not (inbox / 'again.pdf').exists()
+    assert (organized / 'docs' / 'report.pdf').exists()
+
+
+def test_watcher_keeps_a_duplicate_whose_delete_was_declined(tmp_path, tmp_config, monkeypatch):
+    import file_watcher, main
+    from duplicates import HashIndex
+    cfg = load_config(tmp_config)
+    cfg['index'] = {'path': str(tmp_path / 'files.sqlite')}
+    cfg['auto_confirm'] = False
+    inbox = tmp_path / 'inbox'
+    (inbox / 'report.pdf').write_bytes(b'quarterly numbers')
+    hash_index = HashIndex(path=str(tmp_path / 'hashes.sqlite'))
+    index = main.load_index(cfg)
+    hash_index.record(main.iter_entries(cfg))
+    hash_index.mark_seeded(cfg)
+    (inbox / 'copy.pdf').write_bytes(b'quarterly numbers')
+    monkeypatch.setattr('builtins.input', lambda prompt: 'n')
+    handler = file_watcher.ChangeHandler(cfg, index=index, hash_index=hash_index)
+    handler.process_paths([str(inbox / 'copy.pdf')])
+    assert (inbox / 'copy.pdf').exists()
+    assert index.lookup(str(inbox / 'copy.pdf')) is None   # asked again on the next scan
+
+    # An error in a batch is logged; the processing thread keeps running
+    monkeypatch.setattr(handler, 'process_ready', lambda: 1 / 0)
+    handler.debounce_seconds = 0.2
+    thread = file_watcher.threading.Thread(target=handler._drain, daemon=True)
+    thread.start()
+    time.sleep(0.2)
+    assert thread.is_alive()
+    handler._stop.set()
+    thread.join(1)
+
+# --- Tests for the rule engine ---
+
+RULES = [
+    {'name': 'mac_metadata', 'glob': '.DS_Store', 'delete': True},
+    {'name': 'screenshots', 'extensions': ['.png'],
+     'regex': r'^Screenshot (?P<date>\d{4}-\d{2}-\d{2}) at (?P<time>[\d.]+)',
+     'rename': 'screenshot_{date}_{time}{ext}', 'folder': 'media/screenshots/{mtime:%Y_%m}'},
+    {'name': 'iphone_photos', 'glob': 'IMG_*.heic', 'folder': 'media/photos/{mtime:%Y}',
+     'rename': '{slug}{ext}'},
+    {'name': 'old_large_videos', 'extensions': ['mp4'], 'min_size': 1000, 'min_age_days': 30,
+     'folder': 'media/videos/archive'},
+]
+
+
+def test_rule_set_matches_first_rule_and_fills_templates():
+    from rules import RuleSet
+    rules = RuleSet(RULES)
+    now = 1_750_000_000.0
+    mtime_ns = int((now - 40 * 86400) * 1e9)
+
+    def meta(name, size=10):
+        return {'name': name, 'size_bytes': size, 'mtime_ns': mtime_ns, 'created_time': ''}
+
+    assert rules.match(meta('.DS_Store'), now)['delete'] is True
+    shot = rules.match(meta('Screenshot 2025-07-18 at 9.43.56 PM.png'), now)
+    assert shot['suggested_name'] == 'screenshot_2025-07-18_9.43.56.png'
+    assert shot['suggested_folder'].startswith('media/screenshots/2025_')
+    assert shot['rule'] == 'screenshots'
+    photo = rules.match(meta('IMG_1234.HEIC'), now)
+    assert photo['suggested_name'] == 'img_1234.heic'
+    assert rules.match(meta('clip.mp4', size=5000), now)['suggested_folder'] == 'media/videos/archive'
+    assert rules.match(meta('clip.mp4', size=10), now) is None
+    assert rules.match(meta('notes.txt'), now) is None
+
+
+def test_rules_answer_before_llm(monkeypatch):
+    import organizer
+    from rules import RuleSet
+    fake = CountingChain({'suggested_name': 'x', 'suggested_folder': 'y', 'delete': False})
+    monkeypatch.setattr(organizer, 'default_chain', fake)
+    fm = {'name': '.DS_Store', 'size_bytes': 6148, 'created_time': '', 'modified_time': '', 'preview': ''}
+    assert suggest_actions(fm, rules=RuleSet(RULES))['delete'] is True
+    assert fake.calls == 0
+
+
+def test_invalid_rule_is_rejected():
+    from rules import RuleSet
+    with pytest.raises(ValueError):
+        RuleSet([{'name': 'no_condition', 'delete': True}])
+
+
+def test_benchmark_smoke(tmp_path, monkeypatch):
+    import bench
+    import organizer
+    for name in ('backend', 'default_chain', 'batch_chain'):
+        monkeypatch.setattr(organizer, name, getattr(organizer, name))
+    home, cwd = tmp_path / 'home', tmp_path / 'cwd'
+    home.mkdir()
+    cwd.mkdir()
+    monkeypatch.setenv('HOME', str(home))
+    monkeypatch.chdir(cwd)
+    results = bench.run_benchmark(files=12, latency=0, seed=1, workdir=str(tmp_path / 'work'),
+                                  config_overrides={'duplicates': {'enabled': False}})
+    assert list(home.iterdir()) == [] and list(cwd.iterdir()) == []   # all state stays in workdir
+    assert set(results['stages']) == {'scan_directories', 'suggest_actions', 'apply_suggestion', 'job'}
+    for stage in results['stages'].values():
+        assert stage['files'] == 12
+        assert stage['files_per_sec'] > 0
+    assert results['stages']['suggest_actions']['p99_ms'] >= results['stages']['suggest_actions']['p50_ms']
+    assert not any(regressed for *_, regressed in bench.compare(results, results))
+
+
+def test_fake_llm_answers_batches():
+    import bench
+    reply = json.loads(bench._fake_reply('Files (JSON array, one object per file):\n'
+                                         '[{"id": 3, "name": "a.txt"}, {"id": 7, "name": "b.txt"}]'))
+    assert [item['id'] for item in reply] == [3, 7]
+
+
+def test_metrics_render_and_summary():
+    from metrics import Metrics
+    registry = Metrics()
+    registry.inc('moves_total')
+    registry.inc('errors_total', stage='move')
+    registry.observe('preview_seconds', 0.25, ext='.pdf')
+    registry.observe('preview_seconds', 0.75, ext='.pdf')
+    text = registry.render_prometheus()
+    assert 'afo_moves_total 1' in text
+    assert 'afo_errors_total{stage="move"} 1' in text
+    assert 'afo_preview_seconds_count{ext=".pdf"} 2' in text
+    assert 'afo_preview_seconds_sum{ext=".pdf"} 1.000000' in text
+    assert 'preview_seconds{ext=".pdf"}: 1.000s total, 2 calls' in registry.summary()
+
+
+def test_metrics_record_llm_and_moves(tmp_path, monkeypatch):
+    import organizer
+    from metrics import metrics
+    metrics.reset()
+    fake = CountingChain({'suggested_name': 'b.txt', 'suggested_folder': 'docs', 'delete': False})
+    monkeypatch.setattr(organizer, 'default_chain', fake)
+    f = tmp_path / 'a.txt'
+    f.write_text('hello')
+    fm = {'path': str(f), 'name': 'a.txt', 'size_bytes': 5, 'created_time': '', 'modified_time': '', 'preview': 'hello'}
+    suggestion = suggest_actions(fm)
+    apply_suggestion(fm, suggestion, root_folder=str(tmp_path / 'out'), auto_confirm=True)
+    assert metrics.counter('llm_requests_total', kind='single') == 1
+    assert metrics.counter('llm_tokens_in_total') > 0
+    assert metrics.counter('moves_total') == 1
+    assert metrics.snapshot()['timers'][('llm_request_seconds', (('kind', 'single'),))][0] == 1
+
+
+def test_metrics_endpoint():
+    import urllib.request
+    from metrics import Metrics, start_metrics_server
+    registry = Metrics()
+    registry.inc('deletes_total', 3)
+    server = start_metrics_server(registry, port=0)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        body = urllib.request.urlopen(url, timeout=5).read().decode()
+        assert 'afo_deletes_total 3' in body
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+# --- Tests for the batch plan executor ---
+
+def _meta(path):
+    return {'path': str(path), 'name': Path(path).name}
+
+
+def test_build_plan_resolves_collisions(tmp_path):
+    from plan import build_plan
+    inbox, out = tmp_path / 'inbox', tmp_path / 'out'
+    inbox.mkdir()
+    (out / 'docs').mkdir(parents=True)
+    (out / 'docs' / 'report.txt').write_text('already organized')
+    a, b, c = (inbox / name for name in ('a.txt', 'b.txt', 'c.txt'))
+    same = {'suggested_name': 'report.txt', 'suggested_folder': 'docs', 'delete': False}
+    plan = build_plan([
+        (_meta(a), same),
+        (_meta(b), same),
+        (_meta(c), {'suggested_name': 'c.txt', 'suggested_folder': 'new/deep', 'delete': False}),
+        (_meta(inbox / 'x.dmg'), {'suggested_name': 'x.dmg', 'suggested_folder': '', 'delete': True}),
+    ], root_folder=str(out))
+    assert [Path(action['dst']).name for action in plan.actions if action['op'] == 'move'] == \
+        ['report_1.txt', 'report_2.txt', 'c.txt']
+    assert plan.actions[-1]['op'] == 'delete'
+    assert plan.directories == [str(out / 'new' / 'deep')]
+
+
+def test_plan_journal_resume_and_undo(tmp_path):
+    from plan import PlanJournal, build_plan, execute_plan, latest_journal, resume_plan, undo_plan
+    inbox, out, journals = tmp_path / 'inbox', tmp_path / 'out', tmp_path / 'journal'
+    inbox.mkdir()
+    files = []
+    for i in range(3):
+        f = inbox / f'f{i}.txt'
+        f.write_text(str(i))
+        files.append(f)
+    plan = build_plan([(_meta(f), {'suggested_name': f.name, 'suggested_folder': 'sorted', 'delete': False})
+                       for f in files], root_folder=str(out))
+
+    # Simulate a crash after the first move: the plan is journaled, one action recorded
+    journal = PlanJournal.create(str(journals))
+    calls = []
+    def confirm(action):
+        if calls:
+            raise KeyboardInterrupt
+        calls.append(action)
+        return True
+    with pytest.raises(KeyboardInterrupt):
+        execute_plan(plan, journal, confirm=confirm)
+    assert (out / 'sorted' / 'f0.txt').exists() and files[1].exists()
+
+    pending = latest_journal(str(journals), state='incomplete')
+    moved = resume_plan(pending, auto_confirm=True)
+    assert sorted(p.name for p in moved.values()) == ['f0.txt', 'f1.txt', 'f2.txt']
+    assert not any(f.exists() for f in files)
+    assert latest_journal(str(journals), state='incomplete') is None
+
+    assert undo_plan(latest_journal(str(journals), state='complete')) == 3
+    assert all(f.exists() for f in files)
+    assert not (out / 'sorted').exists()
+
+
+
+def test_plan_journals_are_unique_and_pruning_keeps_interrupted_ones(tmp_path):
+    from plan import Plan, PlanJournal, list_journals
+    journals = str(tmp_path / 'journal')
+    first, second = PlanJournal.create(journals), PlanJournal.create(journals)
+    assert first.path != second.path        # two plans in the same second
+    first.begin(Plan([{'seq': 0, 'op': 'delete', 'src': 'a'}]))   # interrupted
+    first.close()
+    second.begin(Plan([{'seq': 0, 'op': 'delete', 'src': 'b'}]))
+    second.finish()
+    for _ in range(3):
+        PlanJournal.create(journals, keep=2).finish()
+    remaining = list_journals(journals)
+    assert first.path in remaining and second.path not in remaining
+    assert first.load()[0].actions[0]['src'] == 'a'
+
+# --- Tests for the move layer ---
+
+def test_move_file_renames_on_same_device(tmp_path):
+    from mover import move_file
+    src, dst = tmp_path / 'a.bin', tmp_path / 'b.bin'
+    src.write_bytes(b'x' * 1000)
+    inode = src.stat().st_ino
+    move_file(str(src), str(dst))
+    assert not src.exists() and dst.stat().st_ino == inode
+
+
+def test_move_file_copies_across_devices(tmp_path):
+    from mover import move_file
+    src, dst = tmp_path / 'a.bin', tmp_path / 'out' / 'b.bin'
+    dst.parent.mkdir()
+    data = os.urandom(300000)
+    src.write_bytes(data)
+    os.utime(src, (1000000000, 1000000000))
+    move_file(str(src), str(dst), dst_dev=-1)  # pretend dst is on another filesystem
+    assert not src.exists()
+    assert dst.read_bytes() == data
+    assert dst.stat().st_mtime == 1000000000
+    assert [p.name for p in dst.parent.iterdir()] == ['b.bin']  # no temp file left
+
+
+def test_mover_runs_large_cross_device_moves_in_background(tmp_path, monkeypatch):
+    from mover import Mover
+    import threading
+    mover = Mover(background_min_bytes=100)
+    monkeypatch.setattr(mover, '_device', lambda folder: -1)
+    big, small = tmp_path / 'big.bin', tmp_path / 'small.bin'
+    big.write_bytes(b'b' * 1000)
+    small.write_bytes(b's')
+    (tmp_path / 'out').mkdir()
+    done, threads = [], []
+    def on_done(error):
+        done.append(error)
+        threads.append(threading.current_thread().name)
+    assert mover.move(str(big), str(tmp_path / 'out' / 'big.bin'), on_done) is False
+    assert mover.move(str(small), str(tmp_path / 'out' / 'small.bin'), on_done) is True
+    mover.close()
+    assert done == [None, None]
+    assert any(name.startswith('mover') for name in threads)
+    assert (tmp_path / 'out' / 'big.bin').stat().st_size == 1000
+
+
+
+def test_plan_hands_back_large_moves_and_settles_them_later(tmp_path, monkeypatch):
+    import threading
+    import mover as mover_module
+    from mover import Mover
+    from plan import PlanJournal, build_plan, execute_plan
+    mover = Mover(background_min_bytes=100)
+    monkeypatch.setattr(mover, '_device', lambda folder: -1)
+    release = threading.Event()
+    real_move = mover_module.move_file
+    monkeypatch.setattr(mover_module, 'move_file',
+                        lambda src, *a: (src.endswith('big.bin') and release.wait(5), real_move(src, *a)))
+    inbox = tmp_path / 'inbox'
+    inbox.mkdir()
+    (inbox / 'big.bin').write_bytes(b'b' * 1000)
+    (inbox / 'small.txt').write_text('s')
+    plan = build_plan([(_meta(inbox / name), {'suggested_name': name, 'suggested_folder': 'out'})
+                       for name in ('big.bin', 'small.txt')], root_folder=str(tmp_path))
+    journal = PlanJournal.create(str(tmp_path / 'journal'))
+    completed = []
+    moved = execute_plan(plan, journal, auto_confirm=True, mover=mover, on_complete=completed.append)
+    # The small file is in place while the large copy is still running
+    assert list(moved) == [str(inbox / 'small.txt')] and completed == []
+    assert journal.load()[2] == 'incomplete'
+    release.set()
+    mover.close()
+    assert sorted(Path(p).name for p in completed[0]) == ['big.bin', 'small.txt']
+    assert journal.load()[2] == 'complete'
+
+
+# --- Tests for image OCR ---
+
+def test_image_ocr_skips_blank_downscales_and_caches(tmp_path, monkeypatch):
+    import pytesseract
+    from PIL import Image, ImageDraw
+    from ocr import ImageOcr
+    sizes = []
+    monkeypatch.setattr(pytesseract, 'image_to_string', lambda img: sizes.append(img.size) or 'INVOICE 2025')
+
+    blank = tmp_path / 'blank.png'
+    Image.new('RGB', (1500, 1000), (200, 200, 200)).save(blank)
+    shot = tmp_path / 'shot.png'
+    img = Image.new('RGB', (1600, 900), 'white')
+    draw = ImageDraw.Draw(img)
+    for y in range(0, 900, 16):
+        draw.text((10, y), 'Invoice number 12345 total due ' * 6, fill='black')
+    img.save(shot)
+
+    ocr = ImageOcr(max_dimension=400, cache_path=str(tmp_path / 'ocr.sqlite'))
+    assert ocr.extract(blank) == ''
+    assert sizes == []
+    assert ocr.extract(shot) == 'INVOICE 2025'
+    assert max(sizes[0]) == 400
+    # Same content under another name comes from the cache
+    copy = tmp_path / 'copy.png'
+    shutil.copyfile(shot, copy)
+    assert ocr.extract(copy) == 'INVOICE 2025'
+    assert len(sizes) == 1
+
+
+# --- Tests for bounded PDF and DOCX previews ---
+
+def test_preview_docx_streams_paragraphs_until_max_chars(tmp_path):
+    from docx import Document
+    from file_scanner import preview_docx
+    doc = Document()
+    doc.add_paragraph('Quarterly report')
+    for i in range(2000):
+        doc.add_paragraph(f'Paragraph {i} ' * 10)
+    path = tmp_path / 'long.docx'
+    doc.save(path)
+    preview = preview_docx(path, max_chars=100)
+    assert preview.startswith('Quarterly report\nParagraph 0 ')
+    assert len(preview) == 100
+    # The byte cap stops reading the XML early, keeping what was parsed so far
+    assert len(preview_docx(path, max_chars=10 ** 6, max_bytes=64 * 1024)) < 64 * 1024
+
+
+def test_preview_pdf_loads_first_pages_within_byte_cap(tmp_path):
+    import bench
+    from PyPDF2 import PdfReader, PdfWriter
+    from file_scanner import preview_pdf
+    bench._write_pdf(tmp_path / 'one.pdf', 'first page')
+    bench._write_pdf(tmp_path / 'two.pdf', 'other page')
+    writer = PdfWriter()
+    writer.add_page(PdfReader(str(tmp_path / 'one.pdf')).pages[0])
+    for _ in range(300):
+        writer.add_page(PdfReader(str(tmp_path / 'two.pdf')).pages[0])
+    with open(tmp_path / 'long.pdf', 'wb') as f:
+        writer.write(f)
+    assert preview_pdf(tmp_path / 'long.pdf') == 'first pageother page'
+    assert preview_pdf(tmp_path / 'long.pdf', max_bytes=1000) == ''
+
+
+# --- Tests for the index of past decisions ---
+
+def test_naming_pattern_carries_numbers_over():
+    from decision_index import apply_pattern, naming_pattern
+    pattern = naming_pattern('Invoice ACME 2025-03.pdf', 'acme_invoice_2025_03.pdf')
+    assert apply_pattern(pattern, 'Invoice ACME 2025-04.pdf') == 'acme_invoice_2025_04.pdf'
+    assert apply_pattern(naming_pattern('Weekly Report.docx', 'weekly_report.docx'), 'Weekly Notes.docx') == 'weekly_notes.docx'
+    assert naming_pattern('Report.pdf', 'report_2024.pdf') is None  # number not from the name
+
+
+def test_decision_index_reuses_similar_decisions(tmp_path):
+    from decision_index import DecisionIndex
+    path = str(tmp_path / 'decisions.sqlite')
+    preview = 'ACME Corporation invoice number total amount due payment terms net 30 days'
+    march = {'path': '/in/a.pdf', 'name': 'Invoice ACME 2025-03.pdf', 'preview': preview + ' march'}
+    april = {'path': '/in/b.pdf', 'name': 'Invoice ACME 2025-04.pdf', 'preview': preview + ' april'}
+    photo = {'path': '/in/c.pdf', 'name': 'holiday.pdf', 'preview': 'beach sunset family trip'}
+    index = DecisionIndex(path, threshold=0.8)
+    assert index.lookup(april, 'prompt') is None
+    decision = {'suggested_name': 'acme_invoice_2025_03.pdf', 'suggested_folder': 'finance/acme/2025', 'delete': False}
+    assert index.learn([(march, decision)], {'/in/a.pdf': Path('/out/x.pdf')}, 'prompt') == 1
+    index.close()
+
+    index = DecisionIndex(path, threshold=0.8)  # persisted
+    hit = index.lookup(april, 'prompt')
+    assert hit['suggested_name'] == 'acme_invoice_2025_04.pdf'
+    assert hit['suggested_folder'] == 'finance/acme/2025'
+    assert index.lookup(photo, 'prompt') is None
+    assert index.lookup(april, 'another prompt') is None
+    assert index.stats()['hits'] == 1 and index.stats()['lookups'] == 3
+
+
+
+def test_decision_index_ignores_files_without_preview_and_content_words(tmp_path):
+    from decision_index import DecisionIndex, naming_pattern
+    index = DecisionIndex(str(tmp_path / 'd.sqlite'), threshold=0.8)
+    photo = {'path': '/in/IMG_0412.JPG', 'name': 'IMG_0412.JPG', 'preview': ''}
+    moved = {'/in/IMG_0412.JPG': Path('/out/p.jpg')}
+    paris = {'suggested_name': 'paris_eiffel_tower_0412.jpg', 'suggested_folder': 'travel/paris_2024'}
+    assert naming_pattern('IMG_0412.JPG', 'paris_eiffel_tower_0412.jpg') is None
+    assert index.learn([(photo, paris)], moved, 'prompt') == 0
+    # Even a name-preserving decision is not reused for a file without preview text
+    keep = {'suggested_name': 'IMG_0412.JPG', 'suggested_folder': 'travel/paris_2024'}
+    assert index.learn([(photo, keep)], moved, 'prompt') == 0
+    assert index.lookup(dict(photo, path='/in/IMG_9981.JPG', name='IMG_9981.JPG'), 'prompt') is None
+    assert len(index) == 0
+
+def test_similar_decision_skips_llm(tmp_path, monkeypatch):
+    import organizer
+    from decision_index import DecisionIndex
+    fake = CountingChain({'suggested_name': 'x.txt', 'suggested_folder': 'y', 'delete': False})
+    monkeypatch.setattr(organizer, 'default_chain', fake)
+    index = DecisionIndex(str(tmp_path / 'd.sqlite'))
+    meta = {'path': '/in/w1.txt', 'name': 'weekly report 1.txt', 'preview': 'team status update',
+            'size_bytes': 10, 'created_time': '', 'modified_time': ''}
+    index.add(meta, {'suggested_name': 'weekly_report_1.txt', 'suggested_folder': 'reports', 'delete': False},
+              organizer.DEFAULT_PROMPT_TEMPLATE)
+    suggestion = suggest_actions(dict(meta, name='weekly report 2.txt'), decisions=index)
+    assert suggestion['suggested_name'] == 'weekly_report_2.txt'
+    assert fake.calls == 0
+
+# --- Tests for the durable work queue ---
+
+def test_work_queue_leases_retries_and_dead_letters(tmp_path):
+    from work_queue import WorkQueue
+    queue = WorkQueue(str(tmp_path / 'q.sqlite'), visibility_timeout=60, max_attempts=2, retry_delay=10)
+    assert queue.enqueue(['/in/a', '/in/b'], now=0) == 2
+    assert queue.enqueue(['/in/a'], now=0) == 0            # already pending
+    first = queue.lease('w1', limit=1, now=1)
+    assert [t[1:] for t in first] == [('/in/a', 1)]
+    assert [t[1] for t in queue.lease('w2', now=2)] == ['/in/b']  # leased tasks are invisible
+    assert queue.lease('w3', now=30) == []
+    assert queue.fail('w1', first[0][0], 'boom', now=30) is False   # retried after 10 s
+    assert queue.lease('w3', now=35) == [] and len(queue.lease('w3', now=40)) == 1
+    # w2 died: its lease expires and the task is handed out again, then dead-lettered
+    again = queue.lease('w4', now=70)
+    assert [t[1:] for t in again] == [('/in/b', 2)]
+    assert queue.lease('w5', now=200) == []
+    assert sorted(d['path'] for d in queue.dead_letters()) == ['/in/a', '/in/b']
+    assert queue.stats()['dead'] == 2
+    assert queue.enqueue(['/in/a'], now=200) == 0          # dead letters wait for requeue_dead
+    assert queue.requeue_dead(now=200) == 2 and queue.active(now=200) == 2
+
+
+def test_work_queue_settles_only_the_current_lease(tmp_path):
+    from work_queue import WorkQueue
+    queue = WorkQueue(str(tmp_path / 'q.sqlite'), visibility_timeout=60, max_attempts=3)
+    queue.enqueue(['/in/a'], now=0)
+    (task_id, _, _), = queue.lease('w1', now=0)
+    assert [t[1:] for t in queue.lease('w2', now=61)] == [('/in/a', 2)]  # w1 stalled
+    assert queue.complete('w1', [task_id], now=62) == 0
+    assert queue.fail('w1', task_id, 'late', now=62) is False
+    assert queue.stats()['leased'] == 1
+    assert queue.complete('w2', [task_id], now=63) == 1
+    assert queue.fail('w2', task_id, 'late', now=64) is False and queue.stats()['done'] == 1
+
+
+def test_work_queue_resumes_after_restart(tmp_path):
+    from work_queue import WorkQueue
+    path = str(tmp_path / 'q.sqlite')
+    queue = WorkQueue(path)
+    queue.enqueue(['/in/a', '/in/b', '/in/c'])
+    done, stuck = queue.lease('w1', limit=2)
+    queue.complete('w1', [done[0]])
+    queue.close()                       # crash with /in/b still leased
+
+    queue = WorkQueue(path)
+    assert queue.release() == 1
+    assert sorted(t[1] for t in queue.lease('w2')) == ['/in/b', '/in/c']
+    assert queue.enqueue(['/in/a']) == 1  # finished files are queued again when they change
+
+
+def test_worker_organizes_leased_files(tmp_path):
+    from work_queue import WorkQueue
+    from worker import Worker, share_limits
+    inbox, root = tmp_path / 'in', tmp_path / 'out'
+    inbox.mkdir()
+    (inbox / 'IMG_0001.JPG').write_bytes(b'x')
+    config = {
+        'monitor_folders': [str(inbox)], 'root_folder': str(root), 'auto_confirm': True,
+        'cache': {'enabled': False}, 'similar': {'enabled': False}, 'plan': {'journal': False},
+        'index': {'path': str(tmp_path / 'index.sqlite')},
+        'rules': [{'name': 'photos', 'glob': 'IMG_*', 'rename': '{slug}{ext}', 'folder': 'photos'}]
+    }
+    queue = WorkQueue(str(tmp_path / 'q.sqlite'))
+    queue.enqueue([str(inbox / 'IMG_0001.JPG'), str(inbox / 'gone.txt')])
+    worker = Worker(config, queue, name='w1')
+    assert worker.run_once() == 2
+    assert (root / 'photos' / 'img_0001.jpg').exists()
+    assert queue.stats()['done'] == 2 and queue.active() == 0
+    assert share_limits({'llm': {'requests_per_minute': 60}}, 4)['llm']['requests_per_minute'] == 15
+
+
+def test_worker_retries_a_file_whose_target_another_worker_took(tmp_path, monkeypatch):
+    import worker as worker_module
+    from work_queue import WorkQueue
+    inbox, root = tmp_path / 'in', tmp_path / 'out'
+    inbox.mkdir()
+    (inbox / 'IMG_0001.JPG').write_bytes(b'mine')
+    config = {
+        'monitor_folders': [str(inbox)], 'root_folder': str(root), 'auto_confirm': True,
+        'cache': {'enabled': False}, 'similar': {'enabled': False}, 'plan': {'journal': False},
+        'index': {'path': str(tmp_path / 'index.sqlite')},
+        'rules': [{'name': 'photos', 'glob': 'IMG_*', 'rename': '{slug}{ext}', 'folder': 'photos'}]
+    }
+    real_build_plan = worker_module.build_plan
+
+    def build_plan_then_lose_the_race(items, **kwargs):
+        plan = real_build_plan(items, **kwargs)
+        (root / 'photos').mkdir(parents=True)
+        (root / 'photos' / 'img_0001.jpg').write_bytes(b'theirs')   # another worker, meanwhile
+        return plan
+
+    monkeypatch.setattr(worker_module, 'build_plan', build_plan_then_lose_the_race)
+    queue = WorkQueue(str(tmp_path / 'q.sqlite'), max_attempts=2, retry_delay=0)
+    queue.enqueue([str(inbox / 'IMG_0001.JPG')])
+    worker = worker_module.Worker(config, queue, name='w1')
+    assert worker.run_once() == 1
+    assert (root / 'photos' / 'img_0001.jpg').read_bytes() == b'theirs'
+    assert (inbox / 'IMG_0001.JPG').read_bytes() == b'mine'
+    assert queue.stats()['pending'] == 1 and queue.stats()['done'] == 0
+    monkeypatch.setattr(worker_module, 'build_plan', real_build_plan)
+    assert worker.run_once() == 1                    # retried: the plan now picks a free name
+    assert (root / 'photos' / 'img_0001_1.jpg').read_bytes() == b'mine'
+    assert queue.stats()['done'] == 1
+
+
+def test_move_file_never_overwrites(tmp_path):
+    from mover import move_file
+    src, dst = tmp_path / 'a.txt', tmp_path / 'b.txt'
+    src.write_text('new')
+    dst.write_text('old')
+    with pytest.raises(FileExistsError):
+        move_file(str(src), str(dst))
+    assert dst.read_text() == 'old' and src.exists()
+
+
+@pytest.mark.parametrize('renameat2', [True, False])
+def test_background_copy_never_overwrites_a_target_created_meanwhile(tmp_path, monkeypatch, renameat2):
+    import mover
+    if not renameat2:
+        monkeypatch.setattr(mover, '_renameat2', False)   # the hard-link fallback
+    src, dst = tmp_path / 'big.bin', tmp_path / 'out.bin'
+    src.write_bytes(b'big' * 1000)
+    real_copy = mover._copy_range
+
+    def copy_while_another_plan_moves(src_fd, dst_fd, size):
+        dst.write_text('moved here meanwhile')
+        real_copy(src_fd, dst_fd, size)
+
+    monkeypatch.setattr(mover, '_copy_range', copy_while_another_plan_moves)
+    m = mover.Mover(background_min_bytes=0)
+    monkeypatch.setattr(m, '_device', lambda folder: -1)   # pretend dst is on another filesystem
+    errors = []
+    assert m.move(str(src), str(dst), on_done=errors.append) is False
+    m.close()
+    assert len(errors) == 1 and isinstance(errors[0], FileExistsError)
+    assert dst.read_text() == 'moved here meanwhile' and src.exists()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['big.bin', 'out.bin']   # no temp file left
+    (tmp_path / 'other.txt').write_text('other')
+    with pytest.raises(FileExistsError):   # same filesystem
+        mover.rename_noreplace(str(tmp_path / 'other.txt'), str(dst))
+    assert dst.read_text() == 'moved here meanwhile'
+
+# --- Tests for the adaptive polling scheduler ---
+
+def test_folder_scheduler_skips_unchanged_folders_and_backs_off(tmp_path):
+    from poll_scheduler import FolderScheduler
+    busy, idle = tmp_path / 'busy', tmp_path / 'idle'
+    busy.mkdir()
+    idle.mkdir()
+    scheduler = FolderScheduler([str(busy), str(idle)], min_interval=10, max_interval=80,
+                                clock=lambda: 0.0)
+    assert scheduler.due(now=0) == [str(busy), str(idle)]   # first check scans everything
+    assert scheduler.due(now=5) == []                      # nothing due yet
+    assert scheduler.due(now=20) == []                     # unchanged: not scanned
+    (busy / 'new.pdf').write_bytes(b'x')
+    os.utime(busy, ns=(busy.stat().st_mtime_ns + 10**9,) * 2)
+    intervals = {s['folder']: s['interval'] for s in scheduler.stats()}
+    assert intervals[str(idle)] == 20                      # doubled after a quiet check
+    assert scheduler.due(now=40) == [str(busy)]
+    intervals = {s['folder']: s['interval'] for s in scheduler.stats()}
+    assert intervals[str(busy)] == 10 and intervals[str(idle)] == 40
+    for now in range(50, 1000, 10):
+        scheduler.due(now=now)
+    assert max(s['interval'] for s in scheduler.stats()) == 80
+    assert scheduler.next_wakeup() <= 1000 + 80
+
+
+def test_folder_scheduler_sees_changes_in_known_subfolders(tmp_path):
+    from poll_scheduler import FolderScheduler
+    sub = tmp_path / 'a' / 'b'
+    sub.mkdir(parents=True)
+    scheduler = FolderScheduler([str(tmp_path)], min_interval=1, recursive=True, clock=lambda: 0.0)
+    assert scheduler.due(now=0) == [str(tmp_path)]
+    assert scheduler.due(now=10) == []
+    (sub / 'report.pdf').write_bytes(b'x')
+    os.utime(sub, ns=(sub.stat().st_mtime_ns + 10**9,) * 2)
+    assert scheduler.due(now=20) == [str(tmp_path)]
+
+# --- Tests for prompt budgeting ---
+
+def test_custom_prompt_chain_is_compiled_once(monkeypatch):
+    import organizer
+    built = []
+    def fake_create_chain(template=None):
+        built.append(template)
+        return CountingChain({'suggested_name': 'x.txt', 'suggested_folder': 'y', 'delete': False})
+    monkeypatch.setattr(organizer, 'create_chain', fake_create_chain)
+    monkeypatch.setattr(organizer, '_chains', {})
+    prompt = 'Organize {name} ({size_bytes}, {created_time}, {modified_time}): {preview}'
+    for i in range(5):
+        suggest_actions({'name': f'f{i}.txt', 'size_bytes': 1, 'preview': ''}, custom_prompt=prompt)
+    assert built == [prompt]
+
+
+def test_long_previews_are_trimmed_to_the_token_budget(monkeypatch):
+    import organizer
+    from metrics import metrics
+    from rate_limiter import estimate_tokens
+    seen = {}
+    fake = CountingChain({'suggested_name': 'x.txt', 'suggested_folder': 'y', 'delete': False})
+    def run(**kwargs):
+        seen.update(kwargs)
+        return json.dumps(fake.response)
+    fake.run = run
+    monkeypatch.setattr(organizer, 'default_chain', fake)
+    metrics.reset()
+    meta = {'name': 'long.txt', 'size_bytes': 1, 'preview': 'word ' * 2000}
+    suggest_actions(meta, token_budget=600)
+    prompt_tokens = estimate_tokens(organizer.DEFAULT_PROMPT_TEMPLATE) + sum(
+        estimate_tokens(str(v)) for v in seen.values())
+    assert prompt_tokens <= 600 and len(seen['preview']) > 100
+    stats = organizer.prompt_token_stats()
+    assert stats['files'] == 1 and stats['previews_trimmed'] == 1
+    assert stats['tokens_per_file'] <= 600
+    # the static part comes first, the file last
+    assert organizer.DEFAULT_PROMPT_TEMPLATE.rstrip().endswith('{preview}')
+    assert organizer.BATCH_PROMPT_TEMPLATE.rstrip().endswith('{files}')
+
+# --- Tests for the structured action log ---
+
+def test_action_log_answers_where_and_recent(tmp_path):
+    import gzip
+    from action_log import ActionLog, recent, where
+    log = ActionLog()
+    log.start(str(tmp_path), max_bytes=2000, keep=50)
+    log.record('scan', files=2)
+    log.record('move', path='/in/Invoice.pdf', dst='/out/finance/invoice.pdf', status='done')
+    for i in range(40):
+        log.record('suggestion', path=f'/in/f{i}.txt', suggested_name=f'f{i}.txt')
+    log.flush()  # rotation happens between batches
+    log.record('move', path='/out/finance/invoice.pdf', dst='/out/archive/invoice.pdf', status='done')
+    log.record('delete', path='/in/setup.exe', status='done')
+    log.close()
+
+    trail = where(str(tmp_path), 'Invoice.pdf')
+    assert [row['dst'] for row in trail[0]] == ['/out/finance/invoice.pdf', '/out/archive/invoice.pdf']
+    assert where(str(tmp_path), '/in/setup.exe')[0][0]['event'] == 'delete'
+    assert where(str(tmp_path), 'unknown.txt') == []
+    assert len(recent(str(tmp_path), 3600, event='move')) == 2
+    assert recent(str(tmp_path), 3600, now=time.time() + 7200) == []
+    rotated = list(tmp_path.glob('actions.main.*.jsonl.gz'))
+    assert rotated
+    with gzip.open(rotated[0], 'rt') as f:
+        assert json.loads(f.readline())['event'] == 'scan'
+
+
+def test_action_log_records_plan_moves(tmp_path):
+    from action_log import action_log, where
+    from plan import build_plan, execute_plan
+    src = tmp_path / 'in' / 'a.txt'
+    src.parent.mkdir()
+    src.write_text('x')
+    action_log.start(str(tmp_path / 'log'))
+    try:
+        items = [({'path': str(src), 'name': 'a.txt'},
+                  {'suggested_name': 'b.txt', 'suggested_folder': 'docs', 'delete': False})]
+        execute_plan(build_plan(items, root_folder=str(tmp_path / 'out')), auto_confirm=True)
+        action_log.flush()
+    finally:
+        action_log.close()
+    assert where(str(tmp_path / 'log'), 'a.txt')[0][0]['dst'] == str(tmp_path / 'out' / 'docs' / 'b.txt')
+
+
+def test_configure_logging_formats_each_line_once(tmp_path, monkeypatch):
+    import logging
+    from action_log import configure_logging
+    monkeypatch.setattr(logging.root, 'handlers', [])
+    listener = configure_logging(str(tmp_path / 'actions.log'), fmt='%(levelname)s: %(message)s')
+    logging.info("Moved a -> b")
+    listener.stop()
+    assert (tmp_path / 'actions.log').read_text() == "INFO: Moved a -> b\n"
+
+# --- Tests for the agent tools ---
+
+def test_agent_session_pages_and_reuses_its_snapshot(tmp_path, monkeypatch):
+    import agent_tools
+    inbox = tmp_path / 'in'
+    inbox.mkdir()
+    for i in range(45):
+        (inbox / f'IMG_{i:03}.JPG').write_text(f'photo {i}')
+    (inbox / 'notes.txt').write_text('meeting notes')
+    config = {
+        'monitor_folders': [str(inbox)], 'root_folder': str(tmp_path / 'out'),
+        'cache': {'enabled': False}, 'similar': {'enabled': False}, 'plan': {'journal': False},
+        'rules': [{'name': 'photos', 'glob': 'IMG_*', 'rename': '{slug}{ext}', 'folder': 'photos'}]
+    }
+    scans = []
+    real_iter_entries = agent_tools.iter_entries
+    monkeypatch.setattr(agent_tools, 'iter_entries', lambda c: scans.append(1) or real_iter_entries(c))
+    session = agent_tools.AgentSession(config, page_size=20)
+
+    page = session.scan_files('')
+    assert '46 files' in page and 'page 1/3' in page
+    assert sum(line.startswith('f') for line in page.splitlines()) == 20
+    assert 'page 3/3' in session.scan_files('page=3')
+    assert 'f46 notes.txt' in session.scan_files('ext=.txt')
+    assert 'meeting notes' in session.file_details('f46')
+    assert session.suggest_actions('f1-f2').splitlines()[0] == 'f1 IMG_000.JPG -> photos/img_000.jpg'
+    assert not session._meta[2].preview_loaded       # dropped once suggested, read again on request
+    session.file_details('f2')
+    assert session._meta[2].preview_loaded
+    assert session.apply_suggestion('f1-f10, f99').startswith('Applied 10 of 10: 10 moved')
+    assert (tmp_path / 'out' / 'photos' / 'img_009.jpg').exists()
+    assert '[applied]' in session.scan_files('')
+    assert scans == [1]
+    session.scan_files('refresh')
+    assert scans == [1, 1]
+    assert isinstance(session.snapshot(), agent_tools.Snapshot)
+    assert agent_tools.parse_handles('f3, f1 f5-f7') == [3, 1, 5, 6, 7]
+    assert agent_tools.parse_handles('f1-f999999999 f5') == list(range(1, agent_tools.MAX_BATCH + 1))
+    assert agent_tools.parse_handles('f7-f999999999, f1', limit=3) == [7, 8, 9]
+    assert session.scan_files('page=next').startswith("Bad page 'next'")
+    session.close()
+
+# --- Tests for saved plans ---
+
+def test_saved_plan_is_applied_without_the_llm_and_skips_changed_files(tmp_path, monkeypatch):
+    import main
+    import organizer
+    from plan_file import PlanWriter, read_plan_file
+    inbox = tmp_path / 'in'
+    inbox.mkdir()
+    for name in ('IMG_1.JPG', 'IMG_2.JPG', 'IMG_3.JPG'):
+        (inbox / name).write_text(name)
+    config = {
+        'monitor_folders': [str(inbox)], 'root_folder': str(tmp_path / 'out'), 'auto_confirm': True,
+        'similar': {'enabled': False}, 'plan': {'journal': False},
+        'rules': [{'name': 'photos', 'glob': 'IMG_*', 'rename': '{slug}{ext}', 'folder': 'photos'}]
+    }
+    with PlanWriter(tmp_path / 'plan.jsonl') as writer:
+        main.job(config, dry_run=True, plan_writer=writer)
+    assert writer.count == 3 and not (tmp_path / 'out').exists()
+    header, entries = read_plan_file(tmp_path / 'plan.jsonl')
+    assert {entry['suggestion']['suggested_folder'] for entry in entries} == {'photos'}
+
+    (inbox / 'IMG_2.JPG').write_text('edited since')
+    (inbox / 'IMG_3.JPG').unlink()
+    monkeypatch.setattr(organizer, 'get_chain', lambda *a, **k: pytest.fail("LLM called"))
+    moved = main.apply_saved_plan(config, str(tmp_path / 'plan.jsonl'))
+    assert list(moved) == [str(inbox / 'IMG_1.JPG')]
+    assert (tmp_path / 'out' / 'photos' / 'img_1.jpg').exists()
+    assert (inbox / 'IMG_2.JPG').exists()
+
+
+def test_saved_plan_keeps_scan_time_identity_and_guards_duplicates(tmp_path):
+    from file_scanner import get_file_metadata
+    from plan_file import PlanWriter, load_plan_items
+    inbox = tmp_path / 'in'
+    inbox.mkdir()
+    for name in ('a.txt', 'copy.txt', 'keeper.txt', 'copy2.txt', 'keeper2.txt'):
+        (inbox / name).write_text('same content')
+    a = inbox / 'a.txt'
+    with PlanWriter(tmp_path / 'plan.jsonl') as writer:
+        [(path, stat)] = writer.scanned([(a, a.stat())])
+        file_meta = get_file_metadata(path, stat)
+        a.write_text('edited while the LLM was thinking')
+        os.utime(a, ns=(stat.st_mtime_ns, stat.st_mtime_ns))
+        writer.add(file_meta, {'suggested_name': 'a.txt', 'suggested_folder': 'docs'})
+        for copy, keeper in (('copy.txt', 'keeper.txt'), ('copy2.txt', 'keeper2.txt')):
+            writer.add({'path': str(inbox / copy), 'name': copy},
+                       {'suggested_name': copy, 'suggested_folder': '', 'delete': True,
+                        'duplicate_of': str(inbox / keeper)})
+    (inbox / 'keeper.txt').unlink()
+    items, skipped = load_plan_items(tmp_path / 'plan.jsonl')
+    assert [meta['name'] for meta, _ in items] == ['copy2.txt']
+    assert sorted(skipped) == [(str(a), 'modified'), (str(inbox / 'copy.txt'), 'kept copy missing')]
+
+# --- Tests for the LLM backend ---
+
+def _stand_in_llm(replies):
+    """Start a local OpenAI-compatible endpoint answering with the given (status, body) list."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    import threading
+    seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'   # keep-alive
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            seen.append((self.path, self.client_address[1]))
+            status, body = replies[min(len(seen), len(replies)) - 1]
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            if status == 429:
+                self.send_header('Retry-After', '0')
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/v1", seen
+
+
+def _use_llm(monkeypatch, llm_options):
+    import organizer
+    for name in ('backend', 'default_chain', 'batch_chain', 'breaker', '_llm_config', 'MODEL_NAME'):
+        monkeypatch.setattr(organizer, name, getattr(organizer, name))
+    organizer.configure_llm({'llm': llm_options})
+    return organizer
+
+
+def test_http_backend_retries_transient_errors_on_one_connection(monkeypatch):
+    answer = {'suggested_name': 'report.txt', 'suggested_folder': 'docs', 'delete': False}
+    server, url, seen = _stand_in_llm([
+        (503, {'error': 'overloaded'}), (429, {'error': 'slow down'}),
+        (200, {'choices': [{'message': {'content': json.dumps(answer)}}]})
+    ])
+    organizer = _use_llm(monkeypatch, {'base_url': url, 'api_key_env': None, 'model': 'local',
+                                       'backoff_seconds': 0.01, 'max_retries': 3})
+    try:
+        fm = {'name': 'scan.txt', 'size_bytes': 10, 'created_time': '', 'modified_time': '', 'preview': 'Q3'}
+        assert organizer.suggest_actions(fm) == answer
+    finally:
+        organizer.reset_chains()
+        server.shutdown()
+    assert [path for path, _ in seen] == ['/v1/chat/completions'] * 3
+    assert len({port for _, port in seen}) == 1   # pooled keep-alive connection
+    assert organizer.MODEL_NAME == 'local'
+
+
+def test_open_circuit_defers_files_instead_of_keeping_them(monkeypatch):
+    from pipeline import suggest_many
+    server, url, seen = _stand_in_llm([(500, {'error': 'down'})])
+    organizer = _use_llm(monkeypatch, {'base_url': url, 'api_key_env': None, 'max_retries': 1,
+                                       'backoff_seconds': 0.01,
+                                       'circuit': {'failure_threshold': 1, 'reset_seconds': 60}})
+    files = [{'path': f'/tmp/f{i}.txt', 'name': f'f{i}.txt', 'preview': ''} for i in range(3)]
+    try:
+        results = list(suggest_many(files, concurrency=1))
+    finally:
+        organizer.reset_chains()
+        server.shutdown()
+    assert [suggestion for _, suggestion in results] == [None, None, None]
+    assert len(seen) == 2                    # one request and its retry, then the circuit opened
+    assert organizer.breaker.state == 'open'
+    assert 0 < organizer.llm_retry_after() <= 60
+
+
+def test_circuit_breaker_probes_once_per_reset_period():
+    from llm_backend import CircuitBreaker
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=10, clock=lambda: now[0])
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow() and breaker.retry_after() == 10
+    now[0] = 10
+    assert breaker.allow() and not breaker.allow()   # a single probe
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.allow()
+
+# --- Tests for compact records and snapshots ---
+
+def test_file_record_reads_like_metadata_and_loads_preview_on_demand(sample_text_file):
+    import pickle
+    record = get_file_metadata(sample_text_file, preview=False)
+    assert not hasattr(record, '__dict__')
+    assert not record.preview_loaded
+    assert record['name'] == 'note.txt' and record.get('sha256') is None
+    assert 'preview' not in {**record} and record == get_file_metadata(sample_text_file, preview=False)
+    assert not record.preview_loaded   # copying and comparing do not read the file
+    assert 'preview' in record and not record.preview_loaded   # membership does not read the file
+    stat = sample_text_file.stat()
+    assert record['size_bytes'] == stat.st_size and record['mtime_ns'] == stat.st_mtime_ns
+    assert record['modified_time'].startswith(time.strftime('%Y-%m-%d', time.localtime(stat.st_mtime)))
+    assert 'Hello world' in record['preview'] and record.preview_loaded
+    assert {**record}['path'] == str(sample_text_file)
+    assert pickle.loads(pickle.dumps(record)) == record
+    with pytest.raises(KeyError):
+        record['size'] = 1
+
+
+def test_snapshot_round_trips_a_listing(tmp_path):
+    from snapshot import Snapshot, save_listing
+    inbox = tmp_path / 'inbox'
+    (inbox / 'sub').mkdir(parents=True)
+    for name in ('b.txt', 'a.txt', 'café.txt', 'sub/c.pdf'):
+        (inbox / name).write_text(name)
+    config = {'monitor_folders': [str(inbox)], 'scan': {'recursive': True}}
+    assert save_listing(config, tmp_path / 'listing.snap') == 4
+
+    with Snapshot(tmp_path / 'listing.snap') as snapshot:
+        assert len(snapshot) == 4 and snapshot.directory_count == 2
+        records = {record['path']: record for record in snapshot}
+        assert set(records) == {str(inbox / name) for name in ('a.txt', 'b.txt', 'café.txt', 'sub/c.pdf')}
+        expected = get_file_metadata(inbox / 'café.txt', preview=False)
+        index = snapshot.find(str(inbox / 'café.txt'))
+        assert snapshot[index] == expected and snapshot[index].to_dict() == expected.to_dict()
+        assert not expected.preview_loaded    # compared without reading the file
+        assert snapshot.find(str(inbox / 'missing.txt')) is None
+        assert snapshot.total_size() == sum(len(name.encode()) for name in ('b.txt', 'a.txt', 'café.txt', 'sub/c.pdf'))
+    (tmp_path / 'other.snap').write_bytes(b'not a snapshot')
+    with pytest.raises(ValueError):
+        Snapshot(tmp_path / 'other.snap')
+
 # To run the tests:
 # pytest -q
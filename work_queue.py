@@ -0,0 +1,297 @@
+"""
+work_queue.py
+
+Durable queue of files waiting to be organized, shared by the scanner or
+watcher (producer) and N worker processes (consumers):
+- One SQLite row per path, in WAL mode so readers never block the writer
+- Workers lease tasks for a visibility timeout; a task whose lease runs out
+  (its worker crashed or was killed) becomes available to the others again
+- Failed tasks are retried with exponential backoff up to max_attempts,
+  then kept in a dead-letter list until requeue_dead is called
+- Survives restarts: pending and leased work is picked up where it stopped
+"""
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable
+
+DEFAULT_QUEUE_PATH = '~/.cache/auto_file_organizer/queue.sqlite'
+DEFAULT_BATCH_SIZE = 16
+DEFAULT_VISIBILITY_TIMEOUT = 600.0
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_DELAY = 30.0
+
+# Finished tasks are dropped after this long; the file index remembers them
+DONE_RETENTION_SECONDS = 3600.0
+
+STATES = ('pending', 'leased', 'done', 'dead')
+
+
+class WorkQueue:
+    """
+    SQLite-backed task queue with leases. Opened separately in each
+    process; safe to share between threads of one process.
+    """
+    def __init__(self, path: str = DEFAULT_QUEUE_PATH,
+                 visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 retry_delay: float = DEFAULT_RETRY_DELAY):
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        # Autocommit mode: transactions are opened explicitly where needed
+        self._conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " path TEXT NOT NULL UNIQUE,"
+            " state TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " available_at REAL NOT NULL,"
+            " lease_until REAL,"
+            " worker TEXT,"
+            " last_error TEXT,"
+            " enqueued_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_state ON tasks(state, available_at)")
+
+    def enqueue(self, paths: Iterable[str], now: float = None) -> int:
+        """
+        Add paths to the queue. A path that is already pending or leased is
+        left alone, and so is a dead-lettered one: only requeue_dead brings
+        it back. A finished one is queued again with a fresh attempt count.
+
+        :returns: Number of paths newly queued
+        """
+        now = time.time() if now is None else now
+        rows = [(str(p), now, now, now) for p in paths]
+        if not rows:
+            return 0
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO tasks (path, state, attempts, available_at, enqueued_at, updated_at)"
+                    " VALUES (?, 'pending', 0, ?, ?, ?)"
+                    " ON CONFLICT(path) DO UPDATE SET state = 'pending', attempts = 0,"
+                    " available_at = excluded.available_at, lease_until = NULL, worker = NULL,"
+                    " last_error = NULL, enqueued_at = excluded.enqueued_at,"
+                    " updated_at = excluded.updated_at"
+                    " WHERE tasks.state = 'done'",
+                    rows
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return self._conn.total_changes - before
+
+    def lease(self, worker: str, limit: int = DEFAULT_BATCH_SIZE, now: float = None) -> list:
+        """
+        Take up to `limit` available tasks for `worker` until the visibility
+        timeout runs out. Tasks whose lease expired count as available;
+        those already out of attempts are moved to the dead-letter list.
+
+        :returns: List of (task id, path, attempt number) tuples
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE tasks SET state = 'dead', last_error = 'lease expired', updated_at = ?"
+                    " WHERE state = 'leased' AND lease_until <= ? AND attempts >= ?",
+                    (now, now, self.max_attempts)
+                )
+                rows = self._conn.execute(
+                    "SELECT id, path, attempts FROM tasks"
+                    " WHERE (state = 'pending' AND available_at <= ?)"
+                    " OR (state = 'leased' AND lease_until <= ?)"
+                    " ORDER BY available_at, id LIMIT ?",
+                    (now, now, limit)
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE tasks SET state = 'leased', attempts = attempts + 1,"
+                    " lease_until = ?, worker = ?, updated_at = ? WHERE id = ?",
+                    [(now + self.visibility_timeout, worker, now, row[0]) for row in rows]
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [(task_id, path, attempts + 1) for task_id, path, attempts in rows]
+
+    def complete(self, worker: str, task_ids: Iterable[int], now: float = None) -> int:
+        """
+        Mark tasks leased by `worker` as done. Tasks whose lease ran out and
+        went to another worker are left to that worker.
+
+        :returns: Number of tasks marked done
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "UPDATE tasks SET state = 'done', lease_until = NULL, updated_at = ?"
+                " WHERE id = ? AND worker = ? AND state = 'leased'",
+                [(now, task_id, worker) for task_id in task_ids]
+            )
+            return self._conn.total_changes - before
+
+    def fail(self, worker: str, task_id: int, error: str, now: float = None) -> bool:
+        """
+        Record a failed attempt of a task leased by `worker`. The task is
+        retried after retry_delay * 2 ** (attempts - 1) seconds, or
+        dead-lettered once it has used max_attempts. Nothing changes if the
+        lease has since gone to another worker.
+
+        :returns: True if the task was dead-lettered
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT attempts FROM tasks WHERE id = ? AND worker = ? AND state = 'leased'",
+                (task_id, worker)
+            ).fetchone()
+            if row is None:
+                return False
+            attempts = row[0]
+            dead = attempts >= self.max_attempts
+            self._conn.execute(
+                "UPDATE tasks SET state = ?, available_at = ?, lease_until = NULL,"
+                " last_error = ?, updated_at = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+                ('dead' if dead else 'pending',
+                 now + self.retry_delay * 2 ** max(0, attempts - 1),
+                 str(error)[:1000], now, task_id, worker)
+            )
+        return dead
+
+    def release(self, task_ids: Iterable[int] = None, now: float = None, delay: float = 0,
+                refund: bool = False) -> int:
+        """
+        Return leased tasks to the queue without waiting for their leases to
+        expire, e.g. on shutdown or at startup when no worker is running.
+        The attempt already counted is kept unless refund is set (the task
+        was not attempted, e.g. because the LLM is down). Releases every
+        lease if task_ids is None.
+
+        :param delay: Seconds before the tasks can be leased again
+        """
+        now = time.time() if now is None else now
+        refund = 1 if refund else 0
+        with self._lock:
+            before = self._conn.total_changes
+            if task_ids is None:
+                self._conn.execute(
+                    "UPDATE tasks SET state = 'pending', lease_until = NULL, worker = NULL,"
+                    " attempts = MAX(0, attempts - ?), available_at = ?, updated_at = ?"
+                    " WHERE state = 'leased'", (refund, now + delay, now)
+                )
+            else:
+                self._conn.executemany(
+                    "UPDATE tasks SET state = 'pending', lease_until = NULL, worker = NULL,"
+                    " attempts = MAX(0, attempts - ?), available_at = ?, updated_at = ?"
+                    " WHERE id = ? AND state = 'leased'",
+                    [(refund, now + delay, now, task_id) for task_id in task_ids]
+                )
+            return self._conn.total_changes - before
+
+    def dead_letters(self) -> list:
+        """
+        Return the dead-lettered tasks as dicts with path, attempts and last_error.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, attempts, last_error, updated_at FROM tasks"
+                " WHERE state = 'dead' ORDER BY updated_at"
+            ).fetchall()
+        return [{'path': path, 'attempts': attempts, 'last_error': error, 'failed_at': failed_at}
+                for path, attempts, error, failed_at in rows]
+
+    def requeue_dead(self, now: float = None) -> int:
+        """
+        Move every dead-lettered task back to pending with a fresh attempt count.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE tasks SET state = 'pending', attempts = 0, available_at = ?,"
+                " last_error = NULL, updated_at = ? WHERE state = 'dead'", (now, now)
+            ).rowcount
+
+    def purge_done(self, older_than: float = DONE_RETENTION_SECONDS, now: float = None) -> int:
+        """
+        Drop tasks that finished more than `older_than` seconds ago.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            return self._conn.execute(
+                "DELETE FROM tasks WHERE state = 'done' AND updated_at < ?", (now - older_than,)
+            ).rowcount
+
+    def stats(self) -> dict:
+        """
+        Return the number of tasks in each state.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall()
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(rows)
+        return counts
+
+    def active(self, now: float = None) -> int:
+        """
+        Return the number of tasks being worked on or ready to be leased now;
+        tasks waiting out a retry delay are not counted.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM tasks WHERE state = 'leased'"
+                " OR (state = 'pending' AND available_at <= ?)", (now,)
+            ).fetchone()[0]
+
+    def __len__(self) -> int:
+        """Number of tasks still to do (pending or leased)."""
+        stats = self.stats()
+        return stats['pending'] + stats['leased']
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def get_queue_options(config: dict) -> dict:
+    """
+    Return the `queue` section of config.yaml with defaults filled in.
+    """
+    options = config.get('queue') or {}
+    return {
+        'path': options.get('path', DEFAULT_QUEUE_PATH),
+        'batch_size': options.get('batch_size', DEFAULT_BATCH_SIZE),
+        'visibility_timeout': options.get('visibility_timeout_seconds', DEFAULT_VISIBILITY_TIMEOUT),
+        'max_attempts': options.get('max_attempts', DEFAULT_MAX_ATTEMPTS),
+        'retry_delay': options.get('retry_delay_seconds', DEFAULT_RETRY_DELAY),
+        'poll_seconds': options.get('poll_seconds', 1.0)
+    }
+
+
+def load_queue(config: dict) -> WorkQueue:
+    """
+    Open the WorkQueue configured in the `queue` section of config.yaml.
+    """
+    options = get_queue_options(config)
+    return WorkQueue(
+        path=options['path'],
+        visibility_timeout=options['visibility_timeout'],
+        max_attempts=options['max_attempts'],
+        retry_delay=options['retry_delay']
+    )
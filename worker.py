@@ -0,0 +1,266 @@
+"""
+worker.py
+
+Worker processes draining the durable work queue (see work_queue.py):
+- Each worker leases a batch of paths, builds their metadata, gets the
+  suggestions and applies them as one journaled plan, then marks the batch
+  done; on an error the batch is retried later
+- Two workers never overwrite each other's targets: a move whose target
+  name was taken meanwhile fails with FileExistsError (see mover.py), and
+  only that file is retried, then dead-lettered
+- Workers build their own caches and indexes and share the configured LLM
+  rate limits evenly
+- Files deferred because the LLM provider is down go back to the queue
+  without using up an attempt, to be leased again once requests resume
+- Started with the spawn method, so they do not inherit the parent's open
+  SQLite connections or threads
+"""
+import copy
+import logging
+import multiprocessing
+import os
+import signal
+from pathlib import Path
+
+from action_log import configure_logging, load_action_log, log_suggestion
+from decision_index import learnable, load_decision_index
+from duplicates import load_hash_index
+from file_index import file_state, load_index
+from file_scanner import iter_metadata
+from metrics import metrics
+from mover import load_mover
+from organizer import DEFAULT_PROMPT_TEMPLATE, configure_llm, llm_retry_after
+from pipeline import get_batching, get_concurrency, suggest_many
+from plan import PlanJournal, build_plan, execute_plan, get_journal_options, plan_item
+from rate_limiter import load_limiter
+from rules import load_rules
+from suggestion_cache import load_cache
+from work_queue import WorkQueue, get_queue_options, load_queue
+
+LOG_FORMAT = '%(asctime)s %(levelname)s: [%(processName)s] %(message)s'
+
+
+def share_limits(config: dict, workers: int) -> dict:
+    """
+    Return a copy of config whose LLM rate limits are divided between
+    `workers` processes, so together they stay within the configured limits.
+    """
+    config = copy.deepcopy(config)
+    options = config.get('llm') or {}
+    for key in ('requests_per_minute', 'tokens_per_minute'):
+        if options.get(key):
+            options[key] = options[key] / max(1, workers)
+    return config
+
+
+class Worker:
+    """
+    Processes leased batches of paths with its own services.
+    """
+    def __init__(self, config: dict, queue: WorkQueue, name: str = 'worker',
+                 dry_run: bool = False, custom_prompt: str = None, use_cache: bool = True):
+        self.config = config
+        self.queue = queue
+        self.name = name
+        self.dry_run = dry_run
+        self.custom_prompt = custom_prompt
+        self.cache = load_cache(config) if use_cache else None
+        self.index = None if dry_run else load_index(config)
+        self.limiter = load_limiter(config)
+        self.rules = load_rules(config)
+        self.decisions = load_decision_index(config)
+        self.hash_index = load_hash_index(config)
+        self.mover = load_mover(config)
+        self.batch_size = get_queue_options(config)['batch_size']
+
+    def run_once(self) -> int:
+        """
+        Lease and process one batch. Returns the number of tasks leased.
+        """
+        tasks = self.queue.lease(self.name, self.batch_size)
+        if tasks:
+            self.process(tasks)
+        return len(tasks)
+
+    def process(self, tasks: list) -> None:
+        """
+        Organize the files of leased tasks and settle each task.
+
+        :param tasks: (task id, path, attempt) tuples from WorkQueue.lease
+        """
+        ids = {}
+        entries = []
+        skipped = []
+        for task_id, path, _ in tasks:
+            entry = self._prepare(path)
+            if entry is None:
+                skipped.append(task_id)
+            else:
+                ids[str(entry[0])] = task_id
+                entries.append(entry)
+        self.queue.complete(self.name, skipped)
+        if not entries:
+            return
+        try:
+            # Settles the tasks of the files it organized, once their moves finish
+            deferred = self._organize(entries, ids)
+        except Exception as e:
+            metrics.inc('errors_total', stage='worker')
+            logging.error(f"Error organizing {len(entries)} queued files: {e}")
+            for task_id in ids.values():
+                if self.queue.fail(self.name, task_id, repr(e)):
+                    metrics.inc('queue_dead_letters_total')
+            return
+        if deferred:
+            delay = max(llm_retry_after(), self.queue.retry_delay)
+            logging.warning(f"LLM unavailable: {len(deferred)} files back in the queue for {delay:.0f}s")
+            self.queue.release([ids[path] for path in deferred], delay=delay, refund=True)
+
+    def _settle(self, task_ids: dict, errors: dict) -> None:
+        # Done, unless the file's move failed (e.g. another worker took its
+        # target name first): those are retried, then dead-lettered
+        self.queue.complete(self.name, [task_id for path, task_id in task_ids.items()
+                                        if path not in errors])
+        for path, error in errors.items():
+            if path in task_ids and self.queue.fail(self.name, task_ids[path], repr(error)):
+                metrics.inc('queue_dead_letters_total')
+
+    def _prepare(self, path: str):
+        # Files that are gone or already processed in their current state need no work
+        file_path = Path(path)
+        try:
+            stat = file_path.stat()
+            if not file_path.is_file():
+                return None
+        except OSError:
+            return None
+        if self.index is not None and self.index.lookup(path) == file_state(stat):
+            return None
+        return file_path, stat
+
+    def _organize(self, entries: list, ids: dict) -> list:
+        # Returns the paths deferred because the LLM was unavailable
+        suggestions = suggest_many(
+            iter_metadata(self.config, entries),
+            custom_prompt=self.custom_prompt,
+            cache=self.cache,
+            limiter=self.limiter,
+            concurrency=get_concurrency(self.config),
+            rules=self.rules,
+            decisions=self.decisions,
+            **get_batching(self.config)
+        )
+        items = []
+        deferred = []
+        for file_meta, suggestion in suggestions:
+            if suggestion is None:
+                deferred.append(file_meta['path'])
+                continue
+            log_suggestion(file_meta, suggestion)
+            # Held until large moves finish: only the decision index needs the preview
+            keep = ('preview',) if self.decisions is not None and learnable(file_meta, suggestion) else ()
+            items.append(plan_item(file_meta, suggestion, keep))
+        task_ids = {file_meta['path']: ids[file_meta['path']] for file_meta, _ in items}
+        if self.dry_run or not items:
+            self._settle(task_ids, {})
+            return deferred
+        plan = build_plan(items, root_folder=self.config.get('root_folder'))
+        options = get_journal_options(self.config)
+        journal = PlanJournal.create(**options) if options and len(plan) else None
+        errors = {}   # source path -> exception, for moves that failed
+
+        def record_moves(moved):
+            # Runs once large background copies are in place too
+            self._record_moves(items, moved, errors)
+            self._settle(task_ids, errors)
+
+        # Not waiting for large cross-device moves: the next batch is leased meanwhile
+        execute_plan(plan, journal, auto_confirm=self.config.get('auto_confirm', False),
+                     mover=self.mover, on_complete=record_moves, errors=errors)
+        if self.index is not None:
+            for file_meta, _ in items:
+                if file_meta['path'] not in errors:
+                    self.index.record(file_meta)
+        return deferred
+
+    def _record_moves(self, items: list, moved: dict, errors: dict) -> None:
+        if self.hash_index is not None:
+            self.hash_index.moved(moved)
+        if self.decisions is not None:
+            self.decisions.learn(items, moved, self.custom_prompt or DEFAULT_PROMPT_TEMPLATE)
+        if self.index is None:
+            return
+        # A failed move leaves the file to retry: not processed in its current state
+        self.index.forget(errors)
+        # Other processes cannot see our moves: record the new location too,
+        # so a watcher queueing it does not get it organized a second time
+        for file_meta, _ in items:
+            new_path = moved.get(file_meta['path'])
+            if new_path is None:
+                continue
+            try:
+                stat = new_path.stat()
+            except OSError:
+                continue
+            self.index.record({**file_meta, 'path': str(new_path), 'inode': stat.st_ino,
+                               'size_bytes': stat.st_size, 'mtime_ns': stat.st_mtime_ns})
+
+def run_worker(config: dict, name: str, stop, parent_pid: int, dry_run: bool = False,
+               custom_prompt: str = None, use_cache: bool = True) -> None:
+    """
+    Entry point of a worker process: drain the queue until `stop` is set
+    or the parent process is gone.
+    """
+    # Ctrl+C reaches the whole process group; the parent decides when we stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    listener = configure_logging(fmt=LOG_FORMAT)
+    configure_llm(config)
+    action_log = load_action_log(config, name=name)
+    queue = load_queue(config)
+    poll = get_queue_options(config)['poll_seconds']
+    worker = Worker(config, queue, name=name, dry_run=dry_run,
+                    custom_prompt=custom_prompt, use_cache=use_cache)
+    logging.info(f"Worker {name} started")
+    while not stop.is_set() and os.getppid() == parent_pid:
+        try:
+            leased = worker.run_once()
+        except Exception as e:  # e.g. the queue database is busy for too long
+            logging.error(f"Worker {name} could not lease tasks: {e}")
+            leased = 0
+        if not leased:
+            stop.wait(poll)
+    worker.mover.close()
+    logging.info(f"Worker {name} stopped")
+    action_log.close()
+    listener.stop()
+
+
+def start_workers(config: dict, count: int, dry_run: bool = False,
+                  custom_prompt: str = None, use_cache: bool = True) -> tuple:
+    """
+    Start `count` worker processes.
+
+    :returns: (processes, stop event); set the event and join the processes to stop them
+    """
+    context = multiprocessing.get_context('spawn')
+    stop = context.Event()
+    config = share_limits(config, count)
+    processes = []
+    for i in range(1, count + 1):
+        # Not daemonic: a worker may start its own preview pool processes
+        process = context.Process(
+            target=run_worker, name=f'worker-{i}',
+            args=(config, f'worker-{i}', stop, os.getpid(), dry_run, custom_prompt, use_cache)
+        )
+        process.start()
+        processes.append(process)
+    return processes, stop
+
+
+def stop_workers(processes: list, stop) -> None:
+    """
+    Ask the workers to finish their current batch and wait for them.
+    """
+    stop.set()
+    for process in processes:
+        process.join()